@@ -0,0 +1,293 @@
+"""Packed, append-only archive of a world's submissions.
+
+Thousands of small submission files make scans slow: a directory listing,
+then an open and a decompress per file. ``pack`` bundles a world's
+submissions into one ``submissions/archive.wsar`` that is read through a
+memory map, so any submission, or any slice of its trace, is a few page
+faults away and nothing is copied or inflated.
+
+    b"WSAR" | version (u8) | padding to 8 bytes
+    member* | footer JSON | trailer
+
+Each member is one submission: its header JSON (the ``.wsub`` header, with
+solver and report as blob references into ``submissions/blobs``), then its
+trace columns uncompressed and 8-byte aligned: float64 times, uint64
+payload offsets, uint8 endpoint codes, packed payloads. The footer lists
+each member's name, source digest and the offset of each of those parts.
+The trailer (footer offset, footer length, CRC-32 of the footer, magic)
+closes the file.
+
+Appending never rewrites existing members: new members, a footer and a
+trailer go after the old trailer. Each footer lists only the members its
+append added and points at the previous footer (offset, length, CRC), so
+footers grow with the number of members rather than being repeated in full
+on every append; opening walks the chain back. If an append is interrupted,
+opening the archive falls back to the last intact trailer.
+A submission packed again after being overwritten gets a new member; name
+lookups return the newest.
+
+    python tools/archive.py pack [--worlds 5 6]
+    python tools/archive.py list world_6/submissions/archive.wsar
+    python tools/archive.py show world_6/submissions/archive.wsar goal_1_agent [--slice 0:10]
+"""
+
+from __future__ import annotations
+
+import argparse
+import glob
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+import numpy as np
+
+import submissions
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORLDS = range(1, 7)
+MAGIC = b"WSAR"
+VERSION = 1
+ARCHIVE_NAME = "archive.wsar"
+_TRAILER = struct.Struct("<QQI4s")
+_PREAMBLE = MAGIC + bytes([VERSION]) + bytes(3)
+
+
+def _pad(n: int) -> bytes:
+    return bytes(-n % 8)
+
+
+class Archive:
+    """A memory-mapped view of an archive's members."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path}: not a submission archive")
+        self.end, self.members, _ = _read_footer(self._map)
+        self._by_name = {m["name"]: i for i, m in enumerate(self.members)}
+        self._blob_dir = os.path.join(os.path.dirname(os.path.abspath(path)), "blobs")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        try:
+            self._map.close()
+        except BufferError:
+            pass  # traces still viewing the map keep it alive until they go
+        self._file.close()
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    def names(self) -> list[str]:
+        """Latest member name per submission, in archive order."""
+        return [m["name"] for i, m in enumerate(self.members) if self._by_name[m["name"]] == i]
+
+    def _member(self, key: int | str) -> dict:
+        return self.members[self._by_name[key] if isinstance(key, str) else key]
+
+    def header(self, key: int | str) -> dict:
+        """The submission metadata; blob fields stay references."""
+        offset, length = self._member(key)["header"]
+        return json.loads(self._map[offset:offset + length])
+
+    def trace(self, key: int | str) -> submissions.Trace:
+        """The trace, with its columns viewing the map directly."""
+        m = self._member(key)
+        desc = self.header(key)["api_trace"]
+        n = m["count"]
+        payload_offset, payload_length = m["payloads"]
+        buf = memoryview(self._map)
+        return submissions.Trace(
+            desc["endpoints"],
+            desc["payloads"],
+            np.frombuffer(buf, dtype=np.uint8, count=n, offset=m["codes"]),
+            np.frombuffer(buf, dtype="<f8", count=n, offset=m["times"]),
+            buf[payload_offset:payload_offset + payload_length],
+            np.frombuffer(buf, dtype="<u8", count=n, offset=m["offsets"]),
+        )
+
+    def load(self, key: int | str) -> dict:
+        """The submission in the structure ``submissions.load`` returns."""
+        submission = self.header(key)
+        submission["api_trace"] = self.trace(key)
+        return submissions._resolve_blobs(submission, self._blob_dir)
+
+
+def _digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _read_footer(buf) -> tuple[int, list[dict], list[int] | None]:
+    """The end of the last intact trailer, every member, and the
+    [offset, length, crc] of the newest footer (None for an empty archive)."""
+    if len(buf) == len(_PREAMBLE):
+        return len(buf), [], None
+    end = len(buf)
+    while end - _TRAILER.size >= len(_PREAMBLE):
+        offset, length, crc, magic = _TRAILER.unpack_from(buf, end - _TRAILER.size)
+        if magic == MAGIC and offset + length == end - _TRAILER.size and zlib.crc32(buf[offset:offset + length]) == crc:
+            return end, _members(buf, [offset, length, crc]), [offset, length, crc]
+        # Step back to the previous place a trailer could end.
+        found = buf.rfind(MAGIC, len(_PREAMBLE), end - 1)
+        if found < 0:
+            break
+        end = found + len(MAGIC)
+    raise ValueError("archive has no intact footer")
+
+
+def _members(buf, footer: list[int]) -> list[dict]:
+    """Every member, walking the footer chain back from ``footer``."""
+    chunks = []
+    while footer is not None:
+        offset, length, crc = footer
+        data = buf[offset:offset + length]
+        if zlib.crc32(data) != crc:
+            raise ValueError(f"footer at {offset} is corrupt")
+        parsed = json.loads(data)
+        chunks.append(parsed["members"])
+        footer = parsed["previous"]
+    return [m for chunk in reversed(chunks) for m in chunk]
+
+
+def _write_member(f, name: str, digest: str, path: str, start: int) -> tuple[dict, int]:
+    """Write the submission at ``path`` as a member at ``start`` of ``f``.
+
+    The trace is read a chunk at a time off the column readers. Every
+    column but the payloads has a known size, so each chunk is written
+    straight to its place in each column. Returns the member's footer entry
+    and where the member ends.
+    """
+    header, chunks = submissions.stream_columns(path)
+    header = submissions.store_blobs(header, os.path.join(os.path.dirname(os.path.abspath(path)), "blobs"))
+    n = header["api_trace"]["count"]
+    head = json.dumps(header, separators=(",", ":")).encode()
+    entry = {"name": name, "digest": digest, "count": n, "header": [start, len(head)]}
+    f.seek(start)
+    f.write(head + _pad(len(head)))
+    pos = f.tell()
+    widths = {"times": 8, "offsets": 8, "codes": 1}
+    for key, width in widths.items():
+        entry[key] = pos
+        f.seek(pos + width * n)
+        f.write(_pad(width * n))
+        pos = f.tell()
+    done = written = 0
+    for trace in chunks:
+        for key, column in (
+            ("times", np.asarray(trace.times, dtype="<f8")),
+            ("offsets", np.asarray(trace.offsets, dtype="<u8") + np.uint64(written)),
+            ("codes", np.asarray(trace.codes, dtype=np.uint8)),
+        ):
+            f.seek(entry[key] + widths[key] * done)
+            f.write(column.tobytes())
+        f.seek(pos + written)
+        f.write(trace._payloads)
+        done += len(trace)
+        written += len(trace._payloads)
+    entry["payloads"] = [pos, written]
+    f.seek(pos + written)
+    f.write(_pad(written))
+    return entry, f.tell()
+
+
+def append(archive_path: str, paths: list[str]) -> list[str]:
+    """Append the submissions in ``paths`` not already archived unchanged.
+
+    Returns the names of the members appended.
+    """
+    if os.path.exists(archive_path):
+        with open(archive_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            end, members, previous = _read_footer(buf)
+    else:
+        with open(archive_path, "wb") as f:
+            f.write(_PREAMBLE)
+        end, members, previous = len(_PREAMBLE), [], None
+    latest = {m["name"]: m["digest"] for m in members}
+    added, entries = [], []
+    with open(archive_path, "r+b") as f:
+        f.truncate(end)  # drop the tail of an interrupted append, if any
+        f.seek(end)
+        pos = end
+        for path in paths:
+            digest = _digest(path)
+            name = os.path.splitext(os.path.basename(path))[0]
+            if latest.get(name) == digest:
+                continue
+            entry, pos = _write_member(f, name, digest, path, pos)
+            entries.append(entry)
+            latest[name] = digest
+            added.append(name)
+        if added:
+            f.seek(pos)
+            footer = json.dumps({"previous": previous, "members": entries}, separators=(",", ":")).encode()
+            f.write(footer)
+            f.write(_TRAILER.pack(pos, len(footer), zlib.crc32(footer), MAGIC))
+            f.flush()
+            os.fsync(f.fileno())
+    return added
+
+
+def pack(world: int, root: str = ROOT) -> list[str]:
+    directory = os.path.join(root, f"world_{world}", "submissions")
+    paths = sorted(
+        glob.glob(os.path.join(directory, "*" + submissions.EXTENSION))
+        + glob.glob(os.path.join(directory, "*.json"))
+    )
+    if not paths:
+        return []
+    return append(os.path.join(directory, ARCHIVE_NAME), paths)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("pack", help="append new and changed submissions to each world's archive")
+    p.add_argument("--worlds", type=int, nargs="+", default=list(WORLDS))
+    p = sub.add_parser("list", help="list an archive's members")
+    p.add_argument("archive")
+    p = sub.add_parser("show", help="print one archived submission as JSON")
+    p.add_argument("archive")
+    p.add_argument("name")
+    p.add_argument("--slice", help="only trace entries START:STOP")
+    args = parser.parse_args(argv)
+
+    if args.command == "pack":
+        for world in args.worlds:
+            added = pack(world)
+            print(f"world_{world}: appended {len(added)}" + (f" ({', '.join(added)})" if added else ""))
+        return
+    with Archive(args.archive) as archive:
+        if args.command == "list":
+            for m in archive.members:
+                print(f"{m['name']}  {m['count']} calls  {m['digest'][:12]}")
+            return
+        if args.name not in archive.names():
+            sys.exit(f"{args.name}: not in {args.archive}")
+        submission = archive.load(args.name)
+        trace = submission["api_trace"]
+        if args.slice:
+            start, _, stop = args.slice.partition(":")
+            submission["api_trace"] = trace[slice(int(start or 0), int(stop) if stop else None)]
+        else:
+            submission["api_trace"] = list(trace)
+        json.dump(submission, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Loopback TCP vs Unix-domain-socket latency for every world server.
+
+Starts each world's server twice — once on a free TCP port, once on a Unix
+domain socket — and times the /observe and /advance hot paths over a
+keep-alive connection. Prints median and p99 round-trip latency.
+
+    python tools/bench_transport.py [-n 2000] [--worlds 1 5]
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORLDS = range(1, 7)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start(world: int, args: list[str], wal_dir: str) -> subprocess.Popen:
+    # A scratch WAL, so benchmark traffic is never recovered into a real server.
+    return subprocess.Popen(
+        [sys.executable, "server.py", *args],
+        cwd=os.path.join(ROOT, f"world_{world}"),
+        env={**os.environ, "WAL_DIR": wal_dir},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def _wait_ready(client: httpx.Client, proc: subprocess.Popen, timeout: float = 15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with code {proc.returncode}")
+        try:
+            client.post("/reset")
+            return
+        except httpx.TransportError:
+            time.sleep(0.05)
+    raise RuntimeError("server did not start")
+
+
+def _time(call, n: int) -> list[float]:
+    samples = []
+    for _ in range(n):
+        start = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def _summary(samples: list[float]) -> str:
+    samples = sorted(samples)
+    p50 = statistics.median(samples) * 1e6
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1e6
+    return f"{p50:8.0f} {p99:8.0f}"
+
+
+def bench(world: int, transport: str, n: int) -> dict[str, list[float]]:
+    with tempfile.TemporaryDirectory() as tmp:
+        if transport == "uds":
+            path = os.path.join(tmp, "world.sock")
+            proc = _start(world, ["--uds", path], tmp)
+            client = httpx.Client(transport=httpx.HTTPTransport(uds=path), base_url="http://world")
+        else:
+            port = _free_port()
+            proc = _start(world, ["--port", str(port)], tmp)
+            client = httpx.Client(base_url=f"http://127.0.0.1:{port}")
+        try:
+            with client:
+                _wait_ready(client, proc)
+                for _ in range(min(n, 200)):  # warm up
+                    client.get("/observe")
+                return {
+                    "/observe": _time(lambda: client.get("/observe"), n),
+                    "/advance": _time(lambda: client.post("/advance", json={"steps": 1}), n),
+                }
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", type=int, default=2000, help="requests per endpoint (default 2000)")
+    parser.add_argument("--worlds", type=int, nargs="+", default=list(WORLDS))
+    args = parser.parse_args(argv)
+
+    print(f"{'world':>5} {'endpoint':<9} {'transport':<9} {'p50 us':>8} {'p99 us':>8}")
+    for world in args.worlds:
+        for transport in ("tcp", "uds"):
+            for endpoint, samples in bench(world, transport, args.n).items():
+                print(f"{world:>5} {endpoint:<9} {transport:<9} {_summary(samples)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import contextlib
+import os
+
+from fastapi.testclient import TestClient
+import pytest
+
+import replay
+import server_core
+
+
+@pytest.fixture(scope="session")
+def serve(tmp_path_factory):
+    """Load and serve a world's server, once per run; ``serve(n)`` returns (server, client).
+
+    Each world opens its WAL in its own temporary directory, so two worlds
+    served at once never share a file and test runs stay out of world_N/wal.
+    """
+    served = {}
+    with contextlib.ExitStack() as stack:
+
+        def serve(world: int):
+            if world not in served:
+                server = replay.load_world(world)
+                client = TestClient(server.app)
+                server_core.WAL_DIR = str(tmp_path_factory.mktemp(f"wal_{world}"))
+                stack.enter_context(client)  # runs the startup hook, which opens the WAL
+                served[world] = server, client
+            return served[world]
+
+        yield serve
+
+
+@pytest.fixture
+def write_corpus(serve):
+    """``write_corpus(root, {relpath: (goal, agent_id, [(endpoint, payload), ...])})``
+    writes world 6 submissions under ``root``."""
+    server, _ = serve(6)
+
+    def write(root, files):
+        for rel, (goal, agent, calls) in files.items():
+            segment = server_core.LogSegment(server.world.schema)
+            for i, (endpoint, payload) in enumerate(calls):
+                segment.append(endpoint, payload, 1700000000.0 + i)
+            path = os.path.join(root, rel)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            submission = {"goal": goal, "agent_id": agent, "solver": f"# {agent}", "command": "", "report": "", "api_trace": segment, "submitted_at": 5.0}
+            server_core._write_submission(path, submission)
+
+    return write
+
+
+@pytest.fixture
+def calls():
+    """``calls(acts, advances)``: a /reset, then ``acts`` /act and ``advances`` /advance calls."""
+
+    def calls(acts, advances):
+        return [("/reset", None)] + [("/act", {"action": "A", "value": 0.1})] * acts + [("/advance", {"steps": 1})] * advances
+
+    return calls
@@ -0,0 +1,232 @@
+"""Compile every submission's api_trace into one columnar dataset.
+
+The dataset is a directory of ``.npy`` columns, one row per logged call
+across all worlds, loaded memory-mapped so corpus-wide queries are plain
+vectorized NumPy:
+
+    submission  index into meta.json "submissions" (path, world, goal, agent)
+    world, goal, agent       agent is an index into meta.json "agents"
+    seq         position of the call within its submission's trace
+    endpoint    index into meta.json "endpoints"
+    time        call timestamp
+    payload_<key>            one column per payload key seen in any trace
+                             (e.g. payload_action, payload_value, payload_steps);
+                             0, NaN or b"" on rows whose payload lacks the key
+
+Each submission is compiled to a cached part under ``parts/``; a rebuild
+recompiles only submissions whose file changed (by mtime and size), drops
+parts of deleted ones, and re-concatenates only when anything moved.
+
+    python tools/dataset.py build
+    python tools/dataset.py summary
+"""
+
+from __future__ import annotations
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+
+import numpy as np
+
+import submissions
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_DIR = os.path.join(ROOT, "dataset")
+_FIELD_DTYPES = {"q": "<i8", "d": "<f8", "c": "S1"}
+_FILL = {"<i8": 0, "<f8": np.nan, "S1": b""}
+
+
+def _sources(root: str) -> list[str]:
+    paths = glob.glob(os.path.join(root, "world_*", "submissions", "*" + submissions.EXTENSION))
+    paths += glob.glob(os.path.join(root, "world_*", "submissions", "*.json"))
+    return sorted(paths)
+
+
+def _payload_columns(trace: submissions.Trace) -> dict[str, np.ndarray]:
+    """One array per payload key, gathered endpoint by endpoint without a Python loop."""
+    columns: dict[str, np.ndarray] = {}
+    payloads = np.frombuffer(trace._payloads, dtype=np.uint8)
+    offsets = np.asarray(trace.offsets, dtype=np.int64)
+    for code, layout in enumerate(trace._layouts):
+        if layout is None or layout == "json":
+            continue  # JSON payloads have no fixed layout to put in a column
+        fmt, keys = layout
+        dtype = np.dtype([(k, _FIELD_DTYPES[c]) for k, c in zip(keys, fmt.format.lstrip("<"))])
+        rows = np.flatnonzero(trace.codes == code)
+        if not len(rows):
+            continue
+        raw = payloads[offsets[rows, None] + np.arange(dtype.itemsize)]
+        values = raw.view(dtype).reshape(-1)
+        for key in keys:
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = np.full(len(trace), _FILL[dtype[key].str.lstrip("|")], dtype=dtype[key])
+            column[rows] = values[key]
+    return columns
+
+
+def _compile_part(path: str, part: str) -> dict:
+    """Write one submission's columns to ``part``; return its manifest entry.
+
+    The trace is read a chunk at a time off the column readers, so only the
+    compiled columns, never the inflated trace, are held in memory.
+    """
+    header, chunks = submissions.stream_columns(path)
+    desc = header["api_trace"]
+    codes, times, payloads = [], [], []
+    for trace in chunks:
+        codes.append(np.asarray(trace.codes))
+        times.append(np.asarray(trace.times))
+        payloads.append(_payload_columns(trace))
+    columns = {}
+    for key in dict.fromkeys(k for chunk in payloads for k in chunk):
+        dtype = next(chunk[key].dtype for chunk in payloads if key in chunk)
+        fill = _FILL[dtype.str.lstrip("|")]
+        columns[key] = np.concatenate([
+            chunk[key] if key in chunk else np.full(len(c), fill, dtype=dtype) for chunk, c in zip(payloads, codes)
+        ])
+    np.savez(
+        part,
+        codes=np.concatenate(codes) if codes else np.zeros(0, np.uint8),
+        times=np.concatenate(times) if times else np.zeros(0),
+        **{f"payload_{k}": v for k, v in columns.items()},
+    )
+    return {
+        "goal": header["goal"],
+        "agent": header["agent_id"],
+        "count": desc["count"],
+        "endpoints": list(desc["endpoints"]),
+        "payload": {k: v.dtype.str.lstrip("|") for k, v in columns.items()},
+    }
+
+
+def build(out: str = DEFAULT_DIR, root: str = ROOT) -> tuple[int, int]:
+    """Bring the dataset in ``out`` up to date; return (parts rebuilt, parts dropped)."""
+    parts_dir = os.path.join(out, "parts")
+    os.makedirs(parts_dir, exist_ok=True)
+    manifest_path = os.path.join(out, "manifest.json")
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    fresh = {}
+    rebuilt = 0
+    for path in _sources(root):
+        rel = os.path.relpath(path, root)
+        st = os.stat(path)
+        entry = manifest.pop(rel, None)
+        part = os.path.join(parts_dir, hashlib.sha1(rel.encode()).hexdigest() + ".npz")
+        if entry is None or (entry["mtime_ns"], entry["size"]) != (st.st_mtime_ns, st.st_size) or not os.path.exists(part):
+            entry = _compile_part(path, part)
+            entry.update(mtime_ns=st.st_mtime_ns, size=st.st_size, part=os.path.basename(part))
+            entry["world"] = int(os.path.basename(os.path.dirname(os.path.dirname(path))).removeprefix("world_"))
+            rebuilt += 1
+        fresh[rel] = entry
+    for entry in manifest.values():
+        part = os.path.join(parts_dir, entry["part"])
+        if os.path.exists(part):
+            os.remove(part)
+    if rebuilt or manifest or not os.path.exists(os.path.join(out, "meta.json")):
+        _concatenate(out, fresh)
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(fresh, f)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    return rebuilt, len(manifest)
+
+
+def _concatenate(out: str, sources: dict[str, dict]):
+    endpoints = sorted({e for entry in sources.values() for e in entry["endpoints"]})
+    agents = sorted({entry["agent"] for entry in sources.values()})
+    payload_dtypes: dict[str, str] = {}
+    for entry in sources.values():
+        for key, dtype in entry["payload"].items():
+            payload_dtypes.setdefault(key, dtype)
+    endpoint_index = {e: i for i, e in enumerate(endpoints)}
+    agent_index = {a: i for i, a in enumerate(agents)}
+    columns: dict[str, list[np.ndarray]] = {}
+
+    def add(name, values):
+        columns.setdefault(name, []).append(values)
+
+    for i, (rel, entry) in enumerate(sources.items()):
+        n = entry["count"]
+        with np.load(os.path.join(out, "parts", entry["part"])) as part:
+            remap = np.array([endpoint_index[e] for e in entry["endpoints"]] or [0], dtype=np.uint8)
+            add("submission", np.full(n, i, dtype=np.uint32))
+            add("world", np.full(n, entry["world"], dtype=np.uint8))
+            add("goal", np.full(n, entry["goal"], dtype=np.uint16))
+            add("agent", np.full(n, agent_index[entry["agent"]], dtype=np.uint32))
+            add("seq", np.arange(n, dtype=np.uint32))
+            add("endpoint", remap[part["codes"]])
+            add("time", part["times"])
+            for key, dtype in payload_dtypes.items():
+                name = f"payload_{key}"
+                add(name, part[name] if name in part.files else np.full(n, _FILL[dtype], dtype=dtype))
+    for name, chunks in columns.items():
+        tmp = os.path.join(out, f"{name}.tmp.npy")
+        np.save(tmp, np.concatenate(chunks))
+        os.replace(tmp, os.path.join(out, f"{name}.npy"))
+    meta = {
+        "endpoints": endpoints,
+        "agents": agents,
+        "submissions": [
+            {"path": rel, "world": e["world"], "goal": e["goal"], "agent": e["agent"]} for rel, e in sources.items()
+        ],
+        "columns": sorted(columns),
+    }
+    with open(os.path.join(out, "meta.json.tmp"), "w") as f:
+        json.dump(meta, f, indent=1)
+    os.replace(os.path.join(out, "meta.json.tmp"), os.path.join(out, "meta.json"))
+
+
+def load(out: str = DEFAULT_DIR) -> tuple[dict, dict[str, np.ndarray]]:
+    """The dataset's metadata and its columns, memory-mapped."""
+    with open(os.path.join(out, "meta.json")) as f:
+        meta = json.load(f)
+    columns = {name: np.load(os.path.join(out, f"{name}.npy"), mmap_mode="r") for name in meta["columns"]}
+    return meta, columns
+
+
+def summary(meta: dict, columns: dict[str, np.ndarray]):
+    """Per-world call mix and pacing, as an example of whole-corpus queries."""
+    endpoint = columns["endpoint"]
+    world = columns["world"]
+    code = {e: i for i, e in enumerate(meta["endpoints"])}
+    same = np.diff(columns["submission"]) == 0
+    gaps = np.diff(columns["time"])[same]
+    gap_world = world[1:][same]
+    print(f"{'world':>5} {'subs':>5} {'calls':>7} {'resets':>7} {'obs/act':>8} {'act/adv':>8} {'median dt ms':>13}")
+    for w in np.unique(world):
+        rows = world == w
+        counts = {e: int(np.count_nonzero(rows & (endpoint == i))) for e, i in code.items()}
+        subs = len(np.unique(columns["submission"][rows]))
+        acts, advances = counts.get("/act", 0), counts.get("/advance", 0)
+        world_gaps = gaps[gap_world == w]
+        print(
+            f"{w:>5} {subs:>5} {int(rows.sum()):>7} {counts.get('/reset', 0):>7}"
+            f" {counts.get('/observe', 0) / max(acts, 1):>8.2f} {acts / max(advances, 1):>8.2f}"
+            f" {np.median(world_gaps) * 1e3 if len(world_gaps) else float('nan'):>13.2f}"
+        )
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default=DEFAULT_DIR, help=f"dataset directory (default {os.path.relpath(DEFAULT_DIR)})")
+    parser.add_argument("--root", default=ROOT, help="project root holding the world_* folders")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("build", help="compile new and changed submissions")
+    sub.add_parser("summary", help="build, then print per-world statistics")
+    args = parser.parse_args(argv)
+
+    rebuilt, dropped = build(args.out, args.root)
+    if args.command == "build":
+        print(f"rebuilt {rebuilt} parts, dropped {dropped}")
+    else:
+        summary(*load(args.out))
+
+
+if __name__ == "__main__":
+    main()
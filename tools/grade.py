@@ -0,0 +1,276 @@
+"""Grade every submission by re-simulating its scored episode.
+
+The scored episode is everything after the trace's final /reset. It is
+replayed through the world server's own dynamics (``replay`` with the goal's
+target times as stops), so goals are checked on the true trajectory even
+where the agent never observed, and against the goal table ``GOALS`` in
+that server:
+
+    action      every target's x (and y) at its t, within its tolerance;
+                ``settle`` goals also |x(t + 1) - x(t)| at the last target;
+                the /act budget, via the server's GoalAuditor
+    prediction  the call order, that the prescribed experiment was run,
+                and the prediction's error against the true x at its t
+
+Submissions are graded in a process pool, one per task. Verdicts are cached
+in ``grades.json`` keyed by the SHA-256 of the submission file, stamped with
+digests of the world's server.py and of the grading code (this file,
+replay.py, submissions.py and server_core.py), so a re-run grades only
+new or changed files (or all of a world whose server changed, or
+everything after a grader change).
+
+    python tools/grade.py [--worlds 5 6] [--jobs 8] [--no-cache] [-v]
+"""
+
+from __future__ import annotations
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import glob
+import hashlib
+import itertools
+import json
+import os
+import sys
+import time
+
+import replay
+import server_core
+import submissions
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORLDS = range(1, 7)
+DEFAULT_CACHE = os.path.join(ROOT, "grades.json")
+
+_servers: dict[int, object] = {}  # per process: world -> imported server module
+
+
+def _server(world: int, root: str):
+    if world not in _servers:
+        _servers[world] = replay.load_world(world, root)
+    return _servers[world]
+
+
+def _sources(root: str, worlds) -> list[tuple[int, str]]:
+    found = []
+    for world in worlds:
+        directory = os.path.join(root, f"world_{world}", "submissions")
+        paths = glob.glob(os.path.join(directory, "*" + submissions.EXTENSION))
+        paths += glob.glob(os.path.join(directory, "*.json"))
+        found += [(world, path) for path in sorted(paths)]
+    return found
+
+
+def _digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _grader_digest() -> str:
+    h = hashlib.sha256()
+    for path in (os.path.abspath(__file__), replay.__file__, submissions.__file__, server_core.__file__):
+        h.update(_digest(path).encode())
+    return h.hexdigest()
+
+
+def _within(observed: float, target: float, tol: float) -> bool:
+    # Observations carry 10 decimals, so compare at that precision.
+    return round(abs(observed - target), 10) <= tol
+
+
+def grade(server, submission: dict) -> dict:
+    """The verdict for one loaded submission against ``server``'s goals.
+
+    ``status`` is "pass", "fail", or "unverifiable" when the episode cannot
+    be re-simulated (a trace from before reset seeds were logged).
+    """
+    goal = submission["goal"]
+    verdict = {"goal": goal, "status": "fail", "violations": []}
+    violations = verdict["violations"]
+    spec = server.GOALS.get(goal)
+    if spec is None:
+        violations.append(f"unknown goal {goal}")
+        return verdict
+    resets = submissions.episodes(submission)["resets"]
+    if not resets:
+        violations.append("no /reset in the trace")
+        return verdict
+    episode = submission["api_trace"][resets[-1]:]
+
+    audit = server_core.GoalAuditor(server.GOALS)
+    for entry in episode:
+        audit.record(entry["endpoint"], entry["payload"])
+    violations += audit.verdict(goal)["violations"]
+
+    targets = spec.get("targets", [])
+    experiment = spec.get("experiment")
+    times = {target["t"] for target in targets}
+    if experiment:
+        times.add(experiment["t"])
+    settle_t = targets[-1]["t"] if "settle" in spec else None
+    if settle_t is not None:
+        times.add(settle_t + 1)
+        # The settle check advances one more tick after the run ends.
+        episode = episode + [{"endpoint": "/advance", "payload": {"steps": 1}, "time": None}]
+    check = all(e["payload"] is not None for e in episode if e["endpoint"] == "/observe")
+    seen: dict[int, dict] = {}
+    acts, predictions = [], []
+    try:
+        for i, endpoint, s in server.replay(episode, stops=times, check=check):
+            if s.t in times:
+                seen[s.t] = server.observation(s)
+            if endpoint == "/act":
+                acts.append([s.t, episode[i]["payload"]["action"], episode[i]["payload"]["value"]])
+            elif endpoint == "/predict":
+                predictions.append(episode[i]["payload"])
+    except server_core.ReplayMismatch as e:
+        violations.append(f"trace does not replay: {e}")
+        return verdict
+    except ValueError as e:
+        verdict["status"] = "unverifiable"
+        verdict["reason"] = str(e)
+        return verdict
+    verdict["observations_checked"] = check
+    verdict["observed"] = {str(t): seen[t] for t in sorted(seen)}
+
+    for target in targets:
+        t, tol = target["t"], target["tol"]
+        obs = seen.get(t)
+        if obs is None:
+            violations.append(f"episode never reached t={t}")
+            continue
+        for key in ("x", "y"):
+            if key in target and not _within(obs[key], target[key], tol):
+                violations.append(f"{key}={obs[key]} at t={t}, target {target[key]} ± {tol}")
+    if settle_t is not None and settle_t in seen and settle_t + 1 in seen:
+        drift = abs(seen[settle_t + 1]["x"] - seen[settle_t]["x"])
+        verdict["settle_drift"] = drift
+        if drift >= spec["settle"]:
+            violations.append(f"|x(t={settle_t + 1}) - x(t={settle_t})| = {drift:.6g}, must be < {spec['settle']}")
+    if experiment:
+        t = experiment["t"]
+        prescribed = [[0, action, value] for action, value in experiment["acts"]]
+        if acts != prescribed:
+            violations.append(f"experiment acts {acts}, prescribed {prescribed}")
+        if not predictions:
+            violations.append("no /predict in the episode")
+        elif t not in seen:
+            violations.append(f"experiment never reached t={t}")
+        else:
+            predicted, actual = predictions[-1]["x"], seen[t]["x"]
+            verdict.update(prediction=predicted, actual=actual, error=predicted - actual)
+    if not violations:
+        verdict["status"] = "pass"
+    return verdict
+
+
+def _final_episode(path: str) -> dict:
+    """The submission's metadata with ``api_trace`` cut to its final episode.
+
+    The trace is streamed, so only the scored episode is ever held in memory;
+    a stored episode index lets the calls before it be skipped unparsed.
+    """
+    header, entries = submissions.stream(path)
+    resets = header.pop("episodes", {}).get("resets")
+    if resets:
+        entries = itertools.islice(entries, resets[-1], None)
+    episode: list[dict] = []
+    for entry in entries:
+        if entry["endpoint"] == "/reset":
+            episode = []
+        episode.append(entry)
+    header["api_trace"] = episode
+    return header
+
+
+def grade_file(world: int, path: str, root: str = ROOT) -> dict:
+    """Grade one submission file; runs in a pool worker."""
+    submission = _final_episode(path)
+    verdict = grade(_server(world, root), submission)
+    verdict["agent_id"] = submission["agent_id"]
+    return verdict
+
+
+def _load_cache(path: str) -> dict:
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_cache(path: str, cache: dict):
+    with open(path + ".tmp", "w") as f:
+        json.dump(cache, f)
+    os.replace(path + ".tmp", path)
+
+
+def run(
+    worlds=WORLDS, root: str = ROOT, cache_path: str | None = DEFAULT_CACHE, jobs: int | None = None,
+) -> tuple[dict[str, dict], int]:
+    """Grade every submission in ``worlds``; returns (verdict per path, files graded).
+
+    Files whose content digest, world server digest and grader digest match
+    a cached verdict are not graded again.
+    """
+    cache = _load_cache(cache_path)
+    grader = _grader_digest()
+    code = {
+        world: _digest(os.path.join(root, f"world_{world}", "server.py"))
+        for world in worlds
+        if os.path.exists(os.path.join(root, f"world_{world}", "server.py"))
+    }
+    results: dict[str, dict] = {}
+    pending = []
+    for world, path in _sources(root, worlds):
+        rel = os.path.relpath(path, root)
+        key = _digest(path)
+        entry = cache.get(key)
+        if entry is not None and entry["server"] == code[world] and entry.get("grader") == grader:
+            results[rel] = entry["verdict"]
+        else:
+            pending.append((world, path, rel, key))
+    if pending:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {pool.submit(grade_file, world, path, root): (world, rel, key) for world, path, rel, key in pending}
+            for future in as_completed(futures):
+                world, rel, key = futures[future]
+                results[rel] = verdict = future.result()
+                cache[key] = {"server": code[world], "grader": grader, "verdict": verdict}
+        if cache_path:
+            _save_cache(cache_path, cache)
+    return dict(sorted(results.items())), len(pending)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--worlds", type=int, nargs="+", default=list(WORLDS))
+    parser.add_argument("--root", default=ROOT, help="project root holding the world_* folders")
+    parser.add_argument("--cache", default=DEFAULT_CACHE, help=f"verdict cache (default {os.path.relpath(DEFAULT_CACHE)})")
+    parser.add_argument("--no-cache", action="store_true", help="grade everything and leave the cache alone")
+    parser.add_argument("--jobs", type=int, help="worker processes (default: one per CPU)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print every verdict in full")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    results, graded = run(args.worlds, args.root, None if args.no_cache else args.cache, args.jobs)
+    totals: dict[str, int] = {}
+    for rel, verdict in results.items():
+        status = verdict["status"]
+        totals[status] = totals.get(status, 0) + 1
+        detail = "; ".join(verdict["violations"]) or verdict.get("reason", "")
+        if "error" in verdict:
+            detail = f"predicted {verdict['prediction']}, actual {verdict['actual']}, error {verdict['error']:+.6g}" + (f"; {detail}" if detail else "")
+        print(f"{status:<12} {rel}" + (f": {detail}" if detail else ""))
+        if args.verbose:
+            print(json.dumps(verdict, indent=2))
+    summary = ", ".join(f"{n} {status}" for status, n in sorted(totals.items())) or "no submissions"
+    print(f"graded {graded} of {len(results)} in {time.perf_counter() - start:.2f}s: {summary}")
+    if totals.get("fail"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
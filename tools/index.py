@@ -0,0 +1,166 @@
+"""SQLite index over every world's submissions.
+
+One row per submission file (world, goal, agent_id, submitted_at, trace
+length, solver/report blob digests and the file it came from) plus
+per-endpoint call counts. The index is refreshed incrementally before each
+query: only files whose mtime or size changed are re-read, and rows for
+deleted files are dropped. Re-reading a file streams just its header and
+endpoint codes, so memory does not grow with trace length.
+
+    python tools/index.py update
+    python tools/index.py query [--world 5] [--goal 2] [--agent NAME] [--endpoint /observe]
+    python tools/index.py sql "SELECT world, count(*) FROM submissions GROUP BY world"
+"""
+
+from __future__ import annotations
+
+import argparse
+import glob
+import os
+import sqlite3
+import sys
+
+import submissions
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_DB = os.path.join(ROOT, "submissions.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS submissions (
+    path TEXT PRIMARY KEY,
+    world INTEGER NOT NULL,
+    goal INTEGER NOT NULL,
+    agent_id TEXT NOT NULL,
+    submitted_at REAL,
+    trace_len INTEGER NOT NULL,
+    solver_blob TEXT,
+    report_blob TEXT,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS submissions_world_goal ON submissions (world, goal);
+CREATE TABLE IF NOT EXISTS endpoint_counts (
+    path TEXT NOT NULL REFERENCES submissions (path) ON DELETE CASCADE,
+    endpoint TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (path, endpoint)
+);
+"""
+
+
+def connect(db: str = DEFAULT_DB) -> sqlite3.Connection:
+    conn = sqlite3.connect(db)
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def _submission_files(root: str) -> list[str]:
+    paths = glob.glob(os.path.join(root, "world_*", "submissions", "*.json"))
+    paths += glob.glob(os.path.join(root, "world_*", "submissions", "*" + submissions.EXTENSION))
+    return sorted(paths)
+
+
+def _world(path: str) -> int:
+    return int(os.path.basename(os.path.dirname(os.path.dirname(path))).removeprefix("world_"))
+
+
+def _blob_ref(value) -> str | None:
+    return value["blob"] if isinstance(value, dict) else None
+
+
+def update(conn: sqlite3.Connection, root: str = ROOT) -> tuple[int, int]:
+    """Bring the index up to date; return (files re-indexed, rows removed)."""
+    known = {path: (mtime, size) for path, mtime, size in conn.execute("SELECT path, mtime_ns, size FROM submissions")}
+    changed = 0
+    with conn:
+        for path in _submission_files(root):
+            st = os.stat(path)
+            rel = os.path.relpath(path, root)
+            if known.pop(rel, None) == (st.st_mtime_ns, st.st_size):
+                continue
+            header = submissions.read_header(path)
+            conn.execute("DELETE FROM submissions WHERE path = ?", (rel,))
+            conn.execute(
+                "INSERT INTO submissions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    rel, _world(path), header["goal"], header["agent_id"], header.get("submitted_at"),
+                    header["api_trace"]["count"], _blob_ref(header.get("solver")), _blob_ref(header.get("report")),
+                    st.st_mtime_ns, st.st_size,
+                ),
+            )
+            conn.executemany(
+                "INSERT INTO endpoint_counts VALUES (?, ?, ?)",
+                [(rel, endpoint, count) for endpoint, count in submissions.endpoint_histogram(path).items()],
+            )
+            changed += 1
+        conn.executemany("DELETE FROM submissions WHERE path = ?", [(path,) for path in known])
+    return changed, len(known)
+
+
+def query(
+    conn: sqlite3.Connection,
+    world: int | None = None,
+    goal: int | None = None,
+    agent: str | None = None,
+    endpoint: str | None = None,
+) -> list[tuple]:
+    """Matching submissions with their call count for ``endpoint`` (or all calls)."""
+    where, args = [], []
+    for column, value in (("world", world), ("goal", goal), ("agent_id", agent)):
+        if value is not None:
+            where.append(f"s.{column} = ?")
+            args.append(value)
+    if endpoint is None:
+        calls = "s.trace_len"
+    else:
+        calls = "COALESCE((SELECT count FROM endpoint_counts c WHERE c.path = s.path AND c.endpoint = ?), 0)"
+        args.insert(0, endpoint)
+    sql = f"SELECT s.world, s.goal, s.agent_id, s.submitted_at, {calls}, s.path FROM submissions s"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY s.world, s.goal, s.agent_id"
+    return conn.execute(sql, args).fetchall()
+
+
+def _print_rows(header: list[str], rows: list[tuple]):
+    table = [header] + [["" if v is None else str(v) for v in row] for row in rows]
+    widths = [max(len(row[i]) for row in table) for i in range(len(header))]
+    for row in table:
+        print("  ".join(v.ljust(w) for v, w in zip(row, widths)).rstrip())
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=DEFAULT_DB, help=f"index file (default {os.path.relpath(DEFAULT_DB)})")
+    parser.add_argument("--root", default=ROOT, help="project root holding the world_* folders")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("update", help="re-index new and changed submissions")
+    p = sub.add_parser("query", help="list submissions and their call counts")
+    p.add_argument("--world", type=int)
+    p.add_argument("--goal", type=int)
+    p.add_argument("--agent")
+    p.add_argument("--endpoint", help="count only calls to this endpoint")
+    p = sub.add_parser("sql", help="run a read-only SQL statement against the index")
+    p.add_argument("statement")
+    args = parser.parse_args(argv)
+
+    conn = connect(args.db)
+    changed, removed = update(conn, args.root)
+    if args.command == "update":
+        print(f"indexed {changed} changed submissions, removed {removed}")
+    elif args.command == "query":
+        rows = query(conn, args.world, args.goal, args.agent, args.endpoint)
+        _print_rows(["world", "goal", "agent_id", "submitted_at", args.endpoint or "calls", "path"], rows)
+    else:
+        try:
+            conn.execute("PRAGMA query_only = ON")
+            cursor = conn.execute(args.statement)
+        except sqlite3.Error as e:
+            sys.exit(f"sql error: {e}")
+        _print_rows([d[0] for d in cursor.description or []], cursor.fetchall())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1772 @@
+"""The server infrastructure every world shares.
+
+Each ``world_N/server.py`` holds only its world: the physics, the goal
+table and the payload layouts. It hands its module to ``CopyWorld`` or
+``StoreWorld``, which build everything else: sessions, the API log and its
+write-ahead log, the goal audit, replay, prediction scoring, the REST and
+socket handlers and the /done submission writer. A world module defines
+
+    GOALS        the goal table (agent_briefing.md), as GoalAuditor reads it
+    PAYLOADS     endpoint -> (packed payload layout, payload keys), or None
+                 for no payload; the key order fixes each endpoint's code
+    TICK_DTYPE   one tick-log record: the session tag ("S11"), then the
+                 world's fields
+    State        one session's state
+    reset_state(s, seed)         start an episode from the state ``seed``
+                                 draws; just ``reset_state(s)`` when /reset
+                                 logs no seed (PAYLOADS["/reset"] is None)
+    act_error(action, value)     why an act is invalid, or None
+    apply_act(s, action, value)  clamp and make pending; returns the value
+    observation(s)               what /observe returns
+    same_observation(logged, s)  whether replayed ``s`` reproduces ``logged``
+    format_tick(record)          a tick record as a console line
+
+and either, for ``CopyWorld`` (advances run on a copy of one session's
+State, which has ``copy`` and ``load``):
+
+    consume_action(s)            apply and clear the pending action
+    evolve(s, steps)             advance without touching the tick log
+    advance(s, steps, ticks, tag)  advance and log to ``ticks``; TICK_ECHO
+                                   logs every tick
+
+or, for ``StoreWorld`` (every session is a row of one struct-of-arrays
+store, and queued advances are stepped together), a ``SessionStore``
+subclass of the one here and a ``State`` subclass of ``StoreState``.
+
+The world module then ends with ``world = server_core.CopyWorld(...)`` (or
+``StoreWorld``) and ``app = world.app``.
+"""
+
+from __future__ import annotations
+
+import argparse
+from array import array
+import asyncio
+import atexit
+import contextlib
+from collections import deque
+from collections.abc import Callable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+import fcntl
+import io
+import json
+import mmap
+import os
+import secrets
+import struct
+import threading
+import time
+import zipfile
+import zlib
+
+from fastapi import FastAPI, Header, WebSocket
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+import numpy as np
+from pydantic import BaseModel, Field, ValidationError, create_model
+import uvicorn
+
+import submissions
+
+MAX_SESSIONS = 1024
+MAX_BATCH = 10_000  # commands per /batch
+TICK_ECHO = os.environ.get("TICK_ECHO") == "1"  # record every tick (forces the tick loop)
+TICK_ECHO_RATE = float(os.environ.get("TICK_ECHO_RATE", "50"))  # console tick lines per second, sampled; 0 is off
+TICK_FILE = os.environ.get("TICK_FILE")  # optional file receiving every tick record
+TICK_RING = 1 << 16  # tick records buffered between drains
+TICK_DRAIN_INTERVAL = 0.05  # seconds between tick-log drains
+ADVANCE_WINDOW = 0.0  # seconds; 0 batches advances queued in the same loop iteration
+ADVANCE_BUDGET = float(os.environ.get("ADVANCE_BUDGET", "5.0"))  # wall-clock seconds per /advance
+ADVANCE_CHUNK = 4096  # ticks run between yields to the event loop
+MAX_T = 1 << 62  # ticks since /reset; keeps t and every t + steps inside int64
+WAL_DIR = os.environ.get("WAL_DIR")  # defaults to world_N/wal
+WAL_NAME = os.environ.get("WAL_NAME")  # WAL file name; main() names it after its listener
+WAL_COMMIT_INTERVAL = 0.01  # seconds between group commits of the write-ahead log
+WAL_COMPACT_BYTES = 64 << 20  # the running WAL is compacted each time it grows by this much
+SUBMISSION_QUEUE_BYTES = 256 << 20  # /done submissions held in memory awaiting the writer
+
+
+# --- Tick log ---
+#
+# Ticks never print directly. The simulation writes one fixed-size record per
+# logged tick into a ring buffer and a consumer thread drains it off the hot
+# path: every record goes to TICK_FILE when set, and the console gets an
+# evenly spaced sample of at most TICK_ECHO_RATE lines per second.
+
+
+class TickLog:
+    """Single-producer, single-consumer ring of tick records.
+
+    Only the event loop pushes and only the drainer pops, and each side
+    writes just its own counter (``head`` or ``tail``), so neither takes a
+    lock. A full ring drops new records, counted in ``dropped``, rather than
+    stall the simulation.
+    """
+
+    def __init__(self, capacity: int, dtype: np.dtype):
+        self.capacity = capacity
+        self._ring = np.zeros(capacity, dtype=dtype)
+        self.head = 0  # records pushed; written by the producer only
+        self.tail = 0  # records drained; written by the consumer only
+        self.dropped = 0  # written by the producer only
+
+    def append(self, *fields):
+        """Push one record, given field by field."""
+        if self.head - self.tail >= self.capacity:
+            self.dropped += 1
+            return
+        self._ring[self.head % self.capacity] = fields
+        self.head += 1
+
+    def push(self, records: np.ndarray):
+        n = min(len(records), self.capacity - (self.head - self.tail))
+        if n < len(records):
+            self.dropped += len(records) - n
+            records = records[:n]
+        start = self.head % self.capacity
+        split = min(n, self.capacity - start)
+        self._ring[start:start + split] = records[:split]
+        if split < n:
+            self._ring[:n - split] = records[split:]
+        self.head += n
+
+    def reserve(self, n: int) -> np.ndarray:
+        """Room for ``n`` records, filled in by the caller and then committed.
+
+        This is a view straight into the ring when the records fit without
+        wrapping, which saves building and copying a temporary array.
+        """
+        start = self.head % self.capacity
+        if n <= self.capacity - (self.head - self.tail) and start + n <= self.capacity:
+            return self._ring[start:start + n]
+        return np.empty(n, dtype=self._ring.dtype)
+
+    def commit(self, records: np.ndarray):
+        if records.base is self._ring:
+            self.head += len(records)
+        else:
+            self.push(records)
+
+    def drain(self) -> np.ndarray:
+        """Pop every pending record, oldest first."""
+        head, tail = self.head, self.tail
+        start, end = tail % self.capacity, head % self.capacity
+        if head - tail <= self.capacity - start:
+            records = self._ring[start:start + head - tail].copy()
+        else:
+            records = np.concatenate((self._ring[start:], self._ring[:end]))
+        self.tail = head
+        return records
+
+
+def _sample(n: int, budget: int) -> list[int]:
+    """Indices of an evenly spaced sample of ``budget`` out of ``n``, ending at the last."""
+    if n <= budget:
+        return list(range(n))
+    return [(i + 1) * n // budget - 1 for i in range(budget)]
+
+
+# --- Session store ---
+
+
+class SessionStore:
+    """Struct-of-arrays state for every session, indexed by slot.
+
+    A world subclasses it with its ``COLUMNS``, each column's value after
+    ``alloc`` (whose type also sets the column's dtype), and its ``step``.
+    Columns are allocated once for ``capacity`` slots and slots are recycled
+    through a free list, so memory stays flat as sessions come and go.
+    """
+
+    COLUMNS: dict[str, float | int | bool] = {}
+
+    def __init__(self, capacity: int, ticks: TickLog | None = None):
+        for name, value in self.COLUMNS.items():
+            setattr(self, name, np.full(capacity, value))
+        self.tags = [""] * capacity
+        self.ticks = ticks  # None for stores whose advances are not logged (replay, experiments)
+        self._free = list(range(capacity - 1, -1, -1))
+
+    def alloc(self, tag: str = "") -> int | None:
+        if not self._free:
+            return None
+        slot = self._free.pop()
+        for name, value in self.COLUMNS.items():
+            getattr(self, name)[slot] = value
+        self.tags[slot] = tag
+        return slot
+
+    def free(self, slot: int):
+        self._free.append(slot)
+
+    def gather(self, slots: np.ndarray) -> SessionStore:
+        """Copy the rows for ``slots`` into a scratch store; row i is slots[i]."""
+        rows = type(self).__new__(type(self))
+        for name in self.COLUMNS:
+            setattr(rows, name, getattr(self, name)[slots])
+        rows.tags = [self.tags[slot] for slot in slots]
+        rows.ticks = self.ticks
+        rows._free = []
+        return rows
+
+    def scatter(self, rows: SessionStore, i: int, slot: int):
+        """Commit scratch row ``i`` back to ``slot``."""
+        for name in self.COLUMNS:
+            getattr(self, name)[slot] = getattr(rows, name)[i]
+
+    def _echo(self, rows: np.ndarray, **fields: np.ndarray):
+        """Push a tick record for each of ``rows`` to the tick log.
+
+        Record fields named like a column are read from it; the rest are
+        passed in ``fields``.
+        """
+        if self.ticks is None:
+            return
+        records = self.ticks.reserve(len(rows))
+        records["tag"] = [self.tags[i] for i in rows]
+        for name in records.dtype.names[1:]:
+            records[name] = fields[name] if name in fields else getattr(self, name)[rows]
+        self.ticks.commit(records)
+
+    def step(self, remaining: np.ndarray):
+        """Advance row i by up to remaining[i] ticks, decrementing ``remaining``."""
+        raise NotImplementedError
+
+    def run(self, steps: np.ndarray):
+        """Advance row i by steps[i] ticks to completion."""
+        remaining = np.array(steps, dtype=np.int64)
+        while remaining.any():
+            self.step(remaining)
+
+
+class Column:
+    """A store column seen as an attribute of a StoreState."""
+
+    def __init__(self, kind=float):
+        self.kind = kind
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return self.kind(getattr(obj.store, self.name)[obj.slot])
+
+    def __set__(self, obj, value):
+        getattr(obj.store, self.name)[obj.slot] = value
+
+
+class Pending:
+    """Optional action column: a value array plus a has-value mask."""
+
+    def __init__(self, flag: str):
+        self.flag = flag
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        if not getattr(obj.store, self.flag)[obj.slot]:
+            return None
+        return float(getattr(obj.store, self.name)[obj.slot])
+
+    def __set__(self, obj, value):
+        getattr(obj.store, self.flag)[obj.slot] = value is not None
+        if value is not None:
+            getattr(obj.store, self.name)[obj.slot] = value
+
+
+class StoreState:
+    """One session's row in the store; subclasses declare its Columns."""
+
+    __slots__ = ("store", "slot")
+
+    def __init__(self, store: SessionStore, slot: int):
+        self.store = store
+        self.slot = slot
+
+
+# --- API log ---
+
+
+class ApiSchema:
+    """A world's endpoints and their payload layouts (a world's PAYLOADS)."""
+
+    def __init__(self, payloads: dict):
+        self.payloads = payloads
+        self.endpoints = tuple(payloads)
+        self.codes = {endpoint: code for code, endpoint in enumerate(self.endpoints)}
+        self.reset_code = self.codes["/reset"]
+        self.predict_code = self.codes["/predict"]
+
+    def pack(self, endpoint: str, payload) -> tuple[int, bytes]:
+        """An entry's interned endpoint code and packed payload."""
+        layout = self.payloads[endpoint]
+        if layout is None:
+            return self.codes[endpoint], b""
+        fmt, keys = layout
+        values = (payload[k].encode() if isinstance(payload[k], str) else payload[k] for k in keys)
+        return self.codes[endpoint], fmt.pack(*values)
+
+    def unpack(self, code: int, buf, offset: int):
+        layout = self.payloads[self.endpoints[code]]
+        if layout is None:
+            return None
+        fmt, keys = layout
+        values = fmt.unpack_from(buf, offset)
+        return {k: v.decode() if isinstance(v, bytes) else v for k, v in zip(keys, values)}
+
+    def layouts(self) -> dict:
+        """The payload layouts as a submission header stores them."""
+        return {e: layout and [layout[0].format, list(layout[1])] for e, layout in self.payloads.items()}
+
+
+class LogSegment:
+    """Columns for a run of logged calls.
+
+    One byte of endpoint code, a float64 timestamp, a payload offset and the
+    packed payload per call. Entries read back as the usual
+    ``{"endpoint", "payload", "time"}`` dicts.
+
+    An episode index is kept as calls are appended: the position of every
+    /reset and /predict, and each episode's call count per endpoint (one
+    row of ``len(endpoints)`` counters per episode, the first row for calls
+    before the segment's first /reset).
+    """
+
+    __slots__ = ("schema", "codes", "times", "offsets", "payloads", "resets", "predicts", "episode_counts")
+
+    def __init__(self, schema: ApiSchema):
+        self.schema = schema
+        self.codes = array("B")
+        self.times = array("d")
+        self.offsets = array("Q")
+        self.payloads = bytearray()
+        self.resets = array("Q")
+        self.predicts = array("Q")
+        self.episode_counts = array("Q", bytes(8 * len(schema.endpoints)))
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            len(self.codes) * self.codes.itemsize
+            + len(self.times) * self.times.itemsize
+            + len(self.offsets) * self.offsets.itemsize
+            + len(self.payloads)
+            + (len(self.resets) + len(self.predicts) + len(self.episode_counts)) * 8
+        )
+
+    def append(self, endpoint: str, payload, t: float):
+        self.append_packed(*self.schema.pack(endpoint, payload), t)
+
+    def append_packed(self, code: int, packed: bytes, t: float):
+        n = len(self.schema.endpoints)
+        if code == self.schema.reset_code:
+            self.resets.append(len(self.codes))
+            self.episode_counts.frombytes(bytes(8 * n))
+        elif code == self.schema.predict_code:
+            self.predicts.append(len(self.codes))
+        self.episode_counts[code - n] += 1
+        self.codes.append(code)
+        self.times.append(t)
+        self.offsets.append(len(self.payloads))
+        self.payloads += packed
+
+    def episodes(self) -> dict:
+        """The episode index as stored in a submission; the last row of counts is the final episode."""
+        n = len(self.schema.endpoints)
+        counts = self.episode_counts
+        return {
+            "endpoints": list(self.schema.endpoints),
+            "resets": self.resets.tolist(),
+            "predicts": self.predicts.tolist(),
+            "done": len(self),
+            "counts": [counts[i:i + n].tolist() for i in range(0, len(counts), n)],
+        }
+
+    def packed(self, i: int) -> tuple[int, float, bytes]:
+        """Entry ``i`` as (endpoint code, time, packed payload)."""
+        end = self.offsets[i + 1] if i + 1 < len(self) else len(self.payloads)
+        return self.codes[i], self.times[i], bytes(self.payloads[self.offsets[i]:end])
+
+    def as_trace(self) -> submissions.Trace:
+        """The segment as a submissions.Trace, sharing its columns rather than copying them."""
+        return submissions.Trace(
+            list(self.schema.endpoints),
+            self.schema.layouts(),
+            np.frombuffer(self.codes, dtype=np.uint8),
+            np.frombuffer(self.times, dtype=np.float64),
+            self.payloads,
+            np.frombuffer(self.offsets, dtype=np.uint64),
+        )
+
+    def __getitem__(self, i: int) -> dict:
+        code = self.codes[i]
+        payload = self.schema.unpack(code, self.payloads, self.offsets[i])
+        return {"endpoint": self.schema.endpoints[code], "payload": payload, "time": self.times[i]}
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class ApiLog:
+    """A session's API log: the segment since the last /done, plus a count.
+
+    Indices number every call ever logged, so ``len()`` keeps growing across
+    /done. ``take()`` hands the open segment over without copying and starts
+    a new one, so submitted calls stop costing memory once written out.
+    """
+
+    __slots__ = ("base", "_segment")
+
+    def __init__(self, schema: ApiSchema):
+        self.base = 0  # calls handed off by take()
+        self._segment = LogSegment(schema)
+
+    def __len__(self) -> int:
+        return self.base + len(self._segment)
+
+    def append(self, endpoint: str, payload, t: float):
+        self._segment.append(endpoint, payload, t)
+
+    def append_packed(self, code: int, packed: bytes, t: float):
+        self._segment.append_packed(code, packed, t)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            indices = range(*key.indices(len(self)))
+            return [self._segment[i - self.base] for i in indices if i >= self.base]
+        if key < 0:
+            key += len(self)
+        if not self.base <= key < len(self):
+            raise IndexError("api_log index out of range")
+        return self._segment[key - self.base]
+
+    def __iter__(self):
+        return iter(self._segment)
+
+    def take(self) -> LogSegment:
+        segment, self._segment = self._segment, LogSegment(self._segment.schema)
+        self.base += len(segment)
+        return segment
+
+
+# --- Write-ahead log ---
+#
+# Every logged call is also appended to a per-server binary log on disk, so
+# the audit trail since the last /done survives a crash or restart. A record
+# is a CRC32 of the rest, then kind, token length, endpoint code, time and
+# payload length, then the token and the packed payload. CALL records carry
+# one api_log entry; DONE and BASE records carry a call count (the session's
+# new done_log_start); CLOSE drops a session.
+#
+# A server keeps one file per listener, world_N/wal/api-<port>.wal (a --uds
+# server's is named after its socket; WAL_NAME and WAL_DIR override the name
+# and directory), opened when it starts serving and locked while open. On
+# restart it recovers each session that has unsubmitted calls (its token,
+# done_log_start and those calls) and compacts the file to just that state.
+# World state is not recovered: recovered sessions start zeroed until /reset.
+
+_WAL_CRC = struct.Struct("<I")
+_WAL_HEAD = struct.Struct("<BBBdH")
+_WAL_COUNT = struct.Struct("<q")
+_WAL_CALL, _WAL_DONE, _WAL_CLOSE, _WAL_BASE = range(4)
+
+
+def _wal_record(kind: int, token: str | None, code: int, t: float, payload: bytes) -> bytes:
+    tok = token.encode() if token else b""
+    body = _WAL_HEAD.pack(kind, len(tok), code, t, len(payload)) + tok + payload
+    return _WAL_CRC.pack(zlib.crc32(body)) + body
+
+
+class WalReader:
+    """Memory-mapped, read-only view of a write-ahead log file."""
+
+    def __init__(self, path: str):
+        self._file = None
+        self._buf = b""
+        if os.path.exists(path) and os.path.getsize(path):
+            self._file = open(path, "rb")
+            self._buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        if self._file is not None:
+            self._buf.close()
+            self._file.close()
+            self._file = None
+
+    def __enter__(self) -> WalReader:
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def records(self, offset: int = 0):
+        """Yield ``(offset, kind, token, code, time, payload)`` from ``offset``.
+
+        Stops at the first torn or corrupt record, which is where a crash
+        cut the log off.
+        """
+        buf, size = self._buf, len(self._buf)
+        prefix = _WAL_CRC.size + _WAL_HEAD.size
+        while offset + prefix <= size:
+            (crc,) = _WAL_CRC.unpack_from(buf, offset)
+            kind, tlen, code, t, plen = _WAL_HEAD.unpack_from(buf, offset + _WAL_CRC.size)
+            start = offset + prefix
+            end = start + tlen + plen
+            if end > size or zlib.crc32(buf[offset + _WAL_CRC.size:end]) != crc:
+                return
+            yield offset, kind, buf[start:start + tlen].decode(), code, t, buf[start + tlen:end]
+            offset = end
+
+    def at(self, offsets):
+        """Yield the records at ``offsets``, as ``records`` does."""
+        for offset in offsets:
+            yield next(self.records(offset))
+
+    def index(self) -> dict[str, array]:
+        """Record offsets per token, so one session's records can be read
+        with ``at`` without parsing the rest of the file."""
+        offsets: dict[str, array] = {}
+        for offset, _, token, _, _, _ in self.records():
+            offsets.setdefault(token, array("q")).append(offset)
+        return offsets
+
+    def recover(self, schema: ApiSchema, offsets=None) -> dict[str, tuple[int, LogSegment]]:
+        """Each open session's done_log_start and its calls since then.
+
+        Sessions with no calls since their last /done are left out, so
+        abandoned sessions do not come back on every restart. The default
+        session is keyed by the empty token. ``offsets`` (from ``index``)
+        limits recovery to those records.
+        """
+        state: dict[str, tuple[int, list]] = {}
+        for _, kind, token, code, t, payload in self.records() if offsets is None else self.at(offsets):
+            if kind == _WAL_CALL:
+                state.setdefault(token, (0, []))[1].append((code, t, payload))
+            elif kind == _WAL_CLOSE:
+                state.pop(token, None)
+            else:
+                (count,) = _WAL_COUNT.unpack(payload)
+                done_at, tail = state.get(token, (0, []))
+                if kind == _WAL_DONE:
+                    del tail[:count - done_at]
+                else:
+                    tail = []
+                state[token] = (count, tail)
+        recovered = {}
+        for token, (done_at, tail) in state.items():
+            if not tail:
+                continue
+            segment = LogSegment(schema)
+            for code, t, payload in tail:
+                segment.append_packed(code, payload, t)
+            recovered[token] = (done_at, segment)
+        return recovered
+
+
+class WriteAheadLog:
+    """Appender for the write-ahead log with group commit.
+
+    ``append`` only copies the record into a buffer. A background thread
+    writes and fsyncs whatever has accumulated every WAL_COMMIT_INTERVAL, so
+    one fsync covers every call in the window and no request waits on disk.
+    A crash loses at most the last window.
+
+    The file is locked for as long as it is open, so a second process cannot
+    append to, recover or compact it. Every WAL_COMPACT_BYTES of growth the
+    commit thread compacts it to the state it recovers to. ``index`` maps
+    each token to its records' offsets in the current file.
+    """
+
+    def __init__(self, path: str, schema: ApiSchema, recovered: dict[str, tuple[int, LogSegment]] | None = None):
+        self.path = path
+        self.schema = schema
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = open(path + ".lock", "a")
+        try:
+            fcntl.flock(self._lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock.close()
+            raise RuntimeError(f"{path} is in use by another server process; give this one its own WAL_NAME") from None
+        if recovered is not None:
+            self._compact(recovered)
+        self._open()
+        self._buf = bytearray()
+        self._buf_tokens: list[tuple[str, int]] = []  # (token, offset in _buf) per buffered record
+        self._buf_lock = threading.Lock()  # guards _buf only
+        self._io_lock = threading.Lock()  # keeps flushes in order
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="wal-commit", daemon=True)
+        self._thread.start()
+
+    def _compact(self, recovered: dict[str, tuple[int, LogSegment]]):
+        """Start from just the recovered state, so the file stays bounded."""
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            for token, (done_at, segment) in recovered.items():
+                f.write(_wal_record(_WAL_BASE, token, 0, time.time(), _WAL_COUNT.pack(done_at)))
+                for i in range(len(segment)):
+                    f.write(_wal_record(_WAL_CALL, token, *segment.packed(i)))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def _open(self):
+        self._file = open(self.path, "ab")
+        with WalReader(self.path) as reader:
+            self.index = reader.index()
+        self._compacted_size = self._file.tell()
+
+    def append(self, kind: int, token: str | None, code: int, t: float, payload: bytes = b""):
+        record = _wal_record(kind, token, code, t, payload)
+        with self._buf_lock:
+            self._buf_tokens.append((token or "", len(self._buf)))
+            self._buf += record
+
+    def flush(self):
+        with self._io_lock:
+            with self._buf_lock:
+                buf, self._buf = self._buf, bytearray()
+                tokens, self._buf_tokens = self._buf_tokens, []
+            if buf and not self._file.closed:
+                base = self._file.tell()
+                self._file.write(buf)
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                for token, offset in tokens:
+                    self.index.setdefault(token, array("q")).append(base + offset)
+                if base + len(buf) - self._compacted_size > WAL_COMPACT_BYTES:
+                    # Everything appended is on disk, so the file recovers to the live state.
+                    with WalReader(self.path) as reader:
+                        recovered = reader.recover(self.schema)
+                    self._file.close()
+                    self._compact(recovered)
+                    self._open()
+
+    def session(self, token: str | None) -> tuple[int, LogSegment] | None:
+        """One session's done_log_start and unsubmitted calls, read through
+        the index rather than by scanning the file."""
+        self.flush()
+        with self._io_lock, WalReader(self.path) as reader:
+            return reader.recover(self.schema, self.index.get(token or "", ())).get(token or "")
+
+    def _run(self):
+        while not self._closed.wait(WAL_COMMIT_INTERVAL):
+            self.flush()
+
+    def close(self):
+        if not self._closed.is_set():
+            self._closed.set()
+            self._thread.join()
+            self.flush()
+            self._file.close()
+            self._lock.close()
+
+
+# --- Goal audit ---
+#
+# A world's GOALS (agent_briefing.md) map each goal number to its spec. An
+# action goal caps /act calls after the final /reset, in total or per action
+# name, and lists the observations it must hit as ``targets`` ({t, x[, y],
+# tol}); ``settle`` also requires |x(t + 1) - x(t)| below it at the last
+# target. A prediction goal must run reset -> observe -> predict ->
+# act/advance -> observe; its ``experiment`` is the acts made at t = 0 and
+# the t whose x is predicted.
+
+# Prediction-order state machine: (state, endpoint) -> next state. A /reset
+# restarts it from any state; any pair not listed breaks the order until
+# the next /reset.
+_PREDICTION_ORDER = {
+    ("reset", "/observe"): "observed",
+    ("observed", "/observe"): "observed",
+    ("observed", "/predict"): "predicted",
+    ("predicted", "/observe"): "predicted",
+    ("predicted", "/predict"): "predicted",
+    ("predicted", "/act"): "experiment",
+    ("predicted", "/advance"): "experiment",
+    ("experiment", "/act"): "experiment",
+    ("experiment", "/advance"): "experiment",
+    ("experiment", "/observe"): "complete",
+    ("complete", "/observe"): "complete",
+    ("complete", "/act"): "experiment",
+    ("complete", "/advance"): "experiment",
+}
+
+
+class GoalAuditor:
+    """Checks a session's calls against every goal's constraints as they are logged.
+
+    ``record`` is O(1) per call: counters since the last /reset and the
+    prediction-order state. ``verdict`` reads them at /done, so audit cost
+    never depends on how long the agent explored.
+    """
+
+    __slots__ = ("goals", "resets", "acts", "acts_by_action", "order", "order_error")
+
+    def __init__(self, goals: dict):
+        self.goals = goals
+        self.resets = 0
+        self.acts = 0
+        self.acts_by_action: dict[str, int] = {}
+        self.order = "start"
+        self.order_error = None
+
+    def record(self, endpoint: str, payload=None):
+        if endpoint == "/reset":
+            self.resets += 1
+            self.acts = 0
+            self.acts_by_action = {}
+            self.order = "reset"
+            self.order_error = None
+            return
+        if endpoint == "/act":
+            self.acts += 1
+            action = payload["action"]
+            self.acts_by_action[action] = self.acts_by_action.get(action, 0) + 1
+        if self.order in ("start", "broken"):
+            return
+        following = _PREDICTION_ORDER.get((self.order, endpoint))
+        if following is None:
+            self.order_error = f"{endpoint} after {self.order}"
+            self.order = "broken"
+        else:
+            self.order = following
+
+    def verdict(self, goal: int) -> dict:
+        spec = self.goals.get(goal)
+        if spec is None:
+            return {"goal": goal, "ok": False, "violations": [f"unknown goal {goal}"]}
+        violations = []
+        if not self.resets:
+            violations.append("no /reset before /done")
+        verdict = {"goal": goal, **spec, "acts": self.acts, "acts_by_action": dict(self.acts_by_action)}
+        if spec["type"] == "action":
+            budget = spec["act_budget"]
+            counts = self.acts_by_action if spec["per_action"] else {None: self.acts}
+            for action, n in counts.items():
+                if n > budget:
+                    name = f"/act {action}" if action else "/act"
+                    violations.append(f"{name} called {n} times after the final /reset (budget {budget})")
+        else:
+            verdict["order"] = self.order
+            if self.order == "broken":
+                violations.append(f"out of order: {self.order_error}")
+            elif self.resets and self.order != "complete":
+                violations.append(f"experiment incomplete: stopped at {self.order}")
+        verdict["ok"] = not violations
+        verdict["violations"] = violations
+        return verdict
+
+
+# --- Sessions ---
+
+
+class Session:
+    """One agent run: its world state and its own API log."""
+
+    __slots__ = (
+        "token", "state", "api_log", "audit", "done_log_start", "version", "prediction", "prediction_future",
+    )
+
+    def __init__(self, state, schema: ApiSchema, goals: dict, token: str | None = None):
+        self.token = token
+        self.state = state
+        self.api_log = ApiLog(schema)
+        self.audit = GoalAuditor(goals)
+        self.done_log_start = 0
+        self.version = 0  # bumped by every state change; lets an advance detect it raced one
+        self.prediction: dict | None = None  # the current episode's latest /predict
+        self.prediction_future: Future | None = None
+
+    @property
+    def tag(self) -> str:
+        return f"[{self.token[:8]}] " if self.token else ""
+
+
+def _unknown_session():
+    return JSONResponse(status_code=404, content={"detail": "Unknown session"})
+
+
+def _parse_args(argv: list[str] | None = None, description: str | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--uds", help="serve on this Unix domain socket instead of TCP")
+    return parser.parse_args(argv)
+
+
+def _wal_name(args: argparse.Namespace) -> str:
+    """One WAL per listener, so two servers of a world never share a file."""
+    if args.uds:
+        return "api-uds" + os.path.abspath(args.uds).replace(os.sep, "_") + ".wal"
+    return f"api-{args.port}.wal"
+
+
+def _entry(endpoint: str, payload=None) -> tuple:
+    return endpoint, payload, time.time()
+
+
+# --- Replay ---
+#
+# A trace holds everything needed to rebuild its trajectory: /reset logs the
+# seed its start state was drawn from (or starts from a fixed state and logs
+# none), /act and /advance their arguments and /observe what it returned.
+# World.replay() runs the calls back through the same reset, act and advance
+# code, minus the tick log, and checks every logged observation against the
+# rebuilt state with the world's ``same_observation``.
+#
+# same_observation allows for the rounding gap between a world's fast
+# advance and its TICK_ECHO tick loop. Keep all randomness in a world behind
+# the reset seed, or its traces stop replaying.
+
+
+class ReplayMismatch(ValueError):
+    """A logged observation that the replayed state does not reproduce."""
+
+    def __init__(self, index: int, logged: dict, replayed: dict):
+        super().__init__(f"call {index}: /observe logged {logged}, replay gives {replayed}")
+        self.index = index
+        self.logged = logged
+        self.replayed = replayed
+
+
+# --- Prediction ground truth ---
+#
+# /predict snapshots the session's full state and hands it to a background
+# worker, which runs every prediction goal's experiment (GOALS "experiment")
+# on the snapshot and writes the true x and the prediction's error into the
+# episode record. /done then copies the record into the submission instead
+# of re-simulating anything.
+
+_experiments = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prediction")
+atexit.register(_experiments.shutdown, cancel_futures=True)
+
+
+class ActRequest(BaseModel):
+    action: str
+    value: float
+
+
+class AdvanceRequest(BaseModel):
+    steps: int = Field(le=MAX_T)
+
+
+class Command(BaseModel):
+    op: str  # "act", "advance" or "observe"
+    action: str | None = None
+    value: float | None = None
+    steps: int | None = Field(default=None, le=MAX_T)
+
+
+class BatchRequest(BaseModel):
+    commands: list[Command] = Field(max_length=MAX_BATCH)
+
+
+class DoneRequest(BaseModel):
+    goal: int
+    agent_id: str
+    solver: str
+    command: str
+    report: str
+
+
+def _overrun_error(t: int, steps: int) -> str | None:
+    """Why advancing ``steps`` ticks from ``t`` is refused, or None if it is allowed."""
+    if t + steps > MAX_T:
+        return f"advance would take t past {MAX_T}"
+    return None
+
+
+# --- Agent socket ---
+#
+# One long-lived WebSocket carries the same primitives as the REST API
+# without per-request HTTP overhead. Text frames are JSON objects such as
+# {"op": "act", "action": "A", "value": 1.5}; binary frames pack the same
+# messages little-endian behind a one-byte op code. Every message is run
+# through the REST handler for its op, so clamping, validation and api_log
+# entries are identical by construction. Each message gets exactly one reply
+# in order: the observation for observe, an empty reply otherwise, or a JSON
+# text frame {"error": <status>, "detail": ...} when the REST call would have
+# failed. A predict frame packs the world's /predict payload after its op,
+# and an observation reply is packed as /observe is in the API log.
+
+OP_ACT, OP_ADVANCE, OP_OBSERVE, OP_PREDICT = 1, 2, 3, 4
+_ACT_FRAME = struct.Struct("<Bcd")  # op, action letter, value
+_ADVANCE_FRAME = struct.Struct("<Bq")  # op, steps
+
+
+def _error_frame(response: JSONResponse) -> str:
+    detail = json.loads(response.body)["detail"]
+    return json.dumps({"error": response.status_code, "detail": detail}, separators=(",", ":"))
+
+
+# --- Submissions ---
+
+
+def _write_submission(path: str, submission: dict):
+    """Write a /done submission as ``.wsub`` (tools/submissions.py), atomically.
+
+    The blob fields go to ``blobs/`` beside it. The trace is still the
+    LogSegment /done took, and is read as columns only here, on the writer
+    thread.
+    """
+    submissions.write(path, {**submission, "api_trace": submission["api_trace"].as_trace()})
+
+
+class SubmissionWriter:
+    """Writes /done submissions on a background thread.
+
+    Serialization and disk I/O happen off the request path, and each file is
+    written atomically so a crash never leaves a truncated submission. The
+    submissions waiting to be written are bounded by ``max_bytes`` in total
+    (one is always admitted, however large). ``close`` writes out everything
+    still queued and runs at exit.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._queue: deque[tuple[str, dict, int, Callable[[], None]]] = deque()
+        self._queued_bytes = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="submission-writer", daemon=True)
+        self._thread.start()
+
+    def _has_room(self, size: int) -> bool:
+        return not self._queue or self._queued_bytes + size <= self.max_bytes
+
+    def try_submit(self, path: str, submission: dict, size: int, on_written: Callable[[], None]) -> bool:
+        """Queue a submission unless that would exceed ``max_bytes``."""
+        with self._cond:
+            if not self._has_room(size):
+                return False
+            self._queue.append((path, submission, size, on_written))
+            self._queued_bytes += size
+            self._cond.notify_all()
+            return True
+
+    def submit(self, path: str, submission: dict, size: int, on_written: Callable[[], None]):
+        """Queue a submission, blocking until there is room."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._has_room(size))
+            self._queue.append((path, submission, size, on_written))
+            self._queued_bytes += size
+            self._cond.notify_all()
+
+    def flush(self):
+        """Block until every queued submission has been written."""
+        with self._cond:
+            self._cond.wait_for(lambda: not self._queue)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._queue or self._closed)
+                if not self._queue:
+                    return
+                path, submission, size, on_written = self._queue[0]
+            try:
+                _write_submission(path, submission)
+                on_written()
+            except Exception as e:  # keep the writer alive for the rest of the queue
+                print(f"SUBMISSION write failed for {os.path.basename(path)}: {e!r}")
+            with self._cond:
+                self._queue.popleft()
+                self._queued_bytes -= size
+                self._cond.notify_all()
+
+
+# --- Worlds ---
+
+
+class World:
+    """One world's server, built around the physics in its module.
+
+    Every state-touching handler runs on the event loop, and each state
+    change happens together with its log append with no await in between,
+    so it is atomic with respect to every other request without a lock, and
+    api_log order is commit order. Work that yields (advances, /batch, file
+    writes) runs on copies and commits in one such step.
+
+    Subclasses say how a session's state is held and advanced.
+    """
+
+    def __init__(self, physics):
+        self.physics = physics
+        self.dir = os.path.dirname(os.path.abspath(physics.__file__))
+        self.submissions_dir = os.path.join(self.dir, "submissions")
+        self.goals = physics.GOALS
+        self.prediction_goals = {goal: spec["experiment"] for goal, spec in self.goals.items() if "experiment" in spec}
+        self.schema = ApiSchema(physics.PAYLOADS)
+        self.seeded = physics.PAYLOADS["/reset"] is not None  # /reset draws and logs a seed
+        predict_layout, self.predict_keys = physics.PAYLOADS["/predict"]
+        self.PredictRequest = create_model("PredictRequest", **{k: (float, ...) for k in self.predict_keys})
+        self._predict_frame = struct.Struct("<B" + predict_layout.format.lstrip("<"))  # op, then the payload
+        self._observation_frame = physics.PAYLOADS["/observe"][0]
+
+        self.ticks = TickLog(TICK_RING, physics.TICK_DTYPE)
+        self.tick_file = open(TICK_FILE, "ab") if TICK_FILE else None
+        self._tick_drain_lock = threading.Lock()  # one drainer at a time; the producer never takes it
+        self._ticks_dropped_reported = 0
+        threading.Thread(target=self._tick_consumer, name="tick-log", daemon=True).start()
+        atexit.register(self.drain_ticks)
+
+        self._setup_state()
+        # Requests without an X-Session header use the default session, so a
+        # single-agent server behaves exactly as before sessions existed.
+        self.default_session = Session(self._new_state(""), self.schema, self.goals)
+        self.sessions: dict[str, Session] = {}
+        self.wal: WriteAheadLog | None = None  # opened when serving starts
+
+        self.submissions = SubmissionWriter(SUBMISSION_QUEUE_BYTES)
+        atexit.register(self.submissions.close)
+
+        self.app = FastAPI(docs_url=None, redoc_url=None, openapi_url=None, lifespan=self._lifespan)
+        self._route()
+
+    # --- State hooks ---
+
+    def _setup_state(self):
+        """Build whatever holds session state; runs once the tick log exists."""
+
+    def _new_state(self, tag: str):
+        """A fresh state for a new session, or None if there is no room."""
+        raise NotImplementedError
+
+    def _drop_state(self, s):
+        """Release a closed session's state."""
+
+    def _scratch(self, s):
+        """A private copy of ``s`` for work that yields before it commits."""
+        raise NotImplementedError
+
+    def _commit(self, s, scratch):
+        """Make ``scratch`` (from ``_scratch(s)``) the state of ``s``."""
+        raise NotImplementedError
+
+    async def _advance_scratch(self, s, steps: int, tag: str, deadline: float) -> bool:
+        """Advance a scratch state, yielding between chunks; False at ``deadline``."""
+        raise NotImplementedError
+
+    def _run(self, s, steps: int):
+        """Advance a replay or experiment state ``steps`` ticks without logging them."""
+        raise NotImplementedError
+
+    def _replay_state(self):
+        """A fresh state outside every session, for replays."""
+        raise NotImplementedError
+
+    def _snapshot(self, s):
+        """A copy of ``s`` that a prediction experiment can start from."""
+        raise NotImplementedError
+
+    def _restore(self, snapshot):
+        """A fresh replay state holding ``snapshot``."""
+        raise NotImplementedError
+
+    # --- Tick log ---
+
+    def drain_ticks(self):
+        with self._tick_drain_lock:
+            records = self.ticks.drain()
+            n = len(records)
+            if self.tick_file is not None and n:
+                self.tick_file.write(records.tobytes())
+                self.tick_file.flush()
+            lines = []
+            if TICK_ECHO_RATE > 0:
+                shown = _sample(n, max(1, int(TICK_ECHO_RATE * TICK_DRAIN_INTERVAL)))
+                lines = [self.physics.format_tick(records[i]) for i in shown]
+                if len(shown) < n:
+                    lines.append(f"  ... {n - len(shown)} ticks not echoed")
+            dropped = self.ticks.dropped - self._ticks_dropped_reported
+            if dropped:
+                lines.append(f"  ... tick log full, dropped {dropped} ticks")
+                self._ticks_dropped_reported += dropped
+            if lines:
+                print("\n".join(lines))
+
+    def _tick_consumer(self):
+        while True:
+            time.sleep(TICK_DRAIN_INTERVAL)
+            self.drain_ticks()
+
+    # --- Sessions and logs ---
+
+    def _session(self, token: str | None) -> Session | None:
+        if token is None:
+            return self.default_session
+        return self.sessions.get(token)
+
+    def _new_session(self, token: str) -> Session | None:
+        if len(self.sessions) >= MAX_SESSIONS:
+            return None
+        state = self._new_state(f"[{token[:8]}] ")
+        if state is None:
+            return None
+        self.sessions[token] = sess = Session(state, self.schema, self.goals, token)
+        return sess
+
+    def _recover_sessions(self, recovered: dict[str, tuple[int, LogSegment]]):
+        """Reattach logs recovered from the write-ahead log after a restart.
+
+        Only the audit trail is durable: a recovered session keeps its token
+        and its unsubmitted calls, but its world state starts zeroed until
+        the next /reset.
+        """
+        for token, (done_at, segment) in recovered.items():
+            sess = self._new_session(token) if token else self.default_session
+            if sess is None:
+                print(f"WAL: no room to recover session {token[:8]}")
+                continue
+            sess.api_log.base = done_at
+            sess.api_log._segment = segment
+            sess.done_log_start = done_at
+            for entry in segment:  # rebuild the audit from the unsubmitted calls
+                sess.audit.record(entry["endpoint"], entry["payload"])
+        if recovered:
+            print(f"WAL: recovered {sum(len(s) for _, s in recovered.values())} unsubmitted calls")
+
+    def _open_wal(self, name: str):
+        """Reattach the sessions logged in the WAL directory's ``name`` and start appending to it."""
+        path = os.path.join(WAL_DIR or os.path.join(self.dir, "wal"), name)
+        with WalReader(path) as reader:
+            recovered = reader.recover(self.schema)
+        self.wal = WriteAheadLog(path, self.schema, recovered)
+        self._recover_sessions(recovered)
+
+    @contextlib.asynccontextmanager
+    async def _lifespan(self, app: FastAPI):
+        # Opened here rather than at import, so importing a world (tests,
+        # tools/replay.py) never takes a WAL lock, and named from the listener
+        # main() started, or WAL_NAME for servers launched by plain uvicorn.
+        self._open_wal(WAL_NAME or getattr(app.state, "wal_name", "api.wal"))
+        try:
+            yield
+        finally:
+            self.submissions.flush()  # their DONE records go to the WAL
+            self.wal.close()
+
+    def _log(self, sess: Session, endpoint: str, payload=None, t: float | None = None):
+        code, packed = self.schema.pack(endpoint, payload)
+        if t is None:
+            t = time.time()
+        sess.api_log.append_packed(code, packed, t)
+        sess.audit.record(endpoint, payload)
+        self.wal.append(_WAL_CALL, sess.token, code, t, packed)
+
+    def _fields(self, values) -> str:
+        """The /predict fields of ``values`` (a state or a prediction) as console text."""
+        return " ".join(f"{k}={getattr(values, k):.6f}" for k in self.predict_keys)
+
+    # --- Replay ---
+
+    def replay(self, entries, stops=(), check: bool = True) -> Iterator[tuple[int, str, object]]:
+        """Re-run a trace; yield ``(index, endpoint, state)`` per call from the first /reset on.
+
+        ``state`` is the replay's State, hidden fields included, and is
+        updated in place. Calls before the first /reset ran on a state the
+        trace does not record and are skipped. Raises ReplayMismatch at the
+        first /observe whose logged result the replay does not reproduce,
+        and ValueError at a /reset without a logged seed (in a world that
+        logs one) or an /observe without a logged result (traces from
+        before either was logged).
+
+        An /advance that passes a time in ``stops`` runs in pieces and is
+        also yielded at each such t, so goals can be checked between logged
+        calls. ``check=False`` skips the observation check, for traces
+        whose observations were not logged.
+        """
+        physics = self.physics
+        s = self._replay_state()
+        stops = sorted(stops)
+        started = False
+        for i, entry in enumerate(entries):
+            endpoint, payload = entry["endpoint"], entry["payload"]
+            if endpoint == "/reset":
+                if not self.seeded:
+                    physics.reset_state(s)
+                elif payload is None:
+                    raise ValueError(f"call {i}: /reset has no logged seed")
+                else:
+                    physics.reset_state(s, payload["seed"])
+                started = True
+            elif not started:
+                continue
+            elif endpoint == "/act":
+                physics.apply_act(s, payload["action"], payload["value"])
+            elif endpoint == "/advance":
+                end = s.t + payload["steps"]
+                for stop in stops:
+                    if s.t < stop < end:
+                        self._run(s, stop - s.t)
+                        yield i, endpoint, s
+                self._run(s, end - s.t)
+            elif endpoint == "/observe" and check:
+                if payload is None:
+                    raise ValueError(f"call {i}: /observe has no logged result")
+                if not physics.same_observation(payload, s):
+                    raise ReplayMismatch(i, payload, physics.observation(s))
+            yield i, endpoint, s
+
+    def verify(self, entries) -> int:
+        """Replay a trace to the end; returns how many observations it checked."""
+        return sum(endpoint == "/observe" for _, endpoint, _ in self.replay(entries))
+
+    # --- Prediction ground truth ---
+
+    def _run_experiment(self, snapshot, experiment: dict) -> float | None:
+        """x after ``experiment`` runs from a copy of ``snapshot``.
+
+        The experiment's acts are made at t = 0, so a snapshot taken after
+        the clock has moved has no true outcome and gives None.
+        """
+        run = self._restore(snapshot)
+        if run.t != 0:
+            return None
+        for action, value in experiment["acts"]:
+            self.physics.apply_act(run, action, value)
+        if experiment["t"] > run.t:
+            self._run(run, experiment["t"] - run.t)
+        return self.physics.observation(run)["x"]
+
+    def _score_prediction(self, snapshot, record: dict):
+        """Fill ``record["outcomes"]`` with each prediction goal's true x and the error."""
+        for goal, experiment in self.prediction_goals.items():
+            actual = self._run_experiment(snapshot, experiment)
+            if actual is not None:
+                record["outcomes"][goal] = {"t": experiment["t"], "actual": actual, "error": record["x"] - actual}
+
+    # --- Handlers ---
+
+    def _route(self):
+        app = self.app
+        app.post("/reset", status_code=204)(self.reset)
+        app.delete("/session", status_code=204)(self.close_session)
+        app.post("/act", status_code=204)(self.act)
+        app.post("/advance", status_code=204)(self.advance)
+        app.get("/observe")(self.observe)
+        app.post("/batch")(self.batch)
+
+        async def predict(req, x_session: str | None = Header(default=None)):
+            return await self.predict(req, x_session)
+
+        predict.__annotations__["req"] = self.PredictRequest  # the world's own payload
+        app.post("/predict", status_code=204)(predict)
+        app.websocket("/ws")(self.agent_socket)
+        app.post("/done")(self.done)
+        app.get("/bootstrap")(self.bootstrap)
+        app.get("/")(self.dashboard)
+
+    async def reset(self, x_session: str | None = Header(default=None)):
+        """Reset a session. ``X-Session: new`` mints a session and returns its token."""
+        minted = x_session == "new"
+        if minted:
+            x_session = secrets.token_hex(16)
+            if self._new_session(x_session) is None:
+                return JSONResponse(status_code=503, content={"detail": "Too many sessions"})
+        sess = self._session(x_session)
+        if sess is None:
+            return _unknown_session()
+        s = sess.state
+        if self.seeded:
+            seed = secrets.randbits(63)
+            self.physics.reset_state(s, seed)
+            payload = {"seed": seed}
+        else:
+            self.physics.reset_state(s)
+            payload = None
+        sess.version += 1
+        self._log(sess, "/reset", payload)
+        sess.prediction = sess.prediction_future = None
+        print(f"{sess.tag}RESET {self._fields(s)}")
+        if minted:
+            return JSONResponse(status_code=200, content={"session": x_session})
+
+    async def close_session(self, x_session: str | None = Header(default=None)):
+        sess = self.sessions.pop(x_session, None) if x_session is not None else None
+        if sess is None:
+            return _unknown_session()
+        sess.version += 1
+        self.wal.append(_WAL_CLOSE, sess.token, 0, time.time())
+        self._drop_state(sess.state)
+
+    async def act(self, req: ActRequest, x_session: str | None = Header(default=None)):
+        sess = self._session(x_session)
+        if sess is None:
+            return _unknown_session()
+        if (error := self.physics.act_error(req.action, req.value)) is not None:
+            return JSONResponse(status_code=422, content={"detail": error})
+        clamped = self.physics.apply_act(sess.state, req.action, req.value)
+        sess.version += 1
+        self._log(sess, "/act", {"action": req.action, "value": clamped})
+        print(f"{sess.tag}ACT action={req.action} value={clamped:.6f}")
+
+    async def advance(self, req: AdvanceRequest, x_session: str | None = Header(default=None)):
+        sess = self._session(x_session)
+        if sess is None:
+            return _unknown_session()
+        if req.steps < 1:
+            return JSONResponse(status_code=422, content={"detail": "steps must be >= 1"})
+        # All-or-nothing: run on a copy and commit it only if the advance finishes
+        # within its budget and nothing else changed the session meanwhile.
+        deadline = time.monotonic() + ADVANCE_BUDGET
+        while True:
+            version = sess.version
+            s = self._scratch(sess.state)
+            if (error := _overrun_error(s.t, req.steps)) is not None:
+                return JSONResponse(status_code=422, content={"detail": error})
+            if not await self._advance_scratch(s, req.steps, sess.tag, deadline):
+                print(f"{sess.tag}ADVANCE steps={req.steps} cancelled after {ADVANCE_BUDGET}s budget")
+                return JSONResponse(status_code=503, content={"detail": "advance exceeded time budget"})
+            if sess.version == version:
+                break
+            if self._session(x_session) is not sess:
+                return _unknown_session()
+        self._commit(sess.state, s)
+        sess.version += 1
+        self._log(sess, "/advance", {"steps": req.steps})
+
+    async def observe(self, x_session: str | None = Header(default=None)):
+        sess = self._session(x_session)
+        if sess is None:
+            return _unknown_session()
+        observation = self.physics.observation(sess.state)
+        self._log(sess, "/observe", observation)
+        return observation
+
+    def _command_error(self, cmd: Command) -> str | None:
+        """Why a /batch command is invalid, or None if it is valid."""
+        if cmd.op == "act":
+            if cmd.action is None or cmd.value is None:
+                return "act needs action and value"
+            return self.physics.act_error(cmd.action, cmd.value)
+        if cmd.op == "advance":
+            if cmd.steps is None or cmd.steps < 1:
+                return "steps must be >= 1"
+            return None
+        if cmd.op == "observe":
+            return None
+        return f"Unknown op: {cmd.op}"
+
+    async def batch(self, req: BatchRequest, x_session: str | None = Header(default=None)):
+        """Run a sequence of act/advance/observe commands as one atomic unit.
+
+        The commands run in order on a copy of the session state and commit
+        together, so no other request can interleave with them. Each command
+        is logged exactly as the matching single call would be. Returns the
+        /observe results in order. Invalid commands reject the whole batch
+        with 422 before anything runs; an advance that would take t past
+        MAX_T rejects it with 422 and one past its budget drops it with 503,
+        leaving the session untouched.
+        """
+        sess = self._session(x_session)
+        if sess is None:
+            return _unknown_session()
+        for i, cmd in enumerate(req.commands):
+            if (error := self._command_error(cmd)) is not None:
+                return JSONResponse(status_code=422, content={"detail": f"commands[{i}]: {error}"})
+        physics = self.physics
+        deadline = time.monotonic() + ADVANCE_BUDGET
+        while True:
+            version = sess.version
+            s = self._scratch(sess.state)
+            entries, observations = [], []
+            for i, cmd in enumerate(req.commands):
+                if cmd.op == "act":
+                    clamped = physics.apply_act(s, cmd.action, cmd.value)
+                    entries.append(_entry("/act", {"action": cmd.action, "value": clamped}))
+                elif cmd.op == "advance":
+                    if (error := _overrun_error(s.t, cmd.steps)) is not None:
+                        return JSONResponse(status_code=422, content={"detail": f"commands[{i}]: {error}"})
+                    if not await self._advance_scratch(s, cmd.steps, sess.tag, deadline):
+                        print(f"{sess.tag}BATCH advance steps={cmd.steps} cancelled after {ADVANCE_BUDGET}s budget")
+                        return JSONResponse(status_code=503, content={"detail": "advance exceeded time budget"})
+                    entries.append(_entry("/advance", {"steps": cmd.steps}))
+                else:
+                    observations.append(physics.observation(s))
+                    entries.append(_entry("/observe", observations[-1]))
+            if sess.version == version:
+                break
+            if self._session(x_session) is not sess:
+                return _unknown_session()
+        self._commit(sess.state, s)
+        sess.version += 1
+        for entry in entries:
+            self._log(sess, *entry)
+        print(f"{sess.tag}BATCH commands={len(req.commands)}")
+        return {"observations": observations}
+
+    async def predict(self, req: BaseModel, x_session: str | None = None):
+        sess = self._session(x_session)
+        if sess is None:
+            return _unknown_session()
+        payload = req.model_dump()
+        self._log(sess, "/predict", payload)
+        sess.prediction = record = {**payload, "predicted_at": sess.state.t, "outcomes": {}}
+        if self.prediction_goals:
+            sess.prediction_future = _experiments.submit(self._score_prediction, self._snapshot(sess.state), record)
+        print(f"{sess.tag}PREDICT {self._fields(req)}")
+
+    # --- Agent socket ---
+
+    def _decode_frame(self, frame: bytes) -> dict:
+        op = frame[0] if frame else None
+        if op == OP_ACT:
+            _, action, value = _ACT_FRAME.unpack(frame)
+            return {"op": "act", "action": action.decode("latin-1"), "value": value}
+        if op == OP_ADVANCE:
+            _, steps = _ADVANCE_FRAME.unpack(frame)
+            return {"op": "advance", "steps": steps}
+        if op == OP_OBSERVE and len(frame) == 1:
+            return {"op": "observe"}
+        if op == OP_PREDICT:
+            _, *values = self._predict_frame.unpack(frame)
+            return {"op": "predict", **dict(zip(self.predict_keys, values))}
+        raise ValueError("Malformed frame")
+
+    async def _socket_call(self, message, token: str | None):
+        """Run one socket message through its REST handler and return the result."""
+        if not isinstance(message, dict):
+            return JSONResponse(status_code=422, content={"detail": "Malformed message"})
+        op = message.get("op")
+        if op == "observe":
+            return await self.observe(x_session=token)
+        model = {"act": ActRequest, "advance": AdvanceRequest, "predict": self.PredictRequest}.get(op)
+        if model is None:
+            return JSONResponse(status_code=422, content={"detail": f"Unknown op: {op}"})
+        try:
+            req = model.model_validate(message)
+        except ValidationError:
+            return JSONResponse(status_code=422, content={"detail": f"Invalid {op} message"})
+        if op == "act":
+            return await self.act(req, x_session=token)
+        if op == "advance":
+            return await self.advance(req, x_session=token)
+        return await self.predict(req, x_session=token)
+
+    async def agent_socket(self, websocket: WebSocket):
+        """Long-lived agent channel; ``X-Session`` on the handshake picks the session."""
+        token = websocket.headers.get("x-session")
+        if self._session(token) is None:
+            await websocket.close(code=4404)
+            return
+        await websocket.accept()
+        while True:
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                return
+            binary = frame.get("bytes") is not None
+            try:
+                message = self._decode_frame(frame["bytes"]) if binary else json.loads(frame["text"])
+            except (ValueError, struct.error):
+                result = JSONResponse(status_code=422, content={"detail": "Malformed message"})
+            else:
+                result = await self._socket_call(message, token)
+            if isinstance(result, JSONResponse):
+                await websocket.send_text(_error_frame(result))
+            elif binary:
+                await websocket.send_bytes(self._observation_frame.pack(*result.values()) if result else b"")
+            else:
+                await websocket.send_text(json.dumps(result, separators=(",", ":")) if result else "{}")
+
+    # --- Submissions ---
+
+    async def done(self, req: DoneRequest, x_session: str | None = Header(default=None)):
+        sess = self._session(x_session)
+        if sess is None:
+            return _unknown_session()
+        record, future = sess.prediction, sess.prediction_future
+        if future is not None:
+            await asyncio.wrap_future(future)  # long finished unless /done follows /predict at once
+        prediction = None
+        if req.goal in self.prediction_goals and record is not None:
+            prediction = {k: v for k, v in record.items() if k != "outcomes"}
+            prediction.update(record["outcomes"].get(req.goal, {}))
+        # Take the open log segment and move the partition in one step so no
+        # request can land between them; the submission writer then owns the
+        # segment and frees it once the file is written.
+        trace = sess.api_log.take()
+        sess.done_log_start = done_log_start = len(sess.api_log)
+        audit = sess.audit.verdict(req.goal)
+        submission = {
+            "goal": req.goal,
+            "agent_id": req.agent_id,
+            "solver": req.solver,
+            "command": req.command,
+            "report": req.report,
+            "audit": audit,
+            "prediction": prediction,
+            "episodes": trace.episodes(),
+            "api_trace": trace,
+            "submitted_at": time.time(),
+        }
+        safe_id = req.agent_id.replace("/", "_").replace(" ", "_")
+        filename = f"goal_{req.goal}_{safe_id}{submissions.EXTENSION}"
+        path = os.path.join(self.submissions_dir, filename)
+        size = len(req.solver) + len(req.command) + len(req.report) + trace.nbytes
+        token = sess.token
+        wal = self.wal
+
+        def written():
+            # Only once the submission is on disk may recovery forget these calls.
+            wal.append(_WAL_DONE, token, 0, time.time(), _WAL_COUNT.pack(done_log_start))
+
+        if not self.submissions.try_submit(path, submission, size, written):
+            await asyncio.to_thread(self.submissions.submit, path, submission, size, written)
+        outcome = "ok" if audit["ok"] else "; ".join(audit["violations"])
+        print(f"{sess.tag}DONE goal={req.goal} agent={req.agent_id} audit={outcome} -> {filename}")
+        return {"status": "received"}
+
+    def bootstrap(self):
+        """Return a zip of agent_instructions.md and agent_briefing.md."""
+        files = {
+            "agent_instructions.md": os.path.join(os.path.dirname(self.dir), "agent_instructions.md"),
+            "agent_briefing.md": os.path.join(self.dir, "agent_briefing.md"),
+        }
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+            for arcname, path in files.items():
+                zf.write(path, arcname)
+        buf.seek(0)
+        return StreamingResponse(
+            buf,
+            media_type="application/zip",
+            headers={"Content-Disposition": "attachment; filename=bootstrap.zip"},
+        )
+
+    def dashboard(self):
+        return FileResponse(os.path.join(self.dir, "static", "index.html"))
+
+    def main(self, argv: list[str] | None = None):
+        args = _parse_args(argv, self.physics.__doc__)
+        self.app.state.wal_name = _wal_name(args)
+        if args.uds:
+            # Co-located agents skip TCP loopback; "auto" picks uvloop and
+            # httptools when they are installed.
+            uvicorn.run(self.app, uds=args.uds, loop="auto", http="auto")
+        else:
+            uvicorn.run(self.app, host="0.0.0.0", port=args.port)
+
+
+class CopyWorld(World):
+    """A world whose advances run on a copy of one session's State.
+
+    The world module's State has ``copy`` and ``load``; its ``advance``
+    logs to the tick log and ``evolve`` does not.
+    """
+
+    def _new_state(self, tag: str):
+        return self.physics.State()
+
+    def _scratch(self, s):
+        return s.copy()
+
+    def _commit(self, s, scratch):
+        s.load(scratch)
+
+    async def _advance_scratch(self, s, steps: int, tag: str, deadline: float) -> bool:
+        self.physics.consume_action(s)
+        return await self._run_advance(s, steps, tag, deadline)
+
+    async def _run_advance(self, s, steps: int, tag: str, deadline: float) -> bool:
+        """Advance ``s`` in chunks, yielding to the event loop between them.
+
+        The fast path is a single chunk; the TICK_ECHO tick loop runs
+        ADVANCE_CHUNK ticks per chunk. Returns False if the deadline passes
+        before the advance finishes.
+        """
+        while True:
+            n = min(steps, ADVANCE_CHUNK) if TICK_ECHO else steps
+            self.physics.advance(s, n, self.ticks, tag)
+            steps -= n
+            if not steps:
+                return True
+            await asyncio.sleep(0)
+            if time.monotonic() > deadline:
+                return False
+
+    def _run(self, s, steps: int):
+        self.physics.consume_action(s)
+        self.physics.evolve(s, steps)
+
+    def _replay_state(self):
+        return self.physics.State()
+
+    def _snapshot(self, s):
+        return s.copy()
+
+    def _restore(self, snapshot):
+        return snapshot.copy()
+
+
+# Outcomes of a queued advance.
+_COMMITTED, _CONFLICT, _TIMED_OUT = "committed", "conflict", "timed out"
+
+
+class _AdvanceBatcher:
+    """Runs the advances queued in one scheduling window as one batch.
+
+    A batch gathers its sessions' rows into a scratch store and steps them
+    together, yielding to the event loop between chunks so no batch can
+    monopolise it. Each advance commits back to the store atomically when it
+    finishes, so other requests only ever see whole advances. Advances are
+    all-or-nothing: one still running at its deadline is dropped and its
+    session is left exactly as it was, and one whose session changed while it
+    ran (a concurrent /act, /reset or /advance) reports a conflict so the
+    caller can retry from the new state.
+    """
+
+    def __init__(self, world: StoreWorld):
+        self.world = world
+        self._queue: list[tuple[Session, int, float, asyncio.Future]] = []
+        self._tasks: set[asyncio.Task] = set()
+
+    async def submit(self, sess: Session, steps: int, deadline: float) -> str:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._queue.append((sess, steps, deadline, fut))
+        if len(self._queue) == 1:
+            if ADVANCE_WINDOW > 0:
+                loop.call_later(ADVANCE_WINDOW, self._start)
+            else:
+                loop.call_soon(self._start)
+        return await fut
+
+    def _start(self):
+        batch, self._queue = self._queue, []
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list[tuple[Session, int, float, asyncio.Future]]):
+        store = self.world.store
+        open_ = set(range(len(batch)))
+        try:
+            slots = np.fromiter((b[0].state.slot for b in batch), dtype=np.intp, count=len(batch))
+            remaining = np.fromiter((b[1] for b in batch), dtype=np.int64, count=len(batch))
+            versions = [b[0].version for b in batch]
+            rows = store.gather(slots)
+            while open_:
+                rows.step(remaining)
+                now = time.monotonic()
+                for i in sorted(open_):
+                    sess, steps, deadline, fut = batch[i]
+                    if remaining[i] == 0:
+                        if sess.version != versions[i]:
+                            _settle(fut, _CONFLICT)
+                        else:
+                            store.scatter(rows, i, slots[i])
+                            sess.version += 1
+                            self.world._log(sess, "/advance", {"steps": steps})
+                            _settle(fut, _COMMITTED)
+                        open_.discard(i)
+                    elif now > deadline:
+                        remaining[i] = 0
+                        _settle(fut, _TIMED_OUT)
+                        open_.discard(i)
+                if open_:
+                    await asyncio.sleep(0)
+        finally:
+            for i in open_:
+                _settle(batch[i][3], _TIMED_OUT)
+
+
+def _settle(fut: asyncio.Future, outcome: str):
+    def resolve():
+        if not fut.done():
+            fut.set_result(outcome)
+
+    fut.get_loop().call_soon_threadsafe(resolve)
+
+
+async def _advance_rows(rows: SessionStore, steps: int, deadline: float) -> bool:
+    """Advance a one-row scratch store in chunks, yielding between them.
+
+    Used by /batch, whose advances must see the batch's own earlier commands
+    and so cannot join the shared batcher. Returns False if the deadline
+    passes before the advance finishes.
+    """
+    remaining = np.array([steps], dtype=np.int64)
+    while True:
+        rows.step(remaining)
+        if not remaining[0]:
+            return True
+        await asyncio.sleep(0)
+        if time.monotonic() > deadline:
+            return False
+
+
+class StoreWorld(World):
+    """A world whose sessions are rows of one SessionStore.
+
+    /advance joins the shared batcher, which steps every advance queued in
+    the same window together; /batch and predictions work on rows gathered
+    into scratch stores.
+    """
+
+    def _setup_state(self):
+        self.store = self.physics.SessionStore(MAX_SESSIONS + 1, self.ticks)
+        self._batcher = _AdvanceBatcher(self)
+
+    def _new_state(self, tag: str):
+        slot = self.store.alloc(tag)
+        return None if slot is None else self.physics.State(self.store, slot)
+
+    def _drop_state(self, s):
+        self.store.free(s.slot)
+
+    def _scratch(self, s):
+        return self.physics.State(self.store.gather(np.array([s.slot])), 0)
+
+    def _commit(self, s, scratch):
+        self.store.scatter(scratch.store, 0, s.slot)
+
+    async def _advance_scratch(self, s, steps: int, tag: str, deadline: float) -> bool:
+        return await _advance_rows(s.store, steps, deadline)
+
+    def _run(self, s, steps: int):
+        s.store.run(np.array([steps]))
+
+    def _replay_state(self):
+        rows = self.physics.SessionStore(1)
+        return self.physics.State(rows, rows.alloc())
+
+    def _snapshot(self, s):
+        return self.store.gather(np.array([s.slot]))
+
+    def _restore(self, snapshot):
+        run = self._replay_state()
+        run.store.scatter(snapshot, 0, run.slot)
+        return run
+
+    async def advance(self, req: AdvanceRequest, x_session: str | None = Header(default=None)):
+        sess = self._session(x_session)
+        if sess is None:
+            return _unknown_session()
+        if req.steps < 1:
+            return JSONResponse(status_code=422, content={"detail": "steps must be >= 1"})
+        deadline = time.monotonic() + ADVANCE_BUDGET
+        while True:
+            if (error := _overrun_error(sess.state.t, req.steps)) is not None:
+                return JSONResponse(status_code=422, content={"detail": error})
+            if (outcome := await self._batcher.submit(sess, req.steps, deadline)) != _CONFLICT:
+                break
+            if self._session(x_session) is not sess:
+                return _unknown_session()
+        if outcome == _TIMED_OUT:
+            print(f"{sess.tag}ADVANCE steps={req.steps} cancelled after {ADVANCE_BUDGET}s budget")
+            return JSONResponse(status_code=503, content={"detail": "advance exceeded time budget"})
@@ -0,0 +1,624 @@
+"""Read, write and migrate world submissions.
+
+Servers write submissions in a compact, versioned binary format (``.wsub``):
+
+    b"WSUB" | version (u8) | zlib(
+        header length (u32) | header JSON |
+        endpoint codes (u8 each) |
+        time deltas (i64 each) |
+        packed payloads
+    )
+
+The header is the submission itself with ``api_trace`` replaced by a
+descriptor: the entry count, the endpoint table the codes index into, and
+each endpoint's payload layout. A layout is ``[struct format, keys]`` for a
+fixed-size packed payload, ``"json"`` for a u32-length-prefixed JSON payload
+(used when converting traces whose payloads don't fit a fixed layout), or
+null for no payload. Times are stored as deltas between the float64 bit
+patterns of successive timestamps, which is exact and compresses well.
+
+The large text fields (``BLOB_FIELDS``) are not inline: the header holds
+``{"blob": <sha256>}`` and the text lives once, zlib-compressed, in
+``blobs/<first two hex digits>/<sha256>`` beside the submission.
+Resubmitting the same solver or report costs no extra storage.
+
+``load`` returns the same structure as the old JSON files, with
+``api_trace`` as a lazy ``Trace`` sequence of entry dicts that also exposes
+its columns for analysis. ``read_header`` returns just the metadata: it
+decompresses only the header and never opens a blob. For scans over many
+or very large files, ``stream`` yields trace entries, ``stream_columns``
+yields the trace as columnar chunks and ``endpoint_histogram`` counts calls,
+in memory bounded by ``STREAM_CHUNK`` whatever the trace length.
+
+    python tools/submissions.py convert [--keep] FILE...
+    python tools/submissions.py show [--header] FILE
+    python tools/submissions.py histogram FILE...
+"""
+
+from __future__ import annotations
+
+import argparse
+from collections.abc import Iterator, Sequence
+import contextlib
+import hashlib
+import json
+import os
+import struct
+import sys
+import tempfile
+import zlib
+
+import numpy as np
+
+MAGIC = b"WSUB"
+VERSION = 2
+EXTENSION = ".wsub"
+BLOB_FIELDS = ("solver", "report")
+STREAM_CHUNK = 1 << 16  # bytes inflated per read when streaming
+STREAM_ENTRIES = 4096  # trace entries decoded per batch when streaming
+_HEADER_LEN = struct.Struct("<I")
+_JSON_LEN = struct.Struct("<I")
+
+
+class Trace(Sequence):
+    """A submission's api_trace, decoded lazily from its columns."""
+
+    def __init__(
+        self,
+        endpoints: list[str],
+        layouts: dict,
+        codes: np.ndarray,
+        times: np.ndarray,
+        payloads: bytes,
+        offsets: np.ndarray | None = None,
+    ):
+        self.endpoints = endpoints
+        self.codes = codes
+        self.times = times
+        self._payloads = payloads
+        self._layouts = [_layout(layouts.get(e)) for e in endpoints]
+        self.offsets = _payload_offsets(self._layouts, codes, payloads) if offsets is None else offsets
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        code = self.codes[i]
+        return {
+            "endpoint": self.endpoints[code],
+            "payload": _unpack(self._layouts[code], self._payloads, int(self.offsets[i])),
+            "time": float(self.times[i]),
+        }
+
+    def endpoint_counts(self) -> dict[str, int]:
+        counts = np.bincount(self.codes, minlength=len(self.endpoints))
+        return {e: int(n) for e, n in zip(self.endpoints, counts) if n}
+
+
+def _layout(spec):
+    if spec is None or spec == "json":
+        return spec
+    fmt, keys = spec
+    return struct.Struct(fmt), tuple(keys)
+
+
+def _payload_offsets(layouts: list, codes: np.ndarray, payloads: bytes) -> np.ndarray:
+    if "json" not in layouts:
+        sizes = np.array([layout[0].size if layout else 0 for layout in layouts], dtype=np.int64)
+        return np.concatenate(([0], np.cumsum(sizes[codes])[:-1])) if len(codes) else np.zeros(0, np.int64)
+    offsets = np.empty(len(codes), dtype=np.int64)
+    offset = 0
+    for i, code in enumerate(codes):
+        offsets[i] = offset
+        layout = layouts[code]
+        if layout == "json":
+            offset += _JSON_LEN.size + _JSON_LEN.unpack_from(payloads, offset)[0]
+        elif layout is not None:
+            offset += layout[0].size
+    return offsets
+
+
+def _unpack(layout, payloads: bytes, offset: int):
+    if layout is None:
+        return None
+    if layout == "json":
+        (n,) = _JSON_LEN.unpack_from(payloads, offset)
+        start = offset + _JSON_LEN.size
+        return json.loads(bytes(payloads[start:start + n]))
+    fmt, keys = layout
+    values = fmt.unpack_from(payloads, offset)
+    return {k: v.decode() if isinstance(v, bytes) else v for k, v in zip(keys, values)}
+
+
+# --- Blobs ---
+
+
+def _fsync_dir(directory: str):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_atomic(path: str, data: bytes):
+    """Write ``data`` to ``path`` through a uniquely named temp file, fsynced and renamed.
+
+    The directory is fsynced after the rename, so the new name survives a
+    crash too.
+    """
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=os.path.dirname(path))
+    try:
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp)
+        raise
+    _fsync_dir(os.path.dirname(path) or ".")
+
+
+def _blob_path(blob_dir: str, digest: str) -> str:
+    return os.path.join(blob_dir, digest[:2], digest)
+
+
+def store_blob(blob_dir: str, text: str) -> str:
+    """Store ``text`` under its SHA-256 unless already present; return the digest."""
+    data = text.encode()
+    digest = hashlib.sha256(data).hexdigest()
+    path = _blob_path(blob_dir, digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_atomic(path, zlib.compress(data, 6))
+    return digest
+
+
+def store_blobs(submission: dict, blob_dir: str) -> dict:
+    """A copy of ``submission`` with its inline blob fields stored and referenced."""
+    return {
+        k: {"blob": store_blob(blob_dir, v)} if k in BLOB_FIELDS and isinstance(v, str) else v
+        for k, v in submission.items()
+    }
+
+
+def read_blob(blob_dir: str, digest: str) -> str:
+    with open(_blob_path(blob_dir, digest), "rb") as f:
+        return zlib.decompress(f.read()).decode()
+
+
+def _blob_dir(path: str) -> str:
+    return os.path.join(os.path.dirname(os.path.abspath(path)), "blobs")
+
+
+def _resolve_blobs(submission: dict, blob_dir: str) -> dict:
+    for field in BLOB_FIELDS:
+        value = submission.get(field)
+        if isinstance(value, dict) and "blob" in value:
+            submission[field] = read_blob(blob_dir, value["blob"])
+    return submission
+
+
+# --- Reading ---
+
+
+def load(path: str, blobs: bool = True) -> dict:
+    """Load a submission in either format as the JSON-shaped dict.
+
+    With ``blobs=False`` the blob fields are left as ``{"blob": <sha256>}``
+    references and the blob store is not touched.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        return json.loads(data)
+    submission = decode(data)
+    return _resolve_blobs(submission, _blob_dir(path)) if blobs else submission
+
+
+def read_header(path: str) -> dict:
+    """A submission's metadata without its trace or blobs.
+
+    Only the compressed prefix holding the header is inflated. The
+    ``api_trace`` value is the descriptor (count, endpoints, payloads).
+    """
+    if not _is_wsub(path):
+        with open(path) as f:
+            header = json.load(f)
+        header["api_trace"] = {"count": len(header["api_trace"])}
+        return header
+    with _Inflater(path) as body:
+        return _read_header(body)
+
+
+# --- Streaming ---
+
+
+def _is_wsub(path: str) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class _Inflater:
+    """Sequential reads from a .wsub body, inflating at most a chunk at a time."""
+
+    def __init__(self, path: str):
+        self._file = open(path, "rb")
+        if self._file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path}: not a .wsub submission")
+        _check_version(self._file.read(1)[0])
+        self._zlib = zlib.decompressobj()
+        self._buf = b""
+        self._pos = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._file.close()
+
+    def read(self, n: int) -> bytes:
+        end = self._pos + n
+        if end > len(self._buf):
+            parts = [self._buf[self._pos:]]
+            have = len(parts[0])
+            while have < n:
+                data = self._zlib.unconsumed_tail or self._file.read(STREAM_CHUNK)
+                if not data:
+                    raise ValueError(f"{self._file.name}: truncated submission")
+                parts.append(self._zlib.decompress(data, max(n - have, STREAM_CHUNK)))
+                have += len(parts[-1])
+            self._buf, self._pos, end = b"".join(parts), 0, n
+        out = self._buf[self._pos:end]
+        self._pos = end
+        return out
+
+    def skip(self, n: int):
+        while n > 0:
+            n -= len(self.read(min(n, STREAM_CHUNK)))
+
+
+def _read_header(body: _Inflater) -> dict:
+    (n,) = _HEADER_LEN.unpack(body.read(_HEADER_LEN.size))
+    return json.loads(body.read(n))
+
+
+def stream(path: str, blobs: bool = False) -> tuple[dict, Iterator[dict]]:
+    """A submission's metadata and a lazy iterator over its trace entries.
+
+    Memory stays bounded by ``STREAM_CHUNK`` however long the trace: the
+    endpoint, time and payload columns are each inflated by their own
+    reader, a chunk at a time. Blob fields stay references unless
+    ``blobs`` is set. Legacy JSON files are parsed whole; convert them.
+    """
+    if not _is_wsub(path):
+        submission = load(path)
+        trace = submission["api_trace"]
+        submission["api_trace"] = {"count": len(trace)}
+        return submission, iter(trace)
+    with _Inflater(path) as body:
+        header = _read_header(body)
+    if blobs:
+        _resolve_blobs(header, _blob_dir(path))
+    return header, _iter_entries(path, header["api_trace"])
+
+
+@contextlib.contextmanager
+def _column_readers(path: str, count: int) -> Iterator[tuple[_Inflater, _Inflater, _Inflater]]:
+    """One reader per trace column (codes, time deltas, payloads), each at its start."""
+    with _Inflater(path) as codes, _Inflater(path) as deltas, _Inflater(path) as payloads:
+        skip = _HEADER_LEN.size + _HEADER_LEN.unpack(codes.read(_HEADER_LEN.size))[0]
+        codes.skip(skip - _HEADER_LEN.size)
+        deltas.skip(skip + count)
+        payloads.skip(skip + 9 * count)
+        yield codes, deltas, payloads
+
+
+def _iter_entries(path: str, desc: dict) -> Iterator[dict]:
+    count = desc["count"]
+    endpoints = desc["endpoints"]
+    layouts = [_layout(desc["payloads"].get(e)) for e in endpoints]
+    with _column_readers(path, count) as (codes, deltas, payloads):
+        bits = np.int64(0)
+        for start in range(0, count, STREAM_ENTRIES):
+            n = min(STREAM_ENTRIES, count - start)
+            chunk_codes = codes.read(n)
+            chunk_bits = np.cumsum(np.frombuffer(deltas.read(8 * n), dtype="<i8")) + bits
+            bits = chunk_bits[-1]
+            for code, t in zip(chunk_codes, chunk_bits.view(np.float64).tolist()):
+                layout = layouts[code]
+                if layout is None:
+                    payload = None
+                elif layout == "json":
+                    payload = json.loads(payloads.read(_JSON_LEN.unpack(payloads.read(_JSON_LEN.size))[0]))
+                else:
+                    payload = _unpack(layout, payloads.read(layout[0].size), 0)
+                yield {"endpoint": endpoints[code], "payload": payload, "time": t}
+
+
+def stream_columns(path: str) -> tuple[dict, Iterator[Trace]]:
+    """A submission's metadata and its trace as columnar chunks.
+
+    Each chunk is a ``Trace`` of at most ``STREAM_ENTRIES`` entries, read
+    off the column readers ``stream`` uses, so memory stays bounded however
+    long the trace. A chunk's offsets index its own payload bytes. Blob
+    fields stay as they were written. Legacy JSON files are parsed whole
+    and come back as a single chunk, with the descriptor a ``.wsub`` header
+    would hold.
+    """
+    if not _is_wsub(path):
+        with open(path) as f:
+            header = json.load(f)
+        trace = decode_trace(header["api_trace"])
+        header["api_trace"] = {
+            "count": len(trace),
+            "endpoints": list(trace.endpoints),
+            "payloads": dict(zip(trace.endpoints, _layout_specs(trace))),
+        }
+        return header, iter([trace] if len(trace) else [])
+    with _Inflater(path) as body:
+        header = _read_header(body)
+    return header, _iter_chunks(path, header["api_trace"])
+
+
+def _iter_chunks(path: str, desc: dict) -> Iterator[Trace]:
+    count = desc["count"]
+    layouts = [_layout(desc["payloads"].get(e)) for e in desc["endpoints"]]
+    sizes = np.array([0 if layout in (None, "json") else layout[0].size for layout in layouts], dtype=np.int64)
+    with _column_readers(path, count) as (codes, deltas, payloads):
+        bits = np.int64(0)
+        for start in range(0, count, STREAM_ENTRIES):
+            n = min(STREAM_ENTRIES, count - start)
+            chunk_codes = np.frombuffer(codes.read(n), dtype=np.uint8)
+            chunk_bits = np.cumsum(np.frombuffer(deltas.read(8 * n), dtype="<i8")) + bits
+            bits = chunk_bits[-1]
+            if "json" in layouts:
+                parts = []
+                for code in chunk_codes:
+                    if layouts[code] == "json":
+                        prefix = payloads.read(_JSON_LEN.size)
+                        parts += [prefix, payloads.read(_JSON_LEN.unpack(prefix)[0])]
+                    else:
+                        parts.append(payloads.read(int(sizes[code])))
+                chunk_payloads = b"".join(parts)
+            else:
+                chunk_payloads = payloads.read(int(sizes[chunk_codes].sum()))
+            yield Trace(desc["endpoints"], desc["payloads"], chunk_codes, chunk_bits.view(np.float64), chunk_payloads)
+
+
+def endpoint_histogram(path: str) -> dict[str, int]:
+    """Calls per endpoint, inflating only the header and the code column."""
+    if not _is_wsub(path):
+        counts: dict[str, int] = {}
+        for entry in stream(path)[1]:
+            counts[entry["endpoint"]] = counts.get(entry["endpoint"], 0) + 1
+        return counts
+    with _Inflater(path) as body:
+        desc = _read_header(body)["api_trace"]
+        endpoints = desc["endpoints"]
+        counts = np.zeros(len(endpoints), dtype=np.int64)
+        for start in range(0, desc["count"], STREAM_CHUNK):
+            chunk = body.read(min(STREAM_CHUNK, desc["count"] - start))
+            counts += np.bincount(np.frombuffer(chunk, dtype=np.uint8), minlength=len(endpoints))
+    return {e: int(n) for e, n in zip(endpoints, counts) if n}
+
+
+def _check_version(version: int):
+    if version != VERSION:
+        raise ValueError(f"unsupported submission format version {version}")
+
+
+def decode(data: bytes) -> dict:
+    _check_version(data[len(MAGIC)])
+    body = zlib.decompress(data[len(MAGIC) + 1:])
+    (n,) = _HEADER_LEN.unpack_from(body)
+    start = _HEADER_LEN.size
+    header = json.loads(body[start:start + n])
+    desc = header["api_trace"]
+    count = desc["count"]
+    start += n
+    codes = np.frombuffer(body, dtype=np.uint8, count=count, offset=start)
+    start += count
+    deltas = np.frombuffer(body, dtype="<i8", count=count, offset=start)
+    start += 8 * count
+    times = np.cumsum(deltas, dtype=np.int64).view(np.float64)
+    header["api_trace"] = Trace(desc["endpoints"], desc["payloads"], codes, times, body[start:])
+    return header
+
+
+def episodes(submission: dict) -> dict:
+    """The submission's episode index: stored by the server since /done
+    began recording it, otherwise rebuilt from the trace's code column."""
+    if "episodes" in submission:
+        return submission["episodes"]
+    trace = submission["api_trace"]
+    if not isinstance(trace, Trace):
+        trace = decode_trace(trace)
+    codes = np.asarray(trace.codes)
+    endpoints = list(trace.endpoints)
+
+    def positions(endpoint):
+        return np.flatnonzero(codes == endpoints.index(endpoint)) if endpoint in endpoints else np.zeros(0, np.int64)
+
+    resets = positions("/reset")
+    bounds = np.concatenate(([0], resets, [len(codes)]))
+    return {
+        "endpoints": endpoints,
+        "resets": resets.tolist(),
+        "predicts": positions("/predict").tolist(),
+        "done": len(codes),
+        "counts": [np.bincount(codes[a:b], minlength=len(endpoints)).tolist() for a, b in zip(bounds[:-1], bounds[1:])],
+    }
+
+
+def decode_trace(entries: list[dict]) -> Trace:
+    """A list of JSON trace entries as a columnar Trace."""
+    endpoints = list(dict.fromkeys(e["endpoint"] for e in entries))
+    layouts = {e: _infer_layout([t["payload"] for t in entries if t["endpoint"] == e]) for e in endpoints}
+    code_of = {e: i for i, e in enumerate(endpoints)}
+    packed = b"".join(_pack(layouts[e["endpoint"]], e["payload"]) for e in entries)
+    codes = np.array([code_of[e["endpoint"]] for e in entries], dtype=np.uint8)
+    times = np.array([e["time"] for e in entries], dtype=np.float64)
+    return Trace(endpoints, layouts, codes, times, packed)
+
+
+# --- Writing ---
+
+
+def encode(submission: dict, blob_dir: str) -> bytes:
+    """Encode a submission whose ``api_trace`` is a Trace or a list of entries.
+
+    A list has its payload layouts inferred. The blob fields are written to
+    ``blob_dir`` and referenced by digest.
+    """
+    trace = submission["api_trace"]
+    if not isinstance(trace, Trace):
+        trace = decode_trace(trace)
+    submission = store_blobs(submission, blob_dir)
+    layouts = {e: layout for e, layout in zip(trace.endpoints, _layout_specs(trace))}
+    return _assemble(submission, trace.endpoints, layouts, trace.codes.tobytes(), trace.times, bytes(trace._payloads))
+
+
+def write(path: str, submission: dict):
+    """Write ``submission`` to ``path`` atomically, its blobs to ``blobs/`` beside it."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    write_atomic(path, encode(submission, _blob_dir(path)))
+
+
+def _layout_specs(trace: Trace) -> list:
+    """The JSON layout specs of a trace's parsed layouts."""
+    return [
+        None if layout is None else layout if layout == "json" else [layout[0].format, list(layout[1])]
+        for layout in trace._layouts
+    ]
+
+
+def _assemble(submission: dict, endpoints: list, layouts: dict, codes: bytes, times: np.ndarray, payloads: bytes) -> bytes:
+    header = dict(submission)
+    header["api_trace"] = {"count": len(codes), "endpoints": endpoints, "payloads": layouts}
+    head = json.dumps(header, separators=(",", ":")).encode()
+    bits = times.astype("<f8").view("<i8")
+    deltas = np.diff(bits, prepend=np.int64(0)).astype("<i8")
+    body = _HEADER_LEN.pack(len(head)) + head + codes + deltas.tobytes() + payloads
+    return MAGIC + bytes([VERSION]) + zlib.compress(body, 6)
+
+
+def _infer_layout(payloads: list):
+    """A fixed struct layout if every payload has the same keys and value types."""
+    if all(p is None for p in payloads):
+        return None
+    if any(not isinstance(p, dict) for p in payloads):
+        return "json"
+    keys = list(payloads[0])
+    if any(list(p) != keys for p in payloads):
+        return "json"
+    fmt = "<"
+    for k in keys:
+        values = [p[k] for p in payloads]
+        if all(type(v) is int for v in values):
+            fmt += "q"
+        elif all(type(v) is float for v in values):
+            fmt += "d"
+        elif all(isinstance(v, str) and len(v.encode()) == 1 for v in values):
+            fmt += "c"
+        else:
+            return "json"
+    return [fmt, keys]
+
+
+def _pack(layout, payload) -> bytes:
+    if layout is None:
+        return b""
+    if layout == "json":
+        data = json.dumps(payload, separators=(",", ":")).encode()
+        return _JSON_LEN.pack(len(data)) + data
+    fmt, keys = layout
+    return struct.pack(fmt, *(payload[k].encode() if isinstance(payload[k], str) else payload[k] for k in keys))
+
+
+# --- Migration ---
+
+
+def convert(path: str, keep: bool = False) -> str:
+    """Rewrite a JSON or older .wsub submission as current .wsub.
+
+    The round trip is verified before anything is replaced.
+    """
+    submission = load(path)
+    submission["api_trace"] = list(submission["api_trace"])
+    blob_dir = _blob_dir(path)
+    data = encode(submission, blob_dir)
+    decoded = _resolve_blobs(decode(data), blob_dir)
+    decoded["api_trace"] = list(decoded["api_trace"])
+    if decoded != submission:
+        raise ValueError(f"{path}: round trip mismatch, left as is")
+    out = os.path.splitext(path)[0] + EXTENSION
+    write_atomic(out, data)
+    if not keep and out != path:
+        os.remove(path)
+    return out
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("convert", help="migrate JSON and older .wsub submissions to the current format")
+    p.add_argument("--keep", action="store_true", help="keep the original JSON files")
+    p.add_argument("paths", nargs="+")
+    p = sub.add_parser("show", help="print a submission as JSON")
+    p.add_argument("--header", action="store_true", help="metadata only, without trace or blobs")
+    p.add_argument("path")
+    p = sub.add_parser("histogram", help="print calls per endpoint")
+    p.add_argument("paths", nargs="+")
+    args = parser.parse_args(argv)
+
+    if args.command == "show":
+        if args.header:
+            json.dump(read_header(args.path), sys.stdout, indent=2)
+            print()
+            return
+        # Printed entry by entry so even huge traces never sit in memory.
+        header, entries = stream(args.path, blobs=True)
+        print("{")
+        for i, key in enumerate(header):
+            end = "," if i < len(header) - 1 else ""
+            if key != "api_trace":
+                print(f"  {json.dumps(key)}: {json.dumps(header[key])}{end}")
+                continue
+            print('  "api_trace": [')
+            previous = None
+            for entry in entries:
+                if previous is not None:
+                    print(f"    {json.dumps(previous)},")
+                previous = entry
+            if previous is not None:
+                print(f"    {json.dumps(previous)}")
+            print(f"  ]{end}")
+        print("}")
+        return
+    if args.command == "histogram":
+        for path in args.paths:
+            counts = endpoint_histogram(path)
+            print(path + "  " + "  ".join(f"{e}={n}" for e, n in sorted(counts.items())))
+        return
+    for path in args.paths:
+        if not path.endswith((".json", EXTENSION)):
+            continue
+        before = os.path.getsize(path)
+        try:
+            out = convert(path, keep=args.keep)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            continue
+        print(f"{path} -> {out} ({before} -> {os.path.getsize(out)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
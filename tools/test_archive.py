@@ -0,0 +1,98 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import archive
+import submissions
+
+
+def test_archive_round_trips_submissions_as_views(write_corpus, calls, tmp_path):
+    root = str(tmp_path)
+    write_corpus(root, {
+        "world_6/submissions/goal_1_a.wsub": (1, "a", calls(1, 2)),
+        "world_6/submissions/goal_3_b.wsub": (3, "b", calls(2, 0) + [("/observe", {"x": 0.25, "t": 0})]),
+    })
+    assert archive.pack(6, root) == ["goal_1_a", "goal_3_b"]
+    assert archive.pack(6, root) == []  # unchanged files are not appended again
+    directory = os.path.join(root, "world_6", "submissions")
+    with archive.Archive(os.path.join(directory, archive.ARCHIVE_NAME)) as packed:
+        assert packed.names() == ["goal_1_a", "goal_3_b"]
+        for name in packed.names():
+            loaded = packed.load(name)
+            expected = submissions.load(os.path.join(directory, name + ".wsub"))
+            assert {k: v for k, v in loaded.items() if k != "api_trace"} == {k: v for k, v in expected.items() if k != "api_trace"}
+            assert list(loaded["api_trace"]) == list(expected["api_trace"])
+        trace = packed.trace("goal_3_b")
+        for column in (trace.codes, trace.times, trace.offsets):
+            assert not column.flags.owndata
+            assert np.shares_memory(column, np.frombuffer(packed._map, dtype=np.uint8))
+        assert trace[3:5] == list(expected["api_trace"])[3:5]
+        assert packed.header("goal_3_b")["solver"] == {"blob": packed.header("goal_3_b")["solver"]["blob"]}
+
+
+def test_archive_newest_member_wins_and_footers_chain(write_corpus, calls, tmp_path):
+    root = str(tmp_path)
+    write_corpus(root, {"world_6/submissions/goal_1_a.wsub": (1, "a", calls(1, 2))})
+    archive.pack(6, root)
+    write_corpus(root, {"world_6/submissions/goal_1_a.wsub": (1, "a2", calls(1, 5))})
+    write_corpus(root, {"world_6/submissions/goal_2_b.wsub": (2, "b", calls(0, 1))})
+    assert archive.pack(6, root) == ["goal_1_a", "goal_2_b"]
+    path = os.path.join(root, "world_6", "submissions", archive.ARCHIVE_NAME)
+    with archive.Archive(path) as packed:
+        assert len(packed) == 3
+        assert packed.names() == ["goal_1_a", "goal_2_b"]
+        assert packed.load("goal_1_a")["agent_id"] == "a2"
+        assert len(packed.trace("goal_1_a")) == 7
+        assert packed.load(0)["agent_id"] == "a"  # the overwritten member is still there by index
+    with open(path, "rb") as f:
+        data = f.read()
+    offset, length, _, _ = archive._TRAILER.unpack_from(data, len(data) - archive._TRAILER.size)
+    footer = json.loads(data[offset:offset + length])
+    assert [m["name"] for m in footer["members"]] == ["goal_1_a", "goal_2_b"]  # only this append's members
+    assert footer["previous"] is not None
+
+
+def test_archive_recovers_from_torn_append(write_corpus, calls, tmp_path):
+    root = str(tmp_path)
+    write_corpus(root, {"world_6/submissions/goal_1_a.wsub": (1, "a", calls(1, 2))})
+    archive.pack(6, root)
+    path = os.path.join(root, "world_6", "submissions", archive.ARCHIVE_NAME)
+    intact = os.path.getsize(path)
+    write_corpus(root, {"world_6/submissions/goal_2_b.wsub": (2, "b", calls(0, 3))})
+    archive.pack(6, root)
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 5)  # the second append's trailer is torn
+    with archive.Archive(path) as packed:
+        assert packed.names() == ["goal_1_a"]
+        assert packed.end == intact
+    # The next append cuts the torn tail off before writing.
+    assert archive.pack(6, root) == ["goal_2_b"]
+    with archive.Archive(path) as packed:
+        assert packed.names() == ["goal_1_a", "goal_2_b"]
+        assert packed.end == os.path.getsize(path)
+        assert len(packed.trace("goal_2_b")) == 4
+
+
+def test_archive_skips_footer_with_bad_crc(write_corpus, calls, tmp_path):
+    root = str(tmp_path)
+    write_corpus(root, {"world_6/submissions/goal_1_a.wsub": (1, "a", calls(1, 2))})
+    archive.pack(6, root)
+    path = os.path.join(root, "world_6", "submissions", archive.ARCHIVE_NAME)
+    intact = os.path.getsize(path)
+    write_corpus(root, {"world_6/submissions/goal_2_b.wsub": (2, "b", calls(0, 3))})
+    archive.pack(6, root)
+    with open(path, "r+b") as f:
+        data = f.read()
+        offset, _, _, _ = archive._TRAILER.unpack_from(data, len(data) - archive._TRAILER.size)
+        f.seek(offset + 2)
+        f.write(b"X")  # corrupt the newest footer
+    with archive.Archive(path) as packed:
+        assert packed.names() == ["goal_1_a"]
+        assert packed.end == intact
+    with open(path, "r+b") as f:
+        f.seek(intact - archive._TRAILER.size - 3)
+        f.write(b"X")  # and the one before it
+    with pytest.raises(ValueError):
+        archive.Archive(path)
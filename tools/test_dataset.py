@@ -0,0 +1,95 @@
+import math
+import os
+
+import numpy as np
+
+import archive
+import dataset
+import submissions
+
+
+def _mixed_calls(n):
+    calls = [("/reset", None), ("/observe", {"x": 0.0, "t": 0}), ("/predict", {"x": 0.5 * n})]
+    for i in range(n):
+        calls += [("/act", {"action": "AB"[i % 2], "value": 0.1 * i}), ("/advance", {"steps": i + 1})]
+    return calls + [("/observe", {"x": -1.25, "t": n * (n + 1) // 2})]
+
+
+def test_dataset_columns_match_submissions(write_corpus, calls, tmp_path):
+    root = str(tmp_path)
+    write_corpus(root, {
+        "world_6/submissions/goal_2_a.wsub": (2, "a", _mixed_calls(3)),
+        "world_6/submissions/goal_1_b.wsub": (1, "b", _mixed_calls(5)),
+        "world_5/submissions/goal_1_a.wsub": (1, "a", calls(2, 1)),
+    })
+    out = str(tmp_path / "dataset")
+    assert dataset.build(out, root) == (3, 0)
+    meta, columns = dataset.load(out)
+    keys = {name.removeprefix("payload_") for name in meta["columns"] if name.startswith("payload_")}
+    assert keys == {"action", "value", "steps", "x", "t"}
+    for i, source in enumerate(meta["submissions"]):
+        rows = np.flatnonzero(columns["submission"] == i)
+        entries = list(submissions.load(os.path.join(root, source["path"]))["api_trace"])
+        assert source["world"] == int(source["path"].split("/")[0].removeprefix("world_"))
+        assert list(columns["seq"][rows]) == list(range(len(entries)))
+        assert [meta["endpoints"][code] for code in columns["endpoint"][rows]] == [e["endpoint"] for e in entries]
+        assert list(columns["time"][rows]) == [e["time"] for e in entries]
+        for row, entry in zip(rows, entries):
+            payload = entry["payload"] or {}
+            for key in keys:
+                value = columns[f"payload_{key}"][row]
+                if key not in payload:
+                    assert value == b"" or value == 0 or math.isnan(value)
+                elif key == "action":
+                    assert value.decode() == payload[key]
+                else:
+                    assert value == payload[key]
+
+
+def test_archive_and_dataset_read_traces_a_chunk_at_a_time(write_corpus, tmp_path, monkeypatch):
+    monkeypatch.setattr(submissions, "STREAM_ENTRIES", 4)
+    root = str(tmp_path)
+    calls = _mixed_calls(6)
+    write_corpus(root, {"world_6/submissions/goal_2_a.wsub": (2, "a", calls)})
+    # /observe payloads of varying shape get a JSON layout.
+    directory = os.path.join(root, "world_6", "submissions")
+    entries = [{"endpoint": "/observe", "payload": {"x": 0.5} if i % 3 else {"x": 1.5, "t": i}, "time": 1.0 + i} for i in range(11)]
+    with open(os.path.join(directory, "goal_3_b.wsub"), "wb") as f:
+        f.write(submissions.encode({"goal": 3, "agent_id": "b", "solver": "", "report": "", "api_trace": entries}, os.path.join(directory, "blobs")))
+
+    def whole(*args, **kwargs):
+        raise AssertionError("loaded a whole submission")
+
+    monkeypatch.setattr(submissions, "load", whole)
+    assert archive.pack(6, root) == ["goal_2_a", "goal_3_b"]
+    out = str(tmp_path / "dataset")
+    assert dataset.build(out, root) == (2, 0)
+    monkeypatch.undo()
+    with archive.Archive(os.path.join(directory, archive.ARCHIVE_NAME)) as packed:
+        for name in packed.names():
+            assert list(packed.trace(name)) == list(submissions.load(os.path.join(directory, name + ".wsub"))["api_trace"])
+    meta, columns = dataset.load(out)
+    assert list(columns["submission"]) == [0] * len(calls) + [1] * len(entries)
+    assert list(columns["payload_steps"][:len(calls)]) == [(payload or {}).get("steps", 0) for _, payload in calls]
+    assert list(columns["time"][len(calls):]) == [e["time"] for e in entries]
+
+
+def test_dataset_rebuilds_only_changed_and_drops_deleted(write_corpus, calls, tmp_path):
+    root = str(tmp_path)
+    write_corpus(root, {
+        "world_6/submissions/goal_1_a.wsub": (1, "a", calls(1, 2)),
+        "world_6/submissions/goal_1_b.wsub": (1, "b", calls(2, 2)),
+        "world_5/submissions/goal_2_c.wsub": (2, "c", calls(0, 1)),
+    })
+    out = str(tmp_path / "dataset")
+    assert dataset.build(out, root) == (3, 0)
+    assert dataset.build(out, root) == (0, 0)
+    write_corpus(root, {"world_6/submissions/goal_1_b.wsub": (1, "b", calls(2, 6))})
+    os.remove(os.path.join(root, "world_5/submissions/goal_2_c.wsub"))
+    assert dataset.build(out, root) == (1, 1)
+    assert len(os.listdir(os.path.join(out, "parts"))) == 2
+    meta, columns = dataset.load(out)
+    assert [s["path"] for s in meta["submissions"]] == ["world_6/submissions/goal_1_a.wsub", "world_6/submissions/goal_1_b.wsub"]
+    assert meta["agents"] == ["a", "b"]
+    assert len(columns["time"]) == 4 + 9
+    assert list(np.bincount(columns["submission"])) == [4, 9]
@@ -0,0 +1,96 @@
+import os
+
+import pytest
+
+import grade
+import server_core
+import submissions
+
+
+def play(client, *calls):
+    """Make ``calls`` ((endpoint, json) pairs) on the default session; returns the last /observe."""
+    seen = None
+    for endpoint, body in calls:
+        if endpoint == "/observe":
+            r = client.get("/observe")
+            assert r.status_code == 200
+            seen = r.json()
+        else:
+            assert client.post(endpoint, json=body).status_code in (200, 204)
+    return seen
+
+
+def test_grader_scores_prediction_on_seeded_world(serve):
+    server, client = serve(1)
+    start = len(server.api_log)
+    x0 = play(client, ("/reset", None), ("/observe", None))["x"]
+    play(client, ("/predict", {"x": x0 + 10.0}), ("/act", {"action": "A", "value": 2.0}), ("/advance", {"steps": 5}), ("/observe", None))
+    verdict = grade.grade(server, {"goal": 2, "agent_id": "a", "api_trace": server.api_log[start:]})
+    assert verdict["status"] == "pass", verdict["violations"]
+    assert verdict["actual"] == pytest.approx(x0 + 10.0)
+    assert verdict["error"] == pytest.approx(0.0, abs=1e-9)
+
+
+def test_grader_checks_targets_between_observations(serve):
+    server, client = serve(1)
+    start = len(server.api_log)
+    x0 = play(client, ("/reset", None), ("/observe", None))["x"]
+    play(client, ("/act", {"action": "A", "value": 5.0}), ("/advance", {"steps": 20}))  # t = 10 is never observed
+    play(client, ("/act", {"action": "A", "value": 0.0}))
+    verdict = grade.grade(server, {"goal": 1, "agent_id": "a", "api_trace": server.api_log[start:]})
+    assert verdict["status"] == "fail"
+    assert verdict["observed"]["10"]["x"] == pytest.approx(x0 + 50.0)
+    assert verdict["violations"][0].startswith("/act called 2 times")
+    assert "at t=10, target 50.0" in verdict["violations"][1]
+
+
+def test_grader_scores_prediction_against_true_outcome(serve):
+    server, client = serve(6)
+    start = len(server.api_log)
+    actual = play(
+        client, ("/reset", None), ("/observe", None), ("/predict", {"x": 0.5}),
+        ("/act", {"action": "A", "value": 0.2}), ("/advance", {"steps": 30}), ("/observe", None),
+    )["x"]
+    verdict = grade.grade(server, {"goal": 2, "agent_id": "a", "api_trace": server.api_log[start:]})
+    assert verdict["status"] == "pass", verdict["violations"]
+    assert verdict["actual"] == actual
+    assert verdict["error"] == 0.5 - actual
+
+
+def test_grader_checks_every_target(serve):
+    server, client = serve(6)
+    start = len(server.api_log)
+    play(client, ("/reset", None), ("/advance", {"steps": 60}))  # x stays 0 without actions
+    verdict = grade.grade(server, {"goal": 3, "agent_id": "a", "api_trace": server.api_log[start:]})
+    assert verdict["status"] == "fail"
+    assert verdict["violations"] == ["x=0.0 at t=50, target 3.0 ± 0.2"]
+    assert sorted(verdict["observed"]) == ["40", "50"]
+
+
+def test_grader_streams_final_episode_and_stamps_cache(serve, tmp_path, monkeypatch):
+    server, client = serve(6)
+    start = len(server.api_log)
+    play(client, ("/reset", None), ("/advance", {"steps": 3}))  # an earlier episode, not scored
+    play(
+        client, ("/reset", None), ("/observe", None), ("/predict", {"x": 0.5}),
+        ("/act", {"action": "A", "value": 0.2}), ("/advance", {"steps": 30}), ("/observe", None),
+    )
+    segment = server_core.LogSegment(server.world.schema)
+    for entry in server.api_log[start:]:
+        segment.append(entry["endpoint"], entry["payload"], entry["time"])
+    directory = tmp_path / "world_6" / "submissions"
+    directory.mkdir(parents=True)
+    os.symlink(server.__file__, tmp_path / "world_6" / "server.py")
+    path = str(directory / "goal_2_a.wsub")
+    server_core._write_submission(path, {"goal": 2, "agent_id": "a", "solver": "", "command": "", "report": "", "episodes": segment.episodes(), "api_trace": segment})
+
+    expected = grade.grade(server, submissions.load(path))
+    verdict = grade.grade_file(6, path, str(tmp_path))
+    assert verdict == {**expected, "agent_id": "a"}
+    assert verdict["status"] == "pass", verdict["violations"]
+
+    cache = str(tmp_path / "grades.json")
+    assert grade.run([6], str(tmp_path), cache, jobs=1)[1] == 1
+    assert grade.run([6], str(tmp_path), cache, jobs=1)[1] == 0
+    monkeypatch.setattr(grade, "_grader_digest", lambda: "edited")
+    assert grade.run([6], str(tmp_path), cache, jobs=1)[1] == 1
@@ -0,0 +1,47 @@
+import os
+
+import index
+
+
+def test_index_reindexes_only_changed_files(write_corpus, calls, tmp_path):
+    root = str(tmp_path)
+    write_corpus(root, {
+        "world_6/submissions/goal_1_a.wsub": (1, "a", calls(1, 2)),
+        "world_6/submissions/goal_2_b.wsub": (2, "b", calls(2, 3)),
+        "world_5/submissions/goal_1_c.wsub": (1, "c", calls(0, 4)),
+    })
+    conn = index.connect(str(tmp_path / "index.db"))
+    assert index.update(conn, root) == (3, 0)
+    assert index.update(conn, root) == (0, 0)
+
+    touched = os.path.join(root, "world_6/submissions/goal_1_a.wsub")
+    st = os.stat(touched)
+    os.utime(touched, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert index.update(conn, root) == (1, 0)
+
+    write_corpus(root, {"world_6/submissions/goal_2_b.wsub": (2, "b", calls(2, 7))})
+    os.remove(os.path.join(root, "world_5/submissions/goal_1_c.wsub"))
+    assert index.update(conn, root) == (1, 1)
+    rows = index.query(conn)
+    assert [(world, goal, agent, calls) for world, goal, agent, _, calls, _ in rows] == [(6, 1, "a", 4), (6, 2, "b", 10)]
+    assert conn.execute("SELECT count(*) FROM endpoint_counts WHERE path LIKE 'world_5/%'").fetchone() == (0,)
+
+
+def test_index_counts_calls_per_endpoint(write_corpus, calls, tmp_path, capsys):
+    root = str(tmp_path)
+    write_corpus(root, {
+        "world_6/submissions/goal_1_a.wsub": (1, "a", calls(1, 2)),
+        "world_6/submissions/goal_3_a.wsub": (3, "a", calls(0, 5)),
+        "world_4/submissions/goal_1_b.wsub": (1, "b", calls(3, 1)),
+    })
+    conn = index.connect(str(tmp_path / "index.db"))
+    index.update(conn, root)
+    counts = {(world, goal): calls for world, goal, _, _, calls, _ in index.query(conn, endpoint="/act")}
+    assert counts == {(4, 1): 3, (6, 1): 1, (6, 3): 0}
+    assert [row[:2] for row in index.query(conn, world=6, agent="a", endpoint="/advance")] == [(6, 1), (6, 3)]
+    assert [row[4] for row in index.query(conn, world=6, goal=3, endpoint="/advance")] == [5]
+
+    index.main(["--db", str(tmp_path / "index.db"), "--root", root, "query", "--world", "4", "--endpoint", "/act"])
+    out = capsys.readouterr().out.splitlines()
+    assert out[0].split() == ["world", "goal", "agent_id", "submitted_at", "/act", "path"]
+    assert out[1].split()[:5] == ["4", "1", "b", "5.0", "3"]
@@ -0,0 +1,288 @@
+import os
+import threading
+
+from fastapi.testclient import TestClient
+import numpy as np
+import pytest
+
+import server_core
+import submissions
+
+
+def new_session(client):
+    r = client.post("/reset", headers={"X-Session": "new"})
+    assert r.status_code == 200
+    return {"X-Session": r.json()["session"]}
+
+
+# --- Columnar API log ---
+
+
+def test_api_log_round_trips_entries(serve):
+    server, _ = serve(6)
+    log = server_core.ApiLog(server.world.schema)
+    log.append("/reset", None, 1.0)
+    log.append("/act", {"action": "A", "value": -0.5}, 2.0)
+    log.append("/advance", {"steps": 10**15}, 3.0)
+    log.append("/predict", {"x": 1.5}, 4.0)
+    assert log[1] == {"endpoint": "/act", "payload": {"action": "A", "value": -0.5}, "time": 2.0}
+    assert log[-2]["payload"] == {"steps": 10**15}
+    assert [e["payload"] for e in log[2:]] == [{"steps": 10**15}, {"x": 1.5}]
+
+
+def test_api_log_take_hands_off_segment(serve):
+    server, _ = serve(6)
+    log = server_core.ApiLog(server.world.schema)
+    for i in range(3):
+        log.append("/observe", {"x": 0.0, "t": 0}, float(i))
+    segment = log.take()
+    assert [e["time"] for e in segment] == [0.0, 1.0, 2.0]
+    log.append("/reset", None, 3.0)
+    assert len(log) == 4
+    assert log[3]["endpoint"] == "/reset"
+    assert log[2:] == [log[3]]
+
+
+def test_api_log_is_compact(serve):
+    server, _ = serve(6)
+    log = server_core.ApiLog(server.world.schema)
+    for i in range(1000):
+        log.append("/act", {"action": "A", "value": 0.5}, float(i))
+        log.append("/advance", {"steps": 1}, float(i))
+    assert log.take().nbytes / 2000 < 32
+
+
+def test_log_segment_keeps_episode_index(serve):
+    server, _ = serve(6)
+    segment = server_core.LogSegment(server.world.schema)
+    act = {"action": "A", "value": 1.0}
+    segment.append("/observe", {"x": 0.0, "t": 0}, 1.0)
+    segment.append("/reset", None, 2.0)
+    segment.append("/act", act, 3.0)
+    segment.append("/reset", None, 4.0)
+    segment.append("/act", act, 5.0)
+    segment.append("/act", act, 6.0)
+    segment.append("/predict", {"x": 1.0}, 7.0)
+    index = segment.episodes()
+    assert index["resets"] == [1, 3]
+    assert index["predicts"] == [6]
+    assert index["done"] == 7
+    code = server.world.schema.endpoints.index("/act")
+    assert [counts[code] for counts in index["counts"]] == [0, 1, 2]
+    assert sum(map(sum, index["counts"])) == len(segment)
+
+
+# --- Write-ahead log ---
+
+
+def test_wal_records_every_logged_call(serve):
+    server, client = serve(6)
+    h = new_session(client)
+    tok = h["X-Session"]
+    client.post("/act", json={"action": "A", "value": 0.5}, headers=h)
+    client.post("/advance", json={"steps": 2}, headers=h)
+    server.world.wal.flush()
+    with server_core.WalReader(server.world.wal.path) as reader:
+        done_at, segment = reader.recover(server.world.schema)[tok]
+    assert done_at == 0
+    assert list(segment) == server.world.sessions[tok].api_log[0:]
+
+
+def test_wal_recovery_applies_done_close_and_torn_tail(serve, tmp_path):
+    server, _ = serve(6)
+    path = str(tmp_path / "api.wal")
+    wal = server_core.WriteAheadLog(path, server.world.schema)
+    for i in range(3):
+        code, packed = server.world.schema.pack("/advance", {"steps": i + 1})
+        wal.append(server_core._WAL_CALL, "a", code, float(i), packed)
+        wal.append(server_core._WAL_CALL, "b", code, float(i), packed)
+    wal.append(server_core._WAL_DONE, "a", 0, 3.0, server_core._WAL_COUNT.pack(2))
+    wal.append(server_core._WAL_CLOSE, "b", 0, 3.0)
+    wal.append(server_core._WAL_CALL, "c", code, 3.0, packed)
+    wal.append(server_core._WAL_DONE, "c", 0, 3.0, server_core._WAL_COUNT.pack(1))  # nothing left to recover
+    code, packed = server.world.schema.pack("/observe", {"x": 0.0, "t": 0})
+    wal.append(server_core._WAL_CALL, None, code, 4.0, packed)
+    wal.close()
+    with open(path, "ab") as f:
+        f.write(b"\x00torn")
+    with server_core.WalReader(path) as reader:
+        recovered = reader.recover(server.world.schema)
+    assert set(recovered) == {"a", ""}
+    done_at, segment = recovered["a"]
+    assert done_at == 2
+    assert [e["payload"] for e in segment] == [{"steps": 3}]
+    assert [e["endpoint"] for e in recovered[""][1]] == ["/observe"]
+    # Restarting compacts the file down to exactly the recovered state.
+    server_core.WriteAheadLog(path, server.world.schema, recovered).close()
+    with server_core.WalReader(path) as reader:
+        again = reader.recover(server.world.schema)
+    assert {tok: (n, list(seg)) for tok, (n, seg) in again.items()} == {
+        tok: (n, list(seg)) for tok, (n, seg) in recovered.items()
+    }
+
+
+def test_wal_is_per_listener_and_locked(serve, tmp_path):
+    server, _ = serve(6)
+    names = {server_core._wal_name(server_core._parse_args(argv)) for argv in ([], ["--port", "9001"], ["--uds", "/tmp/w.sock"])}
+    assert len(names) == 3
+    path = str(tmp_path / "api.wal")
+    wal = server_core.WriteAheadLog(path, server.world.schema)
+    with pytest.raises(RuntimeError):
+        server_core.WriteAheadLog(path, server.world.schema)
+    wal.close()
+    server_core.WriteAheadLog(path, server.world.schema).close()
+
+
+def test_wal_opens_at_startup_named_by_listener(serve, tmp_path, monkeypatch):
+    server, _ = serve(6)
+    monkeypatch.setattr(server.world, "wal", server.world.wal)  # the module's own WAL, restored afterwards
+    monkeypatch.setattr(server_core, "WAL_DIR", str(tmp_path))
+    monkeypatch.setattr(server.app.state, "wal_name", server_core._wal_name(server_core._parse_args(["--port", "9001"])), raising=False)
+    with TestClient(server.app):
+        assert server.world.wal.path == str(tmp_path / "api-9001.wal")
+    monkeypatch.setattr(server_core, "WAL_NAME", "mine.wal")
+    with TestClient(server.app):
+        assert server.world.wal.path == str(tmp_path / "mine.wal")
+
+
+def test_wal_compacts_while_running_and_indexes_sessions(serve, tmp_path, monkeypatch):
+    server, _ = serve(6)
+    monkeypatch.setattr(server_core, "WAL_COMPACT_BYTES", 2000)
+    path = str(tmp_path / "api.wal")
+    wal = server_core.WriteAheadLog(path, server.world.schema)
+    code, packed = server.world.schema.pack("/advance", {"steps": 1})
+    for i in range(100):
+        wal.append(server_core._WAL_CALL, "a", code, float(i), packed)
+        wal.append(server_core._WAL_CALL, "b", code, float(i), packed)
+        if i % 10 == 9:
+            wal.append(server_core._WAL_DONE, "a", 0, float(i), server_core._WAL_COUNT.pack(i + 1))
+            wal.flush()
+    wal.flush()
+    assert os.path.getsize(path) < 6000
+    assert wal.session("a") is None  # everything submitted, so compaction dropped it
+    done_at, segment = wal.session("b")
+    assert (done_at, len(segment)) == (0, 100)
+    with server_core.WalReader(path) as reader:
+        assert {tok: list(offsets) for tok, offsets in reader.index().items()} == {
+            tok: list(offsets) for tok, offsets in wal.index.items()
+        }
+    wal.close()
+
+
+# --- Tick log ---
+
+
+def test_tick_log_ring_wraps_and_drops_when_full(serve):
+    server, _ = serve(6)
+    ring = server_core.TickLog(4, server.TICK_DTYPE)
+    records = np.zeros(3, dtype=server.TICK_DTYPE)
+    records["t"] = range(3)
+    ring.push(records)
+    assert len(ring.drain()) == 3
+    records = np.zeros(6, dtype=server.TICK_DTYPE)
+    records["t"] = range(3, 9)
+    records["tag"] = "[abc] "
+    ring.push(records)
+    out = ring.drain()
+    assert ring.dropped == 2
+    assert list(out["t"]) == [3, 4, 5, 6]
+    assert server.format_tick(out[0]).split()[:2] == ["[abc]", "t=3"]
+    for t in range(9, 14):
+        ring.append("", t, 0.0, 0.0, 0.0, 1.0)
+    assert ring.dropped == 3
+    assert list(ring.drain()["t"]) == [9, 10, 11, 12]
+    assert server_core._sample(10, 3) == [2, 5, 9]
+    assert server_core._sample(2, 3) == [0, 1]
+
+
+# --- Submission writer ---
+
+
+def test_submission_writer_bounds_queued_bytes(serve, tmp_path):
+    server, _ = serve(6)
+
+    def sub(n):
+        return {"n": n, "api_trace": server_core.LogSegment(server.world.schema)}
+
+    writer = server_core.SubmissionWriter(max_bytes=10)
+    release = threading.Event()
+    assert writer.try_submit(str(tmp_path / "a.wsub"), sub(1), 8, release.wait)
+    assert not writer.try_submit(str(tmp_path / "b.wsub"), sub(2), 8, lambda: None)
+    release.set()
+    writer.flush()
+    assert writer.try_submit(str(tmp_path / "b.wsub"), sub(2), 8, lambda: None)
+    writer.submit(str(tmp_path / "c.wsub"), sub(3), 8, lambda: None)
+    writer.close()
+    assert sorted(os.listdir(tmp_path)) == ["a.wsub", "b.wsub", "c.wsub"]
+    assert submissions.load(tmp_path / "c.wsub")["n"] == 3
+
+
+def test_submission_format_round_trips_trace(serve, tmp_path):
+    server, _ = serve(6)
+    segment = server_core.LogSegment(server.world.schema)
+    segment.append("/reset", None, 1700000000.25)
+    segment.append("/act", {"action": "A", "value": -0.5}, 1700000000.5)
+    segment.append("/advance", {"steps": 10**15}, 1700000003.125)
+    segment.append("/observe", {"x": 0.0, "t": 0}, 1699999999.0)
+    submission = {"goal": 1, "agent_id": "a", "solver": "s", "command": "c", "report": "r", "api_trace": segment, "submitted_at": 5.0}
+    server_core._write_submission(str(tmp_path / "s.wsub"), submission)
+    loaded = submissions.load(tmp_path / "s.wsub")
+    assert list(loaded) == list(submission)
+    assert list(loaded["api_trace"]) == list(segment)
+    assert loaded["solver"] == "s" and loaded["submitted_at"] == 5.0
+    header, entries = submissions.stream(str(tmp_path / "s.wsub"))
+    assert header["api_trace"]["count"] == 4
+    assert list(entries) == list(segment)
+    assert submissions.endpoint_histogram(str(tmp_path / "s.wsub")) == {"/reset": 1, "/act": 1, "/advance": 1, "/observe": 1}
+
+
+def test_submission_blobs_are_shared_and_skipped_by_header(serve, tmp_path):
+    server, _ = serve(6)
+    solver = "def solve():\n    return 42\n" * 100
+    for goal in (1, 2):
+        submission = {"goal": goal, "agent_id": "a", "solver": solver, "command": "", "report": "r", "api_trace": server_core.LogSegment(server.world.schema)}
+        server_core._write_submission(str(tmp_path / f"goal_{goal}_a.wsub"), submission)
+    blobs = [f for _, _, files in os.walk(tmp_path / "blobs") for f in files]
+    assert len(blobs) == 2  # one solver, one report, shared by both goals
+    assert submissions.load(tmp_path / "goal_2_a.wsub")["solver"] == solver
+    header = submissions.read_header(str(tmp_path / "goal_2_a.wsub"))
+    assert header["goal"] == 2 and set(header["solver"]) == {"blob"}
+
+
+def test_concurrent_writers_never_share_a_temp_file(serve, tmp_path):
+    server, _ = serve(6)
+    path = str(tmp_path / "goal_1_a.wsub")
+    errors = []
+
+    def write(i):
+        try:
+            for j in range(20):
+                submission = {"goal": 1, "agent_id": "a", "solver": f"{i}.{j}", "command": "", "report": "r", "api_trace": server_core.LogSegment(server.world.schema)}
+                server_core._write_submission(path, submission)
+        except Exception as e:
+            errors.append(e)
+
+    writers = [threading.Thread(target=write, args=(i,)) for i in range(4)]
+    for w in writers:
+        w.start()
+    for w in writers:
+        w.join()
+    assert errors == []
+    assert sorted(os.listdir(tmp_path)) == ["blobs", "goal_1_a.wsub"]
+    assert submissions.load(tmp_path / "goal_1_a.wsub")["report"] == "r"
+
+
+def test_done_marks_wal_only_after_write(serve, tmp_path, monkeypatch):
+    server, client = serve(6)
+    monkeypatch.setattr(server.world, "submissions_dir", str(tmp_path))
+    h = new_session(client)
+    tok = h["X-Session"]
+    body = {"goal": 2, "agent_id": "w", "solver": "", "command": "", "report": ""}
+    client.post("/done", json=body, headers=h)
+    server.world.submissions.flush()
+    server.world.wal.flush()
+    assert sorted(os.listdir(tmp_path)) == ["blobs", "goal_2_w.wsub"]
+    with server_core.WalReader(server.world.wal.path) as reader:
+        kinds = [(kind, payload) for _, kind, token, _, _, payload in reader.records() if token == tok]
+        assert kinds[-1] == (server_core._WAL_DONE, server_core._WAL_COUNT.pack(1))
+        assert tok not in reader.recover(server.world.schema)  # nothing unsubmitted, so a restart drops it
@@ -2,169 +2,185 @@
 
 from __future__ import annotations
 
-import io
-import json
 import math
 import os
 import random
-import time
-import zipfile
+import struct
+import sys
 
-from fastapi import FastAPI
-from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
-from pydantic import BaseModel
-import uvicorn
+import numpy as np
 
-app = FastAPI(docs_url=None, redoc_url=None, openapi_url=None)
-
-# --- State ---
-x: float = 0.0
-v: float = 0.0
-t: int = 0
-pending_action: float | None = None
+_TOOLS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tools")
+if _TOOLS not in sys.path:
+    sys.path.insert(0, _TOOLS)
+import server_core as core  # noqa: E402
 
 X_RESET_MIN, X_RESET_MAX = -10.0, 10.0
 A_MIN, A_MAX = -5.0, 5.0
 DT = 1.0
 
-api_log: list[dict] = []
-_done_log_start: int = 0
+# The goals (agent_briefing.md), in the form core.GoalAuditor documents.
+GOALS = {
+    1: {"type": "action", "act_budget": 1, "per_action": False, "targets": [{"t": 10, "x": 50.0, "tol": 0.0}]},
+    2: {"type": "prediction", "experiment": {"acts": [["A", 2.0]], "t": 5}},
+}
+
+# Endpoint -> (packed payload layout, payload keys), or None for no payload.
+# The key order here also fixes each endpoint's interned code.
+PAYLOADS = {
+    "/reset": (struct.Struct("<q"), ("seed",)),
+    "/act": (struct.Struct("<cd"), ("action", "value")),
+    "/advance": (struct.Struct("<q"), ("steps",)),
+    "/observe": (struct.Struct("<dq"), ("x", "t")),
+    "/predict": (struct.Struct("<d"), ("x",)),
+}
+
+TICK_DTYPE = np.dtype([("tag", "S11"), ("t", "<i8"), ("x", "<f8"), ("v", "<f8")])
+
+
+def format_tick(record) -> str:
+    tag, t, x, v = record.item()
+    return f"  {tag.decode()}t={t} x={x:.6f} v={v:.6f}"
+
+
+# --- State ---
+
+
+class State:
+    __slots__ = ("x", "v", "t", "pending_action")
+
+    def __init__(self):
+        self.x = 0.0
+        self.v = 0.0
+        self.t = 0
+        self.pending_action: float | None = None
+
+    def copy(self) -> State:
+        other = State.__new__(State)
+        other.load(self)
+        return other
+
+    def load(self, other: State):
+        for name in State.__slots__:
+            setattr(self, name, getattr(other, name))
+
+
+def reset_state(s: State, seed: int):
+    """Start an episode from the state ``seed`` draws, so the logged seed reproduces it."""
+    rng = random.Random(seed)
+    s.x = rng.uniform(X_RESET_MIN, X_RESET_MAX)
+    s.v = 0.0
+    s.t = 0
+    s.pending_action = None
+
+
+def act_error(action: str, value: float) -> str | None:
+    """Why an act is invalid, or None if it is valid."""
+    if action != "A":
+        return f"Unknown action: {action}"
+    if not math.isfinite(value):
+        return "value must be finite"
+    return None
+
+
+def apply_act(s: State, action: str, value: float) -> float:
+    """Clamp ``value`` into range and make it the pending action; returns it."""
+    clamped = max(A_MIN, min(A_MAX, value))
+    s.pending_action = clamped
+    return clamped
 
 
-def _log(endpoint: str, payload=None):
-    api_log.append({"endpoint": endpoint, "payload": payload, "time": time.time()})
+def consume_action(s: State):
+    """Apply and clear the pending action, as the start of every advance does."""
+    if s.pending_action is not None:
+        s.v = s.pending_action
+        s.pending_action = None
 
 
-def _tick():
-    global x, t
-    x += v * DT
-    t += 1
-    print(f"  t={t} x={x:.6f} v={v:.6f}")
+def observation(s: State) -> dict:
+    return {"x": round(s.x, 10), "t": s.t}
 
 
-class ActRequest(BaseModel):
-    action: str
-    value: float
-
-
-class AdvanceRequest(BaseModel):
-    steps: int
-
-
-class PredictRequest(BaseModel):
-    x: float
-
-
-class DoneRequest(BaseModel):
-    goal: int
-    agent_id: str
-    solver: str
-    command: str
-    report: str
-
-
-@app.post("/reset", status_code=204)
-def reset():
-    global x, v, t, pending_action
-    x = random.uniform(X_RESET_MIN, X_RESET_MAX)
-    v = 0.0
-    t = 0
-    pending_action = None
-    _log("/reset")
-    print(f"RESET x={x:.6f}")
-
-
-@app.post("/act", status_code=204)
-def act(req: ActRequest):
-    global pending_action
-    if req.action != "A":
-        return JSONResponse(status_code=422, content={"detail": f"Unknown action: {req.action}"})
-    if not math.isfinite(req.value):
-        return JSONResponse(status_code=422, content={"detail": "value must be finite"})
-    clamped = max(A_MIN, min(A_MAX, req.value))
-    pending_action = clamped
-    _log("/act", {"action": req.action, "value": clamped})
-    print(f"ACT action={req.action} value={clamped:.6f}")
-
-
-@app.post("/advance", status_code=204)
-def advance(req: AdvanceRequest):
-    global v, pending_action
-    if req.steps < 1:
-        return JSONResponse(status_code=422, content={"detail": "steps must be >= 1"})
-    _log("/advance", {"steps": req.steps})
-    if pending_action is not None:
-        v = pending_action
-        pending_action = None
-    for _ in range(req.steps):
-        _tick()
-
-
-@app.get("/observe")
-def observe():
-    _log("/observe")
-    return {"x": round(x, 10), "t": t}
-
-
-@app.post("/predict", status_code=204)
-def predict(req: PredictRequest):
-    _log("/predict", {"x": req.x})
-    print(f"PREDICT x={req.x:.6f}")
-
-
-_world_dir = os.path.dirname(os.path.abspath(__file__))
-_submissions_dir = os.path.join(_world_dir, "submissions")
-
-
-@app.post("/done")
-def done(req: DoneRequest):
-    global _done_log_start
-    os.makedirs(_submissions_dir, exist_ok=True)
-    trace = api_log[_done_log_start:]
-    _done_log_start = len(api_log)
-    submission = {
-        "goal": req.goal,
-        "agent_id": req.agent_id,
-        "solver": req.solver,
-        "command": req.command,
-        "report": req.report,
-        "api_trace": trace,
-        "submitted_at": time.time(),
-    }
-    safe_id = req.agent_id.replace("/", "_").replace(" ", "_")
-    filename = f"goal_{req.goal}_{safe_id}.json"
-    path = os.path.join(_submissions_dir, filename)
-    with open(path, "w") as f:
-        json.dump(submission, f, indent=2)
-    print(f"DONE goal={req.goal} agent={req.agent_id} -> {filename}")
-    return {"status": "received"}
-_project_root = os.path.dirname(_world_dir)
-_static = os.path.join(_world_dir, "static")
-
-
-@app.get("/bootstrap")
-def bootstrap():
-    """Return a zip of agent_instructions.md and agent_briefing.md."""
-    files = {
-        "agent_instructions.md": os.path.join(_project_root, "agent_instructions.md"),
-        "agent_briefing.md": os.path.join(_world_dir, "agent_briefing.md"),
-    }
-    buf = io.BytesIO()
-    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
-        for arcname, path in files.items():
-            zf.write(path, arcname)
-    buf.seek(0)
-    return StreamingResponse(
-        buf,
-        media_type="application/zip",
-        headers={"Content-Disposition": "attachment; filename=bootstrap.zip"},
+def _tick(s: State, ticks: core.TickLog, tag: str = ""):
+    s.x += s.v * DT
+    s.t += 1
+    ticks.append(tag, s.t, s.x, s.v)
+
+
+# --- Matrix-power advance ---
+# Between actions the dynamics are linear, so N ticks are one 2x2 transition
+# matrix on (x, v) raised to the N-th power by repeated squaring.
+
+Matrix = tuple[tuple[float, float], tuple[float, float]]
+_IDENTITY: Matrix = ((1.0, 0.0), (0.0, 1.0))
+
+
+def _mat_mul(a: Matrix, b: Matrix) -> Matrix:
+    return (
+        (a[0][0] * b[0][0] + a[0][1] * b[1][0], a[0][0] * b[0][1] + a[0][1] * b[1][1]),
+        (a[1][0] * b[0][0] + a[1][1] * b[1][0], a[1][0] * b[0][1] + a[1][1] * b[1][1]),
     )
 
 
-@app.get("/")
-def dashboard():
-    return FileResponse(os.path.join(_static, "index.html"))
+def _mat_pow(m: Matrix, n: int) -> Matrix:
+    result = _IDENTITY
+    while n:
+        if n & 1:
+            result = _mat_mul(result, m)
+        m = _mat_mul(m, m)
+        n >>= 1
+    return result
+
+
+def _apply(m: Matrix, s: State):
+    s.x, s.v = m[0][0] * s.x + m[0][1] * s.v, m[1][0] * s.x + m[1][1] * s.v
+
+
+_STEP: Matrix = ((1.0, DT), (0.0, 1.0))
+
+
+def evolve(s: State, steps: int):
+    """Advance ``steps`` ticks in O(log steps), without touching the tick log."""
+    _apply(_mat_pow(_STEP, steps), s)
+    s.t += steps
+
+
+def advance(s: State, steps: int, ticks: core.TickLog, tag: str = ""):
+    """Advance ``steps`` ticks and log the result; TICK_ECHO falls back to the tick loop."""
+    if core.TICK_ECHO:
+        for _ in range(steps):
+            _tick(s, ticks, tag)
+        return
+    evolve(s, steps)
+    ticks.append(tag, s.t, s.x, s.v)
+
+
+# --- Replay ---
+
+# The matrix power rounds a handful of times per advance and the TICK_ECHO
+# tick loop once per tick, so the two drift apart by about an ulp of the
+# value per tick since /reset. An observation at t may be off by
+# max(1, |value|) * (REPLAY_TOLERANCE + REPLAY_DRIFT * t).
+REPLAY_TOLERANCE = 1e-9
+REPLAY_DRIFT = 1e-15  # per tick; the worst drift measured is about 3e-17
+
+
+def same_observation(logged: dict, s: State) -> bool:
+    replayed = observation(s)
+    if logged["t"] != replayed["t"]:
+        return False
+    allowance = REPLAY_TOLERANCE + REPLAY_DRIFT * logged["t"]
+    return all(
+        abs(logged[k] - replayed[k]) <= allowance * max(1.0, abs(logged[k])) for k in logged if k != "t"
+    )
+
 
+world = core.CopyWorld(sys.modules[__name__])
+app = world.app
+replay = world.replay
+verify = world.verify
+state = world.default_session.state
+api_log = world.default_session.api_log
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8080)
+    world.main()
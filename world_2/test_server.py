@@ -1,10 +1,23 @@
+import os
+import tempfile
+
+os.environ.setdefault("WAL_DIR", tempfile.mkdtemp())  # keep test runs out of world_N/wal
+os.environ.setdefault("TICK_ECHO_RATE", "0")  # keep the console tick sample out of test output
+
 from fastapi.testclient import TestClient
+import pytest
 
 from server import app
 
 client = TestClient(app)
 
 
+@pytest.fixture(autouse=True, scope="module")
+def serving():
+    with client:  # runs the startup hook, which opens the WAL
+        yield
+
+
 def reset():
     r = client.post("/reset")
     assert r.status_code == 204
@@ -215,13 +228,13 @@ def _sim(x0, v, steps):
 def test_bounce_right_wall():
     """Ball moving right should reflect off the right wall."""
     reset()
-    from server import x as _, WALL_HI
+    from server import WALL_HI
     import server
 
-    server.x = 47.0
-    server.v = 0.0
-    server.t = 0
-    server.pending_action = None
+    server.state.x = 47.0
+    server.state.v = 0.0
+    server.state.t = 0
+    server.state.pending_action = None
 
     act("A", 5.0)
     advance(1)
@@ -238,10 +251,10 @@ def test_bounce_left_wall():
     reset()
     import server
 
-    server.x = 3.0
-    server.v = 0.0
-    server.t = 0
-    server.pending_action = None
+    server.state.x = 3.0
+    server.state.v = 0.0
+    server.state.t = 0
+    server.state.pending_action = None
 
     act("A", -5.0)
     advance(1)
@@ -258,10 +271,10 @@ def test_multi_bounce_trajectory():
     reset()
     import server
 
-    server.x = 10.0
-    server.v = 0.0
-    server.t = 0
-    server.pending_action = None
+    server.state.x = 10.0
+    server.state.v = 0.0
+    server.state.t = 0
+    server.state.pending_action = None
 
     act("A", 4.0)
     advance(30)
@@ -275,10 +288,10 @@ def test_multi_bounce_negative_velocity():
     reset()
     import server
 
-    server.x = 40.0
-    server.v = 0.0
-    server.t = 0
-    server.pending_action = None
+    server.state.x = 40.0
+    server.state.v = 0.0
+    server.state.t = 0
+    server.state.pending_action = None
 
     act("A", -3.5)
     advance(40)
@@ -294,10 +307,10 @@ def test_ball_stays_in_bounds():
 
     for v_val in [-5.0, -3.0, -1.0, 1.0, 3.0, 5.0]:
         for x0 in [1.0, 10.0, 25.0, 40.0, 49.0]:
-            server.x = x0
-            server.v = 0.0
-            server.t = 0
-            server.pending_action = None
+            server.state.x = x0
+            server.state.v = 0.0
+            server.state.t = 0
+            server.state.pending_action = None
             act("A", v_val)
             advance(100)
             s = observe()
@@ -309,10 +322,10 @@ def test_velocity_reversal_on_bounce():
     reset()
     import server
 
-    server.x = 48.0
-    server.v = 0.0
-    server.t = 0
-    server.pending_action = None
+    server.state.x = 48.0
+    server.state.v = 0.0
+    server.state.t = 0
+    server.state.pending_action = None
 
     act("A", 5.0)
     advance(1)
@@ -329,10 +342,10 @@ def test_exact_wall_hit():
     reset()
     import server
 
-    server.x = 45.0
-    server.v = 0.0
-    server.t = 0
-    server.pending_action = None
+    server.state.x = 45.0
+    server.state.v = 0.0
+    server.state.t = 0
+    server.state.pending_action = None
 
     act("A", 5.0)
     advance(1)
@@ -357,3 +370,570 @@ def test_goal1_exact_targeting():
         s = observe()
         assert abs(s["x"] - 25.0) < 1e-9
         assert s["t"] == 10
+
+
+# --- Sessions ---
+
+
+def new_session():
+    r = client.post("/reset", headers={"X-Session": "new"})
+    assert r.status_code == 200
+    return {"X-Session": r.json()["session"]}
+
+
+def test_session_mint_returns_token():
+    h = new_session()
+    r = client.get("/observe", headers=h)
+    assert r.status_code == 200
+    assert r.json()["t"] == 0
+
+
+def test_sessions_are_isolated():
+    reset()
+    before = observe()
+    h = new_session()
+    client.post("/act", json={"action": "A", "value": 2.0}, headers=h)
+    client.post("/advance", json={"steps": 3}, headers=h)
+    assert client.get("/observe", headers=h).json()["t"] == 3
+    assert observe() == before
+
+
+def test_session_api_log_is_separate():
+    import server
+    h = new_session()
+    client.get("/observe", headers=h)
+    sess = server.world.sessions[h["X-Session"]]
+    assert [e["endpoint"] for e in sess.api_log] == ["/reset", "/observe"]
+
+
+def test_unknown_session_404():
+    h = {"X-Session": "nope"}
+    assert client.get("/observe", headers=h).status_code == 404
+    assert client.post("/act", json={"action": "A", "value": 1.0}, headers=h).status_code == 404
+    assert client.post("/advance", json={"steps": 1}, headers=h).status_code == 404
+
+
+def test_close_session():
+    h = new_session()
+    assert client.delete("/session", headers=h).status_code == 204
+    assert client.get("/observe", headers=h).status_code == 404
+
+
+# --- Closed-form advance ---
+
+
+def _loop(x0, v0, n, monkeypatch):
+    import server
+    s = server.State()
+    s.x, s.v = x0, v0
+    monkeypatch.setattr(server.core, "TICK_ECHO", True)
+    server.advance(s, n, server.world.ticks)
+    monkeypatch.setattr(server.core, "TICK_ECHO", False)
+    return s.x, s.v
+
+
+def test_fold_matches_tick_loop(monkeypatch):
+    import random as rnd
+    import server
+    rng = rnd.Random(3)
+    for _ in range(200):
+        x0, v0 = rng.uniform(0.0, 50.0), rng.uniform(-5.0, 5.0)
+        n = rng.randint(1, 2000)
+        fx, fv = server._fold(x0, v0, n)
+        lx, lv = _loop(x0, v0, n, monkeypatch)
+        assert abs(fx - lx) < 1e-9
+        assert fv == lv
+
+
+def test_fold_wall_hits_are_inclusive(monkeypatch):
+    import server
+    # Land exactly on each wall, start on each wall, and pass through several bounces.
+    for x0, v0, n in [(45.0, 5.0, 1), (5.0, -5.0, 1), (50.0, -2.0, 7), (0.0, 2.0, 7), (45.0, 5.0, 21), (25.0, -2.5, 40)]:
+        assert server._fold(x0, v0, n) == _loop(x0, v0, n, monkeypatch)
+
+
+def test_huge_advance_is_fast():
+    import time
+    reset()
+    act("A", 3.0)
+    start = time.perf_counter()
+    assert advance(10_000_000).status_code == 204
+    assert time.perf_counter() - start < 1.0
+    s = observe()
+    assert s["t"] == 10_000_000
+    assert 0.0 <= s["x"] <= 50.0
+
+
+# --- Time-budgeted advance ---
+
+
+def _set(x, v, pending=None):
+    import server
+    reset()
+    server.state.x = x
+    server.state.v = v
+    server.state.t = 0
+    server.state.pending_action = pending
+
+
+def test_advance_over_budget_is_rolled_back(monkeypatch):
+    import server
+    _set(10.0, 1.0, pending=2.0)
+    log_len = len(server.api_log)
+    monkeypatch.setattr(server.core, "TICK_ECHO", True)
+    monkeypatch.setattr(server.core, "ADVANCE_BUDGET", 0.0)
+    r = advance(10 * server.core.ADVANCE_CHUNK)
+    assert r.status_code == 503
+    assert observe() == {"x": 10.0, "t": 0}
+    assert server.state.v == 1.0
+    assert server.state.pending_action == 2.0
+    assert [e["endpoint"] for e in server.api_log[log_len:]] == ["/observe"]
+
+
+def test_advance_conflict_retries_from_new_state(monkeypatch):
+    import server
+    _set(10.0, 0.0, pending=1.0)
+    real_run = server.world._run_advance
+    calls = []
+
+    async def run(s, steps, tag, deadline):
+        if not calls:
+            # Simulate an /act landing while the first attempt is in flight.
+            server.state.pending_action = 2.0
+            server.world.default_session.version += 1
+        calls.append(1)
+        return await real_run(s, steps, tag, deadline)
+
+    monkeypatch.setattr(server.world, "_run_advance", run)
+    log_len = len(server.api_log)
+    assert advance(1).status_code == 204
+    assert len(calls) == 2
+    assert abs(observe()["x"] - 12.0) < 1e-9
+    assert [e["endpoint"] for e in server.api_log[log_len:]] == ["/advance", "/observe"]
+
+
+def test_long_advance_does_not_block_observe(monkeypatch):
+    import asyncio
+    import time
+    import httpx
+    import server
+    monkeypatch.setattr(server.core, "TICK_ECHO", True)
+    monkeypatch.setattr(server.core, "ADVANCE_BUDGET", 0.5)
+    monkeypatch.setattr(server.core, "print", lambda *a, **k: None, raising=False)
+    h = new_session()
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+            runaway = asyncio.create_task(c.post("/advance", json={"steps": 10**9}))
+            await asyncio.sleep(0.1)
+            start = time.perf_counter()
+            r = await c.get("/observe", headers=h)
+            latency = time.perf_counter() - start
+            return r, latency, await runaway
+
+    r, latency, runaway = asyncio.run(scenario())
+    assert r.status_code == 200
+    assert latency < 0.1
+    assert runaway.status_code == 503
+
+
+# --- Batch ---
+
+
+def batch(commands, headers=None):
+    return client.post("/batch", json={"commands": commands}, headers=headers)
+
+
+def test_batch_matches_single_calls():
+    import server
+    _set(10.0, 1.0)
+    act("A", 2.0)
+    advance(3)
+    first = observe()
+    advance(5)
+    second = observe()
+    _set(10.0, 1.0)
+    log_len = len(server.api_log)
+    r = batch([
+        {"op": "act", "action": "A", "value": 2.0},
+        {"op": "advance", "steps": 3},
+        {"op": "observe"},
+        {"op": "advance", "steps": 5},
+        {"op": "observe"},
+    ])
+    assert r.status_code == 200
+    assert r.json() == {"observations": [first, second]}
+    trace = server.api_log[log_len:]
+    assert [e["endpoint"] for e in trace] == ["/act", "/advance", "/observe", "/advance", "/observe"]
+    assert [e["payload"] for e in trace] == [
+        {"action": "A", "value": 2.0}, {"steps": 3}, first, {"steps": 5}, second,
+    ]
+
+
+def test_batch_clamps_act():
+    import server
+    reset()
+    log_len = len(server.api_log)
+    r = batch([{"op": "act", "action": "A", "value": 1e9}])
+    assert r.json() == {"observations": []}
+    assert server.api_log[log_len]["payload"] == {"action": "A", "value": server.A_MAX}
+
+
+def test_batch_invalid_command_applies_nothing():
+    import server
+    reset()
+    before = observe()
+    log_len = len(server.api_log)
+    r = batch([{"op": "advance", "steps": 4}, {"op": "act", "action": "Z", "value": 1.0}])
+    assert r.status_code == 422
+    assert r.json() == {"detail": "commands[1]: Unknown action: Z"}
+    assert batch([{"op": "advance", "steps": 0}]).status_code == 422
+    assert batch([{"op": "act", "action": "A"}]).status_code == 422
+    assert batch([{"op": "jump"}]).status_code == 422
+    assert observe() == before
+    assert len(server.api_log) == log_len + 1
+
+
+def test_advance_past_max_t_is_rejected():
+    import server
+    reset()
+    assert advance(2**63).status_code == 422
+    assert batch([{"op": "advance", "steps": 2**63}]).status_code == 422
+    server.state.t = server.core.MAX_T - 2
+    before = observe()
+    assert advance(3).status_code == 422
+    r = batch([{"op": "advance", "steps": 1}, {"op": "advance", "steps": 2}])
+    assert r.status_code == 422
+    assert r.json() == {"detail": f"commands[1]: advance would take t past {server.core.MAX_T}"}
+    assert observe() == before
+    assert advance(2).status_code == 204
+    assert observe()["t"] == server.core.MAX_T
+
+
+def test_batch_over_budget_is_rolled_back(monkeypatch):
+    import server
+    reset()
+    before = observe()
+    log_len = len(server.api_log)
+    monkeypatch.setattr(server.core, "TICK_ECHO", True)
+    monkeypatch.setattr(server.core, "ADVANCE_BUDGET", 0.0)
+    r = batch([{"op": "observe"}, {"op": "advance", "steps": 10 * server.core.ADVANCE_CHUNK}])
+    assert r.status_code == 503
+    assert observe() == before
+    assert len(server.api_log) == log_len + 1
+
+
+def test_batch_uses_session():
+    h = new_session()
+    r = batch([{"op": "advance", "steps": 2}, {"op": "observe"}], headers=h)
+    assert r.status_code == 200
+    assert r.json()["observations"][0]["t"] == 2
+    assert batch([{"op": "observe"}], headers={"X-Session": "nope"}).status_code == 404
+
+
+# --- Agent socket ---
+
+
+def test_socket_matches_rest():
+    import server
+    _set(10.0, 1.0)
+    act("A", 2.0)
+    advance(3)
+    expected = observe()
+    _set(10.0, 1.0)
+    log_len = len(server.api_log)
+    with client.websocket_connect("/ws") as ws:
+        ws.send_json({"op": "act", "action": "A", "value": 2.0})
+        assert ws.receive_json() == {}
+        ws.send_json({"op": "advance", "steps": 3})
+        assert ws.receive_json() == {}
+        ws.send_json({"op": "observe"})
+        assert ws.receive_json() == expected
+        ws.send_json({"op": "predict", "x": 1.0})
+        assert ws.receive_json() == {}
+    trace = server.api_log[log_len:]
+    assert [e["endpoint"] for e in trace] == ["/act", "/advance", "/observe", "/predict"]
+    assert [e["payload"] for e in trace] == [
+        {"action": "A", "value": 2.0}, {"steps": 3}, expected, {"x": 1.0},
+    ]
+
+
+def test_socket_binary_frames():
+    import struct
+    import server
+    _set(10.0, 1.0)
+    act("A", 1e9)
+    advance(2)
+    expected = observe()
+    _set(10.0, 1.0)
+    log_len = len(server.api_log)
+    with client.websocket_connect("/ws") as ws:
+        ws.send_bytes(struct.pack("<Bcd", server.core.OP_ACT, b"A", 1e9))
+        assert ws.receive_bytes() == b""
+        ws.send_bytes(struct.pack("<Bq", server.core.OP_ADVANCE, 2))
+        assert ws.receive_bytes() == b""
+        ws.send_bytes(bytes([server.core.OP_OBSERVE]))
+        assert struct.unpack("<dq", ws.receive_bytes()) == tuple(expected.values())
+    assert server.api_log[log_len]["payload"] == {"action": "A", "value": server.A_MAX}
+
+
+def test_socket_errors_match_rest():
+    import server
+    reset()
+    log_len = len(server.api_log)
+    with client.websocket_connect("/ws") as ws:
+        ws.send_json({"op": "act", "action": "Z", "value": 1.0})
+        assert ws.receive_json() == {"error": 422, "detail": "Unknown action: Z"}
+        ws.send_json({"op": "advance", "steps": 0})
+        assert ws.receive_json() == {"error": 422, "detail": "steps must be >= 1"}
+        ws.send_json({"op": "advance"})
+        assert ws.receive_json()["error"] == 422
+        ws.send_json({"op": "jump"})
+        assert ws.receive_json()["error"] == 422
+        ws.send_text("not json")
+        assert ws.receive_json()["error"] == 422
+        ws.send_bytes(b"\xff")
+        assert ws.receive_json()["error"] == 422
+    assert len(server.api_log) == log_len
+
+
+def test_socket_uses_session():
+    import pytest
+    from starlette.websockets import WebSocketDisconnect
+    h = new_session()
+    with client.websocket_connect("/ws", headers=h) as ws:
+        ws.send_json({"op": "advance", "steps": 4})
+        ws.receive_json()
+    assert client.get("/observe", headers=h).json()["t"] == 4
+    with pytest.raises(WebSocketDisconnect):
+        with client.websocket_connect("/ws", headers={"X-Session": "nope"}):
+            pass
+
+
+# --- Unix socket serving ---
+
+
+def test_serves_on_unix_socket(tmp_path):
+    import os
+    import subprocess
+    import sys
+    import time
+    import httpx
+    path = str(tmp_path / "world.sock")
+    proc = subprocess.Popen(
+        [sys.executable, "server.py", "--uds", path],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env={**os.environ, "WAL_DIR": str(tmp_path)},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        with httpx.Client(transport=httpx.HTTPTransport(uds=path), base_url="http://world") as c:
+            deadline = time.monotonic() + 15
+            while not os.path.exists(path):
+                assert proc.poll() is None and time.monotonic() < deadline
+                time.sleep(0.05)
+            assert c.post("/reset").status_code == 204
+            assert c.post("/advance", json={"steps": 3}).status_code == 204
+            assert c.get("/observe").json()["t"] == 3
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+# --- Concurrency ---
+
+
+def test_concurrent_clients_stay_consistent(monkeypatch):
+    import asyncio
+    import httpx
+    import server
+    monkeypatch.setattr(server.core, "print", lambda *a, **k: None, raising=False)
+    rounds = 30
+
+    async def agent(c, h):
+        t = 0
+        seen = []
+        for i in range(rounds):
+            assert (await c.post("/act", json={"action": "A", "value": 1.0}, headers=h)).status_code == 204
+            assert (await c.post("/advance", json={"steps": 1 + i % 3}, headers=h)).status_code == 204
+            t += 1 + i % 3
+            seen.append((await c.get("/observe", headers=h)).json()["t"])
+            assert seen[-1] == t
+        return seen
+
+    async def dashboard(c, running):
+        seen = []
+        while not running.done():
+            seen.append((await c.get("/observe")).json()["t"])
+            await asyncio.sleep(0)
+        return seen
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+            await c.post("/reset")
+            tokens = [(await c.post("/reset", headers={"X-Session": "new"})).json()["session"] for _ in range(8)]
+            headers = [{}] + [{"X-Session": tok} for tok in tokens]
+            running = asyncio.ensure_future(asyncio.gather(*(agent(c, h) for h in headers)))
+            polled = await dashboard(c, running)
+            return tokens, await running, polled
+
+    log_len = len(server.api_log)
+    tokens, seen, polled = asyncio.run(scenario())
+    # Observers only ever see whole advances, in order.
+    assert polled == sorted(polled)
+    assert set(polled) <= {0, *seen[0]}
+    # Each session's log is exactly its own requests, in request order.
+    expected = ["/reset"] + ["/act", "/advance", "/observe"] * rounds
+    for tok in tokens:
+        assert [e["endpoint"] for e in server.world.sessions[tok].api_log] == expected
+    own = [e["endpoint"] for e in server.api_log[log_len:] if e["endpoint"] != "/observe"]
+    assert own == ["/reset"] + ["/act", "/advance"] * rounds
+
+
+def test_done_writes_trace_since_last_done(tmp_path, monkeypatch):
+    import server
+    monkeypatch.setattr(server.world, "submissions_dir", str(tmp_path))
+    h = new_session()
+    body = {"goal": 1, "agent_id": "a b", "solver": "", "command": "", "report": ""}
+    assert client.post("/done", json=body, headers=h).json() == {"status": "received"}
+    client.get("/observe", headers=h)
+    client.post("/done", json=body, headers=h)
+    server.world.submissions.flush()
+    submission = load_submission(tmp_path / "goal_1_a_b.wsub")
+    assert [e["endpoint"] for e in submission["api_trace"]] == ["/observe"]
+    assert submission["episodes"]["resets"] == []
+    assert submission["episodes"]["done"] == 1
+
+
+# --- Tick log ---
+
+
+def test_advance_writes_every_tick_to_tick_file(tmp_path, monkeypatch):
+    import numpy as np
+    import server
+    monkeypatch.setattr(server.core, "TICK_ECHO", True)
+    server.world.drain_ticks()  # so the file gets only this advance's ticks
+    path = tmp_path / "ticks.bin"
+    with open(path, "wb") as f:
+        monkeypatch.setattr(server.world, "tick_file", f)
+        h = new_session()
+        client.post("/advance", json={"steps": 5}, headers=h)
+        server.world.drain_ticks()
+    records = np.frombuffer(path.read_bytes(), dtype=server.TICK_DTYPE)
+    assert records["t"].tolist() == [1, 2, 3, 4, 5]
+    assert {tag.decode() for tag in records["tag"]} == {f"[{h['X-Session'][:8]}] "}
+    assert server.format_tick(records[0]).split()[:2] == [f"[{h['X-Session'][:8]}]", "t=1"]
+
+
+# --- Submissions ---
+
+
+def load_submission(path):
+    import submissions  # tools/, which importing server puts on sys.path
+    return submissions.load(str(path))
+
+
+# --- Goal audit ---
+
+
+def test_audit_counts_acts_after_final_reset():
+    import server
+    h = new_session()
+    audit = server.world.sessions[h["X-Session"]].audit
+    budget = server.GOALS[1]["act_budget"]
+    for _ in range(budget + 3):  # exploring before the final reset is free
+        client.post("/act", json={"action": "A", "value": 1.0}, headers=h)
+    client.post("/reset", headers=h)
+    for _ in range(budget):
+        client.post("/act", json={"action": "A", "value": 1.0}, headers=h)
+    assert audit.verdict(1)["ok"]
+    client.post("/act", json={"action": "A", "value": 1.0}, headers=h)
+    verdict = audit.verdict(1)
+    assert not verdict["ok"]
+    assert verdict["acts"] == budget + 1
+    assert len(verdict["violations"]) == 1
+
+
+def test_done_attaches_audit(tmp_path, monkeypatch):
+    import server
+    monkeypatch.setattr(server.world, "submissions_dir", str(tmp_path))
+    h = new_session()
+    body = {"goal": 1, "agent_id": "a", "solver": "", "command": "", "report": ""}
+    client.post("/done", json=body, headers=h)
+    server.world.submissions.flush()
+    audit = load_submission(tmp_path / "goal_1_a.wsub")["audit"]
+    assert audit["goal"] == 1 and audit["ok"] and audit["acts"] == 0
+    body["goal"] = 99
+    client.post("/done", json=body, headers=h)
+    server.world.submissions.flush()
+    assert load_submission(tmp_path / "goal_99_a.wsub")["audit"]["violations"] == ["unknown goal 99"]
+
+
+# --- Replay ---
+
+
+def test_replay_reproduces_logged_trajectory():
+    import server
+    start = len(server.api_log)
+    reset()
+    act("A", 2.0)
+    advance(7)
+    observe()
+    batch([{"op": "act", "action": "A", "value": -1.0}, {"op": "advance", "steps": 1000}, {"op": "observe"}])
+    advance(2)
+    observe()
+    trace = server.api_log[start:]
+    assert trace[0]["payload"]["seed"] >= 0
+    assert server.verify(trace) == 3
+    *_, (_, _, replayed) = server.replay(trace)
+    fields = ("x", "v", "t", "pending_action")
+    assert [getattr(replayed, f) for f in fields] == [getattr(server.state, f) for f in fields]
+
+
+def test_replay_stops_inside_advance():
+    import server
+    start = len(server.api_log)
+    reset()
+    act("A", 2.0)
+    advance(10)
+    whole = server.api_log[start:]
+    split = whole[:-1] + [
+        {"endpoint": "/advance", "payload": {"steps": 4}, "time": 0.0},
+        {"endpoint": "/advance", "payload": {"steps": 6}, "time": 0.0},
+    ]
+    at_stop = [server.observation(s) for _, _, s in server.replay(whole, stops=[4]) if s.t == 4]
+    assert at_stop == [server.observation(s) for _, _, s in server.replay(split) if s.t == 4]
+    *_, (_, _, last) = server.replay(whole, stops=[4])
+    assert server.same_observation(observe(), last)
+
+def test_replay_rejects_tampered_observation():
+    import pytest
+    import server
+    start = len(server.api_log)
+    reset()
+    act("A", 2.0)
+    advance(3)
+    observe()
+    trace = server.api_log[start:]
+    trace[-1]["payload"]["x"] += 1e-6
+    with pytest.raises(server.core.ReplayMismatch) as e:
+        server.verify(trace)
+    assert e.value.index == len(trace) - 1
+
+
+def test_replay_allowance_stays_tight_on_long_traces():
+    import pytest
+    import server
+    start = len(server.api_log)
+    reset()
+    act("A", 2.0)
+    advance(10_000_000)
+    observe()
+    trace = server.api_log[start:]
+    assert server.verify(trace) == 1
+    trace[-1]["payload"]["x"] += 1e-6 * max(1.0, abs(trace[-1]["payload"]["x"]))
+    with pytest.raises(server.core.ReplayMismatch):
+        server.verify(trace)
@@ -2,29 +2,19 @@
 
 from __future__ import annotations
 
-import io
-import json
 import math
 import os
 import random
+import struct
+import sys
 import time
-import zipfile
 
-from fastapi import FastAPI
-from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
-from pydantic import BaseModel
-import uvicorn
+import numpy as np
 
-app = FastAPI(docs_url=None, redoc_url=None, openapi_url=None)
-
-# --- State ---
-x: float = 0.0
-y: float = 0.0
-vx: float = 0.0
-vy: float = 0.0
-t: int = 0
-pending_a: float | None = None
-pending_b: float | None = None
+_TOOLS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tools")
+if _TOOLS not in sys.path:
+    sys.path.insert(0, _TOOLS)
+import server_core as core  # noqa: E402
 
 X_RESET_MIN, X_RESET_MAX = 0.0, 20.0
 Y_RESET_MIN, Y_RESET_MAX = 0.0, 20.0
@@ -32,166 +22,318 @@ V_MIN, V_MAX = -5.0, 5.0
 DT = 1.0
 DAMP = 0.5
 
-api_log: list[dict] = []
-_done_log_start: int = 0
-
+ADVANCE_SLICE = 0.005  # wall-clock seconds of stepping between yields to the event loop
+CHATTER_PASSES = 4  # single-tick passes in a row before a row is stepped in plain Python
+CHATTER_TICKS = 4096  # ticks per plain-Python run
+
+# The goals (agent_briefing.md), in the form core.GoalAuditor documents.
+GOALS = {
+    1: {
+        "type": "action", "act_budget": 1, "per_action": True,
+        "targets": [{"t": 12, "x": 40.0, "y": 10.0, "tol": 0.5}],
+    },
+}
+
+# Endpoint -> (packed payload layout, payload keys), or None for no payload.
+# The key order here also fixes each endpoint's interned code.
+PAYLOADS = {
+    "/reset": (struct.Struct("<q"), ("seed",)),
+    "/act": (struct.Struct("<cd"), ("action", "value")),
+    "/advance": (struct.Struct("<q"), ("steps",)),
+    "/observe": (struct.Struct("<ddq"), ("x", "y", "t")),
+    "/predict": (struct.Struct("<dd"), ("x", "y")),
+}
+
+TICK_DTYPE = np.dtype([("tag", "S11"), ("t", "<i8"), ("x", "<f8"), ("y", "<f8"), ("vx", "<f8"), ("vy", "<f8"), ("alpha", "?")])
+
+
+def format_tick(record) -> str:
+    tag, t, x, y, vx, vy, alpha = record.item()
+    return (
+        f"  {tag.decode()}t={t} x={x:.6f} y={y:.6f} "
+        f"vx={vx:.6f} vy={vy:.6f} mode={'ALPHA' if alpha else 'BETA'}"
+    )
 
-def _log(endpoint: str, payload=None):
-    api_log.append({"endpoint": endpoint, "payload": payload, "time": time.time()})
 
+# --- State ---
 
-def _mode() -> str:
-    return "ALPHA" if x >= y else "BETA"
 
+class SessionStore(core.SessionStore):
+    COLUMNS = {
+        "x": 0.0, "y": 0.0, "vx": 0.0, "vy": 0.0, "t": 0,
+        "pending_a": 0.0, "pending_b": 0.0, "has_a": False, "has_b": False,
+    }
 
-def _tick():
-    global x, y, t
-    m = _mode()
-    if m == "ALPHA":
-        x += vx * DT
-        y += vy * DAMP * DT
+    def step(self, remaining: np.ndarray):
+        """Advance row i by up to remaining[i] ticks, decrementing ``remaining``.
+
+        Within a mode the motion is a straight line, so x - y changes by a
+        fixed amount per tick and the number of ticks until the next x >= y
+        crossing is known in closed form. Each pass jumps every row to two
+        ticks short of its next crossing and then re-evaluates the mode on the
+        stored state, so the crossing itself is decided by single ticks.
+        A jump only spans ticks where ``_exact_run`` shows that repeated
+        addition is exactly ``x + k * inc``, and is cut back to one tick if
+        the mode at its last tick disagrees, so every state (and the x == y
+        -> ALPHA tie) is bit-for-bit the tick loop's. Cost scales with the
+        number of mode switches and binade crossings rather than with steps.
+
+        A row sliding along x == y switches mode every tick or two, so its
+        jumps keep coming out as one tick. After CHATTER_PASSES such passes
+        it runs up to CHATTER_TICKS ticks in ``_chatter``, a plain-Python
+        tick loop that costs far less per tick than a numpy pass.
+
+        One call runs for about ADVANCE_SLICE seconds; TICK_ECHO makes every
+        pass a single tick.
+        """
+        until = time.monotonic() + ADVANCE_SLICE
+        live = started = np.flatnonzero(remaining > 0)
+        a = live[self.has_a[live]]
+        self.vx[a] = self.pending_a[a]
+        b = live[self.has_b[live]]
+        self.vy[b] = self.pending_b[b]
+        self.has_a[live] = False
+        self.has_b[live] = False
+        alpha_last = np.zeros(len(remaining), dtype=bool)
+        singles = np.zeros(len(remaining), dtype=np.int64)
+        while len(live := live[remaining[live] > 0]):
+            x, y = self.x[live], self.y[live]
+            vx, vy = self.vx[live], self.vy[live]
+            alpha = x >= y
+            dx = np.where(alpha, vx * DT, vx * DAMP * DT)
+            dy = np.where(alpha, vy * DAMP * DT, vy * DT)
+            if core.TICK_ECHO:
+                jump = np.ones(len(live), dtype=np.int64)
+                self.x[live] = x + dx
+                self.y[live] = y + dy
+            else:
+                kx, ix = self._exact_run(x, dx)
+                ky, iy = self._exact_run(y, dy)
+                jump = self._ticks_before_switch(x - y, ix - iy, alpha, remaining[live])
+                jump = np.maximum(np.minimum(jump, np.minimum(kx, ky)), 1)
+                # x - y is linear over an exact run, so one check covers every tick in it.
+                last = jump - 1
+                jump[(x + last * ix >= y + last * iy) != alpha] = 1
+                single = jump == 1
+                self.x[live] = np.where(single, x + dx, x + jump * ix)
+                self.y[live] = np.where(single, y + dy, y + jump * iy)
+                singles[live] = np.where(single & (remaining[live] > 1), singles[live] + 1, 0)
+            self.t[live] += jump
+            remaining[live] -= jump
+            alpha_last[live] = alpha
+            if core.TICK_ECHO:
+                self._echo(live, alpha=alpha)
+            else:
+                for i in live[singles[live] >= CHATTER_PASSES]:
+                    if time.monotonic() >= until:
+                        break
+                    n = int(min(remaining[i], CHATTER_TICKS))
+                    alpha_last[i] = self._chatter(i, n)
+                    self.t[i] += n
+                    remaining[i] -= n
+                    singles[i] = 0
+            if time.monotonic() >= until:
+                break
+        if not core.TICK_ECHO:
+            done = started[remaining[started] == 0]
+            self._echo(done, alpha=alpha_last[done])
+
+    def _chatter(self, i: int, n: int) -> bool:
+        """Run row i through ``n`` ticks of the tick loop; returns the last tick's mode.
+
+        Python floats are the same IEEE doubles as the numpy columns and the
+        per-tick increments are formed the same way, so the result is
+        bit-for-bit the vectorised tick loop's.
+        """
+        x, y = float(self.x[i]), float(self.y[i])
+        vx, vy = float(self.vx[i]), float(self.vy[i])
+        ax, ay = vx * DT, vy * DAMP * DT
+        bx, by = vx * DAMP * DT, vy * DT
+        alpha = True
+        for _ in range(n):
+            alpha = x >= y
+            if alpha:
+                x += ax
+                y += ay
+            else:
+                x += bx
+                y += by
+        self.x[i], self.y[i] = x, y
+        return alpha
+
+    @staticmethod
+    def _exact_run(v: np.ndarray, dv: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Ticks over which repeated ``v += dv`` equals ``v + k * inc``, and ``inc``.
+
+        Inside one binade every float is a multiple of the same ulp, so each
+        addition rounds dv to the same multiple of it, unless dv is an exact
+        half-ulp tie. That holds while v stays a full ulp inside the binade;
+        zero, subnormal and tie rows get 0 and are stepped tick by tick.
+        """
+        _, e = np.frexp(v)
+        ulp = np.ldexp(1.0, e - 53)
+        q = dv / ulp
+        inc = np.rint(q)
+        ok = (np.abs(v) >= np.finfo(float).tiny) & (np.abs(q - inc) != 0.5) & (np.abs(q) < 2.0**52)
+        up = np.where(ok, np.sign(v) * inc, 0).astype(np.int64)  # ulps |v| moves per tick
+        mag = np.where(ok, np.abs(v) / ulp, 2.0**52).astype(np.int64)  # |v| in ulps, in [2^52, 2^53)
+        with np.errstate(divide="ignore"):
+            run = np.where(
+                up > 0,
+                (2**53 - 2 - mag) // np.maximum(up, 1),
+                np.where(up < 0, (mag - 2**52 - 1) // np.maximum(-up, 1), np.iinfo(np.int64).max),
+            )
+        run = np.where(ok, np.maximum(run, 0), 0)
+        run[dv == 0] = np.iinfo(np.int64).max
+        return run, inc * ulp
+
+    @staticmethod
+    def _ticks_before_switch(d: np.ndarray, rate: np.ndarray, alpha: np.ndarray, remaining: np.ndarray) -> np.ndarray:
+        """Ticks each row can take in its current mode, keeping a 2-tick margin.
+
+        ``d`` is x - y and ``rate`` its change per tick. ALPHA holds while
+        d >= 0, BETA while d < 0; a mode whose rate moves d away from the
+        boundary holds for the rest of the advance.
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            run = np.where(
+                alpha,
+                np.where(rate < 0, np.floor(d / -rate) + 1, np.inf),
+                np.where(rate > 0, np.ceil(-d / rate), np.inf),
+            )
+        return np.minimum(np.maximum(run - 2, 1), remaining).astype(np.int64)
+
+    def _chatter(self, i: int, n: int) -> bool:
+        """Run row i through ``n`` ticks of the tick loop; returns the last tick's mode.
+
+        Python floats are the same IEEE doubles as the numpy columns and the
+        per-tick increments are formed the same way, so the result is
+        bit-for-bit the vectorised tick loop's.
+        """
+        x, y = float(self.x[i]), float(self.y[i])
+        vx, vy = float(self.vx[i]), float(self.vy[i])
+        ax, ay = vx * DT, vy * DAMP * DT
+        bx, by = vx * DAMP * DT, vy * DT
+        alpha = True
+        for _ in range(n):
+            alpha = x >= y
+            if alpha:
+                x += ax
+                y += ay
+            else:
+                x += bx
+                y += by
+        self.x[i], self.y[i] = x, y
+        return alpha
+
+    @staticmethod
+    def _exact_run(v: np.ndarray, dv: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Ticks over which repeated ``v += dv`` equals ``v + k * inc``, and ``inc``.
+
+        Inside one binade every float is a multiple of the same ulp, so each
+        addition rounds dv to the same multiple of it, unless dv is an exact
+        half-ulp tie. That holds while v stays a full ulp inside the binade;
+        zero, subnormal and tie rows get 0 and are stepped tick by tick.
+        """
+        _, e = np.frexp(v)
+        ulp = np.ldexp(1.0, e - 53)
+        q = dv / ulp
+        inc = np.rint(q)
+        ok = (np.abs(v) >= np.finfo(float).tiny) & (np.abs(q - inc) != 0.5) & (np.abs(q) < 2.0**52)
+        up = np.where(ok, np.sign(v) * inc, 0).astype(np.int64)  # ulps |v| moves per tick
+        mag = np.where(ok, np.abs(v) / ulp, 2.0**52).astype(np.int64)  # |v| in ulps, in [2^52, 2^53)
+        with np.errstate(divide="ignore"):
+            run = np.where(
+                up > 0,
+                (2**53 - 2 - mag) // np.maximum(up, 1),
+                np.where(up < 0, (mag - 2**52 - 1) // np.maximum(-up, 1), np.iinfo(np.int64).max),
+            )
+        run = np.where(ok, np.maximum(run, 0), 0)
+        run[dv == 0] = np.iinfo(np.int64).max
+        return run, inc * ulp
+
+    @staticmethod
+    def _ticks_before_switch(d: np.ndarray, rate: np.ndarray, alpha: np.ndarray, remaining: np.ndarray) -> np.ndarray:
+        """Ticks each row can take in its current mode, keeping a 2-tick margin.
+
+        ``d`` is x - y and ``rate`` its change per tick. ALPHA holds while
+        d >= 0, BETA while d < 0; a mode whose rate moves d away from the
+        boundary holds for the rest of the advance.
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            run = np.where(
+                alpha,
+                np.where(rate < 0, np.floor(d / -rate) + 1, np.inf),
+                np.where(rate > 0, np.ceil(-d / rate), np.inf),
+            )
+        return np.minimum(np.maximum(run - 2, 1), remaining).astype(np.int64)
+
+
+class State(core.StoreState):
+    """One session's row in the store."""
+
+    __slots__ = ()
+
+    x = core.Column()
+    y = core.Column()
+    vx = core.Column()
+    vy = core.Column()
+    t = core.Column(int)
+    pending_a = core.Pending("has_a")
+    pending_b = core.Pending("has_b")
+
+
+def reset_state(s: State, seed: int):
+    """Start an episode from the state ``seed`` draws, so the logged seed reproduces it."""
+    rng = random.Random(seed)
+    s.x = rng.uniform(X_RESET_MIN, X_RESET_MAX)
+    s.y = rng.uniform(Y_RESET_MIN, Y_RESET_MAX)
+    s.vx = 0.0
+    s.vy = 0.0
+    s.t = 0
+    s.pending_a = None
+    s.pending_b = None
+
+
+def act_error(action: str, value: float) -> str | None:
+    """Why an act is invalid, or None if it is valid."""
+    if action not in ("A", "B"):
+        return f"Unknown action: {action}"
+    if not math.isfinite(value):
+        return "value must be finite"
+    return None
+
+
+def apply_act(s: State, action: str, value: float) -> float:
+    """Clamp ``value`` into range and make it the pending action; returns it."""
+    clamped = max(V_MIN, min(V_MAX, value))
+    if action == "A":
+        s.pending_a = clamped
     else:
-        x += vx * DAMP * DT
-        y += vy * DT
-    t += 1
-    print(f"  t={t} x={x:.6f} y={y:.6f} vx={vx:.6f} vy={vy:.6f} mode={m}")
-
-
-class ActRequest(BaseModel):
-    action: str
-    value: float
-
-
-class AdvanceRequest(BaseModel):
-    steps: int
-
-
-class PredictRequest(BaseModel):
-    x: float
-    y: float
-
-
-class DoneRequest(BaseModel):
-    goal: int
-    agent_id: str
-    solver: str
-    command: str
-    report: str
-
-
-@app.post("/reset", status_code=204)
-def reset():
-    global x, y, vx, vy, t, pending_a, pending_b
-    x = random.uniform(X_RESET_MIN, X_RESET_MAX)
-    y = random.uniform(Y_RESET_MIN, Y_RESET_MAX)
-    vx = 0.0
-    vy = 0.0
-    t = 0
-    pending_a = None
-    pending_b = None
-    _log("/reset")
-    print(f"RESET x={x:.6f} y={y:.6f}")
-
-
-@app.post("/act", status_code=204)
-def act(req: ActRequest):
-    global pending_a, pending_b
-    if req.action not in ("A", "B"):
-        return JSONResponse(status_code=422, content={"detail": f"Unknown action: {req.action}"})
-    if not math.isfinite(req.value):
-        return JSONResponse(status_code=422, content={"detail": "value must be finite"})
-    clamped = max(V_MIN, min(V_MAX, req.value))
-    if req.action == "A":
-        pending_a = clamped
-    else:
-        pending_b = clamped
-    _log("/act", {"action": req.action, "value": clamped})
-    print(f"ACT action={req.action} value={clamped:.6f}")
-
-
-@app.post("/advance", status_code=204)
-def advance(req: AdvanceRequest):
-    global vx, vy, pending_a, pending_b
-    if req.steps < 1:
-        return JSONResponse(status_code=422, content={"detail": "steps must be >= 1"})
-    _log("/advance", {"steps": req.steps})
-    if pending_a is not None:
-        vx = pending_a
-        pending_a = None
-    if pending_b is not None:
-        vy = pending_b
-        pending_b = None
-    for _ in range(req.steps):
-        _tick()
-
-
-@app.get("/observe")
-def observe():
-    _log("/observe")
-    return {"x": round(x, 10), "y": round(y, 10), "t": t}
-
-
-@app.post("/predict", status_code=204)
-def predict(req: PredictRequest):
-    _log("/predict", {"x": req.x, "y": req.y})
-    print(f"PREDICT x={req.x:.6f} y={req.y:.6f}")
-
-
-_world_dir = os.path.dirname(os.path.abspath(__file__))
-_submissions_dir = os.path.join(_world_dir, "submissions")
-
-
-@app.post("/done")
-def done(req: DoneRequest):
-    global _done_log_start
-    os.makedirs(_submissions_dir, exist_ok=True)
-    trace = api_log[_done_log_start:]
-    _done_log_start = len(api_log)
-    submission = {
-        "goal": req.goal,
-        "agent_id": req.agent_id,
-        "solver": req.solver,
-        "command": req.command,
-        "report": req.report,
-        "api_trace": trace,
-        "submitted_at": time.time(),
-    }
-    safe_id = req.agent_id.replace("/", "_").replace(" ", "_")
-    filename = f"goal_{req.goal}_{safe_id}.json"
-    path = os.path.join(_submissions_dir, filename)
-    with open(path, "w") as f:
-        json.dump(submission, f, indent=2)
-    print(f"DONE goal={req.goal} agent={req.agent_id} -> {filename}")
-    return {"status": "received"}
+        s.pending_b = clamped
+    return clamped
 
 
-_project_root = os.path.dirname(_world_dir)
-_static = os.path.join(_world_dir, "static")
+def observation(s: State) -> dict:
+    return {"x": round(s.x, 10), "y": round(s.y, 10), "t": s.t}
 
 
-@app.get("/bootstrap")
-def bootstrap():
-    """Return a zip of agent_instructions.md and agent_briefing.md."""
-    files = {
-        "agent_instructions.md": os.path.join(_project_root, "agent_instructions.md"),
-        "agent_briefing.md": os.path.join(_world_dir, "agent_briefing.md"),
-    }
-    buf = io.BytesIO()
-    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
-        for arcname, path in files.items():
-            zf.write(path, arcname)
-    buf.seek(0)
-    return StreamingResponse(
-        buf,
-        media_type="application/zip",
-        headers={"Content-Disposition": "attachment; filename=bootstrap.zip"},
-    )
+# --- Replay ---
+
+# SessionStore.step reproduces the TICK_ECHO tick loop bit for bit, so a
+# replayed observation must equal the logged one exactly.
+
 
+def same_observation(logged: dict, s: State) -> bool:
+    return logged == observation(s)
 
-@app.get("/")
-def dashboard():
-    return FileResponse(os.path.join(_static, "index.html"))
 
+world = core.StoreWorld(sys.modules[__name__])
+app = world.app
+replay = world.replay
+verify = world.verify
+state = world.default_session.state
+api_log = world.default_session.api_log
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8080)
+    world.main()
@@ -2,170 +2,168 @@
 
 from __future__ import annotations
 
-import io
-import json
 import math
 import os
 import random
-import time
-import zipfile
+import struct
+import sys
 
-from fastapi import FastAPI
-from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
-from pydantic import BaseModel
-import uvicorn
+import numpy as np
 
-app = FastAPI(docs_url=None, redoc_url=None, openapi_url=None)
-
-# --- State ---
-x: float = 0.0
-v: float = 0.0
-t: int = 0
-pending_a: float | None = None
+_TOOLS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tools")
+if _TOOLS not in sys.path:
+    sys.path.insert(0, _TOOLS)
+import server_core as core  # noqa: E402
 
 X_RESET_MIN, X_RESET_MAX = -10.0, 10.0
 A_MIN, A_MAX = -5.0, 5.0
 K = 0.3  # drag coefficient
 DT = 1.0
 
-api_log: list[dict] = []
-_done_log_start: int = 0
+# One force-free tick as a linear map on (x, v): v' = (1 - K) v, x' = x + v'.
+_DRAG = np.array([[1.0, 1.0 - K], [0.0, 1.0 - K]])
 
+# The goals (agent_briefing.md), in the form core.GoalAuditor documents.
+GOALS = {
+    1: {"type": "action", "act_budget": 20, "per_action": False, "targets": [{"t": 20, "x": 50.0, "tol": 1.0}]},
+    2: {
+        "type": "action", "act_budget": 30, "per_action": False,
+        "targets": [{"t": 30, "x": 0.0, "tol": 0.1}], "settle": 0.1,
+    },
+}
 
-def _log(endpoint: str, payload=None):
-    api_log.append({"endpoint": endpoint, "payload": payload, "time": time.time()})
+# Endpoint -> (packed payload layout, payload keys), or None for no payload.
+# The key order here also fixes each endpoint's interned code.
+PAYLOADS = {
+    "/reset": (struct.Struct("<q"), ("seed",)),
+    "/act": (struct.Struct("<cd"), ("action", "value")),
+    "/advance": (struct.Struct("<q"), ("steps",)),
+    "/observe": (struct.Struct("<dq"), ("x", "t")),
+    "/predict": (struct.Struct("<d"), ("x",)),
+}
 
+TICK_DTYPE = np.dtype([("tag", "S11"), ("t", "<i8"), ("x", "<f8"), ("v", "<f8"), ("f", "<f8")])
 
-def _tick():
-    global x, v, t, pending_a
-    f = pending_a if pending_a is not None else 0.0
-    pending_a = None
-    v = v + f - K * v
-    x = x + v
-    t += 1
-    print(f"  t={t} x={x:.6f} v={v:.6f} f={f:.6f}")
 
+def format_tick(record) -> str:
+    tag, t, x, v, f = record.item()
+    return f"  {tag.decode()}t={t} x={x:.6f} v={v:.6f} f={f:.6f}"
 
-class ActRequest(BaseModel):
-    action: str
-    value: float
 
+# --- State ---
 
-class AdvanceRequest(BaseModel):
-    steps: int
 
-
-class PredictRequest(BaseModel):
-    x: float
-
-
-class DoneRequest(BaseModel):
-    goal: int
-    agent_id: str
-    solver: str
-    command: str
-    report: str
-
-
-@app.post("/reset", status_code=204)
-def reset():
-    global x, v, t, pending_a
-    x = random.uniform(X_RESET_MIN, X_RESET_MAX)
-    v = 0.0
-    t = 0
-    pending_a = None
-    _log("/reset")
-    print(f"RESET x={x:.6f}")
-
-
-@app.post("/act", status_code=204)
-def act(req: ActRequest):
-    global pending_a
-    if req.action != "A":
-        return JSONResponse(status_code=422, content={"detail": f"Unknown action: {req.action}"})
-    if not math.isfinite(req.value):
-        return JSONResponse(status_code=422, content={"detail": "value must be finite"})
-    clamped = max(A_MIN, min(A_MAX, req.value))
-    pending_a = clamped
-    _log("/act", {"action": req.action, "value": clamped})
-    print(f"ACT action={req.action} value={clamped:.6f}")
-
-
-@app.post("/advance", status_code=204)
-def advance(req: AdvanceRequest):
-    if req.steps < 1:
-        return JSONResponse(status_code=422, content={"detail": "steps must be >= 1"})
-    _log("/advance", {"steps": req.steps})
-    for _ in range(req.steps):
-        _tick()
-
-
-@app.get("/observe")
-def observe():
-    _log("/observe")
-    return {"x": round(x, 10), "t": t}
-
-
-@app.post("/predict", status_code=204)
-def predict(req: PredictRequest):
-    _log("/predict", {"x": req.x})
-    print(f"PREDICT x={req.x:.6f}")
-
-
-_world_dir = os.path.dirname(os.path.abspath(__file__))
-_submissions_dir = os.path.join(_world_dir, "submissions")
-
-
-@app.post("/done")
-def done(req: DoneRequest):
-    global _done_log_start
-    os.makedirs(_submissions_dir, exist_ok=True)
-    trace = api_log[_done_log_start:]
-    _done_log_start = len(api_log)
-    submission = {
-        "goal": req.goal,
-        "agent_id": req.agent_id,
-        "solver": req.solver,
-        "command": req.command,
-        "report": req.report,
-        "api_trace": trace,
-        "submitted_at": time.time(),
-    }
-    safe_id = req.agent_id.replace("/", "_").replace(" ", "_")
-    filename = f"goal_{req.goal}_{safe_id}.json"
-    path = os.path.join(_submissions_dir, filename)
-    with open(path, "w") as f:
-        json.dump(submission, f, indent=2)
-    print(f"DONE goal={req.goal} agent={req.agent_id} -> {filename}")
-    return {"status": "received"}
-
-
-_project_root = os.path.dirname(_world_dir)
-_static = os.path.join(_world_dir, "static")
-
-
-@app.get("/bootstrap")
-def bootstrap():
-    files = {
-        "agent_instructions.md": os.path.join(_project_root, "agent_instructions.md"),
-        "agent_briefing.md": os.path.join(_world_dir, "agent_briefing.md"),
-    }
-    buf = io.BytesIO()
-    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
-        for arcname, path in files.items():
-            zf.write(path, arcname)
-    buf.seek(0)
-    return StreamingResponse(
-        buf,
-        media_type="application/zip",
-        headers={"Content-Disposition": "attachment; filename=bootstrap.zip"},
+class SessionStore(core.SessionStore):
+    COLUMNS = {"x": 0.0, "v": 0.0, "t": 0, "pending_a": 0.0, "has_a": False}
+
+    def _tick(self, live: np.ndarray) -> np.ndarray:
+        f = np.where(self.has_a[live], self.pending_a[live], 0.0)
+        self.has_a[live] = False
+        v = self.v[live]
+        v = v + f - K * v
+        self.v[live] = v
+        self.x[live] = self.x[live] + v
+        self.t[live] += 1
+        return f
+
+    def step(self, remaining: np.ndarray):
+        """Advance row i by up to remaining[i] ticks, decrementing ``remaining``.
+
+        The first tick consumes the pending force. After that the drag update
+        is the fixed linear map ``_DRAG`` on (x, v), so the remaining ticks are
+        applied by masked repeated squaring in O(log max(steps)) and one call
+        finishes every row. TICK_ECHO runs the per-tick loop instead, at most
+        core.ADVANCE_CHUNK ticks per call.
+        """
+        live = np.flatnonzero(remaining > 0)
+        if core.TICK_ECHO:
+            for _ in range(min(core.ADVANCE_CHUNK, int(remaining.max(initial=0)))):
+                live = live[remaining[live] > 0]
+                self._echo(live, f=self._tick(live))
+                remaining[live] -= 1
+            return
+        f = self._tick(live)
+        steps = remaining[live]
+        left = steps - 1
+        m = _DRAG
+        while left.any():
+            sel = live[(left & 1).astype(bool)]
+            x, v = self.x[sel], self.v[sel]
+            self.x[sel] = m[0, 0] * x + m[0, 1] * v
+            self.v[sel] = m[1, 0] * x + m[1, 1] * v
+            m = m @ m
+            left >>= 1
+        self.t[live] += steps - 1
+        remaining[live] = 0
+        self._echo(live, f=np.where(steps == 1, f, 0.0))
+
+
+class State(core.StoreState):
+    """One session's row in the store."""
+
+    __slots__ = ()
+
+    x = core.Column()
+    v = core.Column()
+    t = core.Column(int)
+    pending_a = core.Pending("has_a")
+
+
+def reset_state(s: State, seed: int):
+    """Start an episode from the state ``seed`` draws, so the logged seed reproduces it."""
+    rng = random.Random(seed)
+    s.x = rng.uniform(X_RESET_MIN, X_RESET_MAX)
+    s.v = 0.0
+    s.t = 0
+    s.pending_a = None
+
+
+def act_error(action: str, value: float) -> str | None:
+    """Why an act is invalid, or None if it is valid."""
+    if action != "A":
+        return f"Unknown action: {action}"
+    if not math.isfinite(value):
+        return "value must be finite"
+    return None
+
+
+def apply_act(s: State, action: str, value: float) -> float:
+    """Clamp ``value`` into range and make it the pending action; returns it."""
+    clamped = max(A_MIN, min(A_MAX, value))
+    s.pending_a = clamped
+    return clamped
+
+
+def observation(s: State) -> dict:
+    return {"x": round(s.x, 10), "t": s.t}
+
+
+# --- Replay ---
+
+# The repeated squaring rounds a handful of times per advance and the
+# TICK_ECHO tick loop once per tick, so the two drift apart by about an ulp
+# of the value per tick since /reset. An observation at t may be off by
+# max(1, |value|) * (REPLAY_TOLERANCE + REPLAY_DRIFT * t).
+REPLAY_TOLERANCE = 1e-9
+REPLAY_DRIFT = 1e-15  # per tick; the worst drift measured is about 2e-20
+
+
+def same_observation(logged: dict, s: State) -> bool:
+    replayed = observation(s)
+    if logged["t"] != replayed["t"]:
+        return False
+    allowance = REPLAY_TOLERANCE + REPLAY_DRIFT * logged["t"]
+    return all(
+        abs(logged[k] - replayed[k]) <= allowance * max(1.0, abs(logged[k])) for k in logged if k != "t"
     )
 
 
-@app.get("/")
-def dashboard():
-    return FileResponse(os.path.join(_static, "index.html"))
-
+world = core.StoreWorld(sys.modules[__name__])
+app = world.app
+replay = world.replay
+verify = world.verify
+state = world.default_session.state
+api_log = world.default_session.api_log
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8080)
+    world.main()
@@ -1,9 +1,22 @@
+import os
+import tempfile
+
+os.environ.setdefault("WAL_DIR", tempfile.mkdtemp())  # keep test runs out of world_N/wal
+os.environ.setdefault("TICK_ECHO_RATE", "0")  # keep the console tick sample out of test output
+
 from fastapi.testclient import TestClient
+import pytest
 
 from server import app
 
 client = TestClient(app)
 
+
+@pytest.fixture(autouse=True, scope="module")
+def serving():
+    with client:  # runs the startup hook, which opens the WAL
+        yield
+
 K = 0.3
 
 
@@ -30,10 +43,10 @@ def set_state(sx, sv=0.0):
     """Force a deterministic state for testing."""
     import server
     reset()
-    server.x = sx
-    server.v = sv
-    server.t = 0
-    server.pending_a = None
+    server.state.x = sx
+    server.state.v = sv
+    server.state.t = 0
+    server.state.pending_a = None
 
 
 def _sim(x0, v0, forces):
@@ -370,3 +383,634 @@ def test_prediction_scenario():
     ex, _ = _sim(0.0, 0.0, forces)
     assert abs(s["x"] - ex) < 1e-6
     assert s["t"] == 30
+
+
+# --- Sessions ---
+
+
+def new_session():
+    r = client.post("/reset", headers={"X-Session": "new"})
+    assert r.status_code == 200
+    return {"X-Session": r.json()["session"]}
+
+
+def act_in(headers, action, value):
+    return client.post("/act", json={"action": action, "value": value}, headers=headers)
+
+
+def test_session_mint_returns_token():
+    h = new_session()
+    r = client.get("/observe", headers=h)
+    assert r.status_code == 200
+    assert r.json()["t"] == 0
+
+
+def test_sessions_are_isolated():
+    set_state(0.0)
+    h = new_session()
+    client.post("/act", json={"action": "A", "value": 3.0}, headers=h)
+    client.post("/advance", json={"steps": 2}, headers=h)
+    assert client.get("/observe", headers=h).json()["t"] == 2
+    assert observe() == {"x": 0.0, "t": 0}
+
+
+def test_session_api_log_is_separate():
+    import server
+    h = new_session()
+    client.get("/observe", headers=h)
+    sess = server.world.sessions[h["X-Session"]]
+    assert [e["endpoint"] for e in sess.api_log] == ["/reset", "/observe"]
+
+
+def test_unknown_session_404():
+    h = {"X-Session": "nope"}
+    assert client.get("/observe", headers=h).status_code == 404
+    assert act_in(h, "A", 1.0).status_code == 404
+    assert client.post("/advance", json={"steps": 1}, headers=h).status_code == 404
+
+
+def test_close_session():
+    h = new_session()
+    assert client.delete("/session", headers=h).status_code == 204
+    assert client.get("/observe", headers=h).status_code == 404
+
+
+# --- Session store ---
+
+
+def test_store_step_matches_sim_per_slot():
+    import server
+    starts = [(1.0, 0.5, 2.0), (-3.0, 0.0, None), (4.0, -1.0, -5.0)]
+    steps = [1, 4, 7]
+    rows = server.SessionStore(len(starts))
+    for i, (sx, sv, f) in enumerate(starts):
+        rows.x[i] = sx
+        rows.v[i] = sv
+        rows.has_a[i] = f is not None
+        rows.pending_a[i] = f or 0.0
+    rows.run(steps)
+    for i, ((sx, sv, f), n) in enumerate(zip(starts, steps)):
+        ex, ev = _sim(sx, sv, [f or 0.0] + [0.0] * (n - 1))
+        assert abs(rows.x[i] - ex) < 1e-12
+        assert abs(rows.v[i] - ev) < 1e-12
+        assert rows.t[i] == n
+
+
+def test_closed_session_slot_is_reused():
+    import server
+    h = new_session()
+    slot = server.world.sessions[h["X-Session"]].state.slot
+    client.delete("/session", headers=h)
+    h2 = new_session()
+    assert server.world.sessions[h2["X-Session"]].state.slot == slot
+
+
+def test_advances_in_one_window_run_as_one_step(monkeypatch):
+    import asyncio
+    import time
+    import server
+    a = new_session()
+    b = new_session()
+    sa, sb = server.world.sessions[a["X-Session"]], server.world.sessions[b["X-Session"]]
+    gathered = []
+    real_gather = server.world.store.gather
+    monkeypatch.setattr(server.world.store, "gather", lambda slots: (gathered.append(list(slots)), real_gather(slots))[1])
+
+    async def both():
+        deadline = time.monotonic() + 5.0
+        return await asyncio.gather(server.world._batcher.submit(sa, 2, deadline), server.world._batcher.submit(sb, 5, deadline))
+
+    assert asyncio.run(both()) == [server.core._COMMITTED, server.core._COMMITTED]
+    assert gathered == [[sa.state.slot, sb.state.slot]]
+    assert client.get("/observe", headers=a).json()["t"] == 2
+    assert client.get("/observe", headers=b).json()["t"] == 5
+
+
+def test_failed_batch_settles_every_advance():
+    import asyncio
+    import time
+    import server
+    a = new_session()
+    sa = server.world.sessions[a["X-Session"]]
+
+    async def both():
+        deadline = time.monotonic() + 5.0
+        return await asyncio.gather(
+            server.world._batcher.submit(server.world.default_session, 2**63, deadline), server.world._batcher.submit(sa, 1, deadline)
+        )
+
+    reset()
+    assert asyncio.run(asyncio.wait_for(both(), 5.0)) == [server.core._TIMED_OUT, server.core._TIMED_OUT]
+
+
+# --- Matrix-power advance ---
+
+
+def test_matrix_advance_matches_tick_loop(monkeypatch):
+    import random as rnd
+    import server
+    rng = rnd.Random(7)
+    n = 40
+    starts = [(rng.uniform(-10, 10), rng.uniform(-5, 5), rng.choice([None, rng.uniform(-5, 5)])) for _ in range(n)]
+    steps = [rng.randint(1, 500) for _ in range(n)]
+
+    def run():
+        rows = server.SessionStore(n)
+        for i, (sx, sv, f) in enumerate(starts):
+            rows.x[i] = sx
+            rows.v[i] = sv
+            rows.has_a[i] = f is not None
+            rows.pending_a[i] = f or 0.0
+        rows.run(steps)
+        return list(zip(rows.x, rows.v, rows.t))
+
+    fast = run()
+    monkeypatch.setattr(server.core, "TICK_ECHO", True)
+    slow = run()
+    for (fx, fv, ft), (sx, sv, st), (x0, v0, f) in zip(fast, slow, starts):
+        assert abs(fx - sx) < 1e-9
+        assert abs(fv - sv) < 1e-9
+        assert ft == st
+        ex, ev = _sim(x0, v0, [f or 0.0] + [0.0] * (st - 1))
+        assert abs(fx - ex) < 1e-9
+
+
+def test_huge_advance_is_fast():
+    import time
+    set_state(0.0)
+    act("A", 2.0)
+    start = time.perf_counter()
+    assert advance(10_000_000).status_code == 204
+    assert time.perf_counter() - start < 1.0
+    s = observe()
+    assert s["t"] == 10_000_000
+    assert abs(s["x"] - 2.0 / K) < 1e-9
+
+
+# --- Time-budgeted advance ---
+
+
+def test_advance_over_budget_is_rolled_back(monkeypatch):
+    import server
+    set_state(1.0, 2.0)
+    act("A", 3.0)
+    log_len = len(server.api_log)
+    monkeypatch.setattr(server.core, "TICK_ECHO", True)
+    monkeypatch.setattr(server.core, "ADVANCE_BUDGET", 0.0)
+    r = advance(10 * server.core.ADVANCE_CHUNK)
+    assert r.status_code == 503
+    assert observe() == {"x": 1.0, "t": 0}
+    assert server.state.v == 2.0
+    assert server.state.pending_a == 3.0
+    assert [e["endpoint"] for e in server.api_log[log_len:]] == ["/observe"]
+
+
+def test_advance_conflict_retries_from_new_state(monkeypatch):
+    import server
+    set_state(0.0)
+    act("A", 1.0)
+    real_gather = server.world.store.gather
+    calls = []
+
+    def gather(slots):
+        rows = real_gather(slots)
+        if not calls:
+            # Simulate an /act landing while the first attempt is in flight.
+            server.state.pending_a = 4.0
+            server.world.default_session.version += 1
+        calls.append(1)
+        return rows
+
+    monkeypatch.setattr(server.world.store, "gather", gather)
+    log_len = len(server.api_log)
+    assert advance(1).status_code == 204
+    assert len(calls) == 2
+    assert abs(observe()["x"] - 4.0) < 1e-9
+    assert [e["endpoint"] for e in server.api_log[log_len:]] == ["/advance", "/observe"]
+
+
+def test_long_advance_does_not_block_observe(monkeypatch):
+    import asyncio
+    import time
+    import httpx
+    import server
+    monkeypatch.setattr(server.core, "TICK_ECHO", True)
+    monkeypatch.setattr(server.core, "ADVANCE_BUDGET", 0.5)
+    monkeypatch.setattr(server.core, "print", lambda *a, **k: None, raising=False)
+    h = new_session()
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+            runaway = asyncio.create_task(c.post("/advance", json={"steps": 10**9}))
+            await asyncio.sleep(0.1)
+            start = time.perf_counter()
+            r = await c.get("/observe", headers=h)
+            latency = time.perf_counter() - start
+            return r, latency, await runaway
+
+    r, latency, runaway = asyncio.run(scenario())
+    assert r.status_code == 200
+    assert latency < 0.1
+    assert runaway.status_code == 503
+
+
+# --- Batch ---
+
+
+def batch(commands, headers=None):
+    return client.post("/batch", json={"commands": commands}, headers=headers)
+
+
+def test_batch_matches_single_calls():
+    import server
+    set_state(1.0, 2.0)
+    act("A", 3.0)
+    advance(3)
+    first = observe()
+    advance(5)
+    second = observe()
+    set_state(1.0, 2.0)
+    log_len = len(server.api_log)
+    r = batch([
+        {"op": "act", "action": "A", "value": 3.0},
+        {"op": "advance", "steps": 3},
+        {"op": "observe"},
+        {"op": "advance", "steps": 5},
+        {"op": "observe"},
+    ])
+    assert r.status_code == 200
+    assert r.json() == {"observations": [first, second]}
+    trace = server.api_log[log_len:]
+    assert [e["endpoint"] for e in trace] == ["/act", "/advance", "/observe", "/advance", "/observe"]
+    assert [e["payload"] for e in trace] == [
+        {"action": "A", "value": 3.0}, {"steps": 3}, first, {"steps": 5}, second,
+    ]
+
+
+def test_batch_clamps_act():
+    import server
+    reset()
+    log_len = len(server.api_log)
+    r = batch([{"op": "act", "action": "A", "value": 1e9}])
+    assert r.json() == {"observations": []}
+    assert server.api_log[log_len]["payload"] == {"action": "A", "value": server.A_MAX}
+
+
+def test_batch_invalid_command_applies_nothing():
+    import server
+    reset()
+    before = observe()
+    log_len = len(server.api_log)
+    r = batch([{"op": "advance", "steps": 4}, {"op": "act", "action": "Z", "value": 1.0}])
+    assert r.status_code == 422
+    assert r.json() == {"detail": "commands[1]: Unknown action: Z"}
+    assert batch([{"op": "advance", "steps": 0}]).status_code == 422
+    assert batch([{"op": "act", "action": "A"}]).status_code == 422
+    assert batch([{"op": "jump"}]).status_code == 422
+    assert observe() == before
+    assert len(server.api_log) == log_len + 1
+
+
+def test_advance_past_max_t_is_rejected():
+    import server
+    reset()
+    assert advance(2**63).status_code == 422
+    assert batch([{"op": "advance", "steps": 2**63}]).status_code == 422
+    server.state.t = server.core.MAX_T - 2
+    before = observe()
+    assert advance(3).status_code == 422
+    r = batch([{"op": "advance", "steps": 1}, {"op": "advance", "steps": 2}])
+    assert r.status_code == 422
+    assert r.json() == {"detail": f"commands[1]: advance would take t past {server.core.MAX_T}"}
+    assert observe() == before
+    assert advance(2).status_code == 204
+    assert observe()["t"] == server.core.MAX_T
+
+
+def test_batch_over_budget_is_rolled_back(monkeypatch):
+    import server
+    reset()
+    before = observe()
+    log_len = len(server.api_log)
+    monkeypatch.setattr(server.core, "TICK_ECHO", True)
+    monkeypatch.setattr(server.core, "ADVANCE_BUDGET", 0.0)
+    r = batch([{"op": "observe"}, {"op": "advance", "steps": 10 * server.core.ADVANCE_CHUNK}])
+    assert r.status_code == 503
+    assert observe() == before
+    assert len(server.api_log) == log_len + 1
+
+
+def test_batch_uses_session():
+    h = new_session()
+    r = batch([{"op": "advance", "steps": 2}, {"op": "observe"}], headers=h)
+    assert r.status_code == 200
+    assert r.json()["observations"][0]["t"] == 2
+    assert batch([{"op": "observe"}], headers={"X-Session": "nope"}).status_code == 404
+
+
+# --- Agent socket ---
+
+
+def test_socket_matches_rest():
+    import server
+    set_state(1.0, 2.0)
+    act("A", 3.0)
+    advance(3)
+    expected = observe()
+    set_state(1.0, 2.0)
+    log_len = len(server.api_log)
+    with client.websocket_connect("/ws") as ws:
+        ws.send_json({"op": "act", "action": "A", "value": 3.0})
+        assert ws.receive_json() == {}
+        ws.send_json({"op": "advance", "steps": 3})
+        assert ws.receive_json() == {}
+        ws.send_json({"op": "observe"})
+        assert ws.receive_json() == expected
+        ws.send_json({"op": "predict", "x": 1.0})
+        assert ws.receive_json() == {}
+    trace = server.api_log[log_len:]
+    assert [e["endpoint"] for e in trace] == ["/act", "/advance", "/observe", "/predict"]
+    assert [e["payload"] for e in trace] == [
+        {"action": "A", "value": 3.0}, {"steps": 3}, expected, {"x": 1.0},
+    ]
+
+
+def test_socket_binary_frames():
+    import struct
+    import server
+    set_state(1.0, 2.0)
+    act("A", 1e9)
+    advance(2)
+    expected = observe()
+    set_state(1.0, 2.0)
+    log_len = len(server.api_log)
+    with client.websocket_connect("/ws") as ws:
+        ws.send_bytes(struct.pack("<Bcd", server.core.OP_ACT, b"A", 1e9))
+        assert ws.receive_bytes() == b""
+        ws.send_bytes(struct.pack("<Bq", server.core.OP_ADVANCE, 2))
+        assert ws.receive_bytes() == b""
+        ws.send_bytes(bytes([server.core.OP_OBSERVE]))
+        assert struct.unpack("<dq", ws.receive_bytes()) == tuple(expected.values())
+    assert server.api_log[log_len]["payload"] == {"action": "A", "value": server.A_MAX}
+
+
+def test_socket_errors_match_rest():
+    import server
+    reset()
+    log_len = len(server.api_log)
+    with client.websocket_connect("/ws") as ws:
+        ws.send_json({"op": "act", "action": "Z", "value": 1.0})
+        assert ws.receive_json() == {"error": 422, "detail": "Unknown action: Z"}
+        ws.send_json({"op": "advance", "steps": 0})
+        assert ws.receive_json() == {"error": 422, "detail": "steps must be >= 1"}
+        ws.send_json({"op": "advance"})
+        assert ws.receive_json()["error"] == 422
+        ws.send_json({"op": "jump"})
+        assert ws.receive_json()["error"] == 422
+        ws.send_text("not json")
+        assert ws.receive_json()["error"] == 422
+        ws.send_bytes(b"\xff")
+        assert ws.receive_json()["error"] == 422
+    assert len(server.api_log) == log_len
+
+
+def test_socket_uses_session():
+    import pytest
+    from starlette.websockets import WebSocketDisconnect
+    h = new_session()
+    with client.websocket_connect("/ws", headers=h) as ws:
+        ws.send_json({"op": "advance", "steps": 4})
+        ws.receive_json()
+    assert client.get("/observe", headers=h).json()["t"] == 4
+    with pytest.raises(WebSocketDisconnect):
+        with client.websocket_connect("/ws", headers={"X-Session": "nope"}):
+            pass
+
+
+# --- Unix socket serving ---
+
+
+def test_serves_on_unix_socket(tmp_path):
+    import os
+    import subprocess
+    import sys
+    import time
+    import httpx
+    path = str(tmp_path / "world.sock")
+    proc = subprocess.Popen(
+        [sys.executable, "server.py", "--uds", path],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env={**os.environ, "WAL_DIR": str(tmp_path)},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        with httpx.Client(transport=httpx.HTTPTransport(uds=path), base_url="http://world") as c:
+            deadline = time.monotonic() + 15
+            while not os.path.exists(path):
+                assert proc.poll() is None and time.monotonic() < deadline
+                time.sleep(0.05)
+            assert c.post("/reset").status_code == 204
+            assert c.post("/advance", json={"steps": 3}).status_code == 204
+            assert c.get("/observe").json()["t"] == 3
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+# --- Concurrency ---
+
+
+def test_concurrent_clients_stay_consistent(monkeypatch):
+    import asyncio
+    import httpx
+    import server
+    monkeypatch.setattr(server.core, "print", lambda *a, **k: None, raising=False)
+    rounds = 30
+
+    async def agent(c, h):
+        t = 0
+        seen = []
+        for i in range(rounds):
+            assert (await c.post("/act", json={"action": "A", "value": 1.0}, headers=h)).status_code == 204
+            assert (await c.post("/advance", json={"steps": 1 + i % 3}, headers=h)).status_code == 204
+            t += 1 + i % 3
+            seen.append((await c.get("/observe", headers=h)).json()["t"])
+            assert seen[-1] == t
+        return seen
+
+    async def dashboard(c, running):
+        seen = []
+        while not running.done():
+            seen.append((await c.get("/observe")).json()["t"])
+            await asyncio.sleep(0)
+        return seen
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+            await c.post("/reset")
+            tokens = [(await c.post("/reset", headers={"X-Session": "new"})).json()["session"] for _ in range(8)]
+            headers = [{}] + [{"X-Session": tok} for tok in tokens]
+            running = asyncio.ensure_future(asyncio.gather(*(agent(c, h) for h in headers)))
+            polled = await dashboard(c, running)
+            return tokens, await running, polled
+
+    log_len = len(server.api_log)
+    tokens, seen, polled = asyncio.run(scenario())
+    # Observers only ever see whole advances, in order.
+    assert polled == sorted(polled)
+    assert set(polled) <= {0, *seen[0]}
+    # Each session's log is exactly its own requests, in request order.
+    expected = ["/reset"] + ["/act", "/advance", "/observe"] * rounds
+    for tok in tokens:
+        assert [e["endpoint"] for e in server.world.sessions[tok].api_log] == expected
+    own = [e["endpoint"] for e in server.api_log[log_len:] if e["endpoint"] != "/observe"]
+    assert own == ["/reset"] + ["/act", "/advance"] * rounds
+
+
+def test_done_writes_trace_since_last_done(tmp_path, monkeypatch):
+    import server
+    monkeypatch.setattr(server.world, "submissions_dir", str(tmp_path))
+    h = new_session()
+    body = {"goal": 1, "agent_id": "a b", "solver": "", "command": "", "report": ""}
+    assert client.post("/done", json=body, headers=h).json() == {"status": "received"}
+    client.get("/observe", headers=h)
+    client.post("/done", json=body, headers=h)
+    server.world.submissions.flush()
+    submission = load_submission(tmp_path / "goal_1_a_b.wsub")
+    assert [e["endpoint"] for e in submission["api_trace"]] == ["/observe"]
+    assert submission["episodes"]["resets"] == []
+    assert submission["episodes"]["done"] == 1
+
+
+# --- Tick log ---
+
+
+def test_advance_writes_every_tick_to_tick_file(tmp_path, monkeypatch):
+    import numpy as np
+    import server
+    monkeypatch.setattr(server.core, "TICK_ECHO", True)
+    server.world.drain_ticks()  # so the file gets only this advance's ticks
+    path = tmp_path / "ticks.bin"
+    with open(path, "wb") as f:
+        monkeypatch.setattr(server.world, "tick_file", f)
+        h = new_session()
+        client.post("/advance", json={"steps": 5}, headers=h)
+        server.world.drain_ticks()
+    records = np.frombuffer(path.read_bytes(), dtype=server.TICK_DTYPE)
+    assert list(records["t"]) == [1, 2, 3, 4, 5]
+    assert set(records["tag"]) == {f"[{h['X-Session'][:8]}] ".encode()}
+    assert server.format_tick(records[0]).split()[:2] == [f"[{h['X-Session'][:8]}]", "t=1"]
+
+
+# --- Submissions ---
+
+
+def load_submission(path):
+    import submissions  # tools/, which importing server puts on sys.path
+    return submissions.load(str(path))
+
+
+# --- Goal audit ---
+
+
+def test_audit_counts_acts_after_final_reset():
+    import server
+    h = new_session()
+    audit = server.world.sessions[h["X-Session"]].audit
+    budget = server.GOALS[1]["act_budget"]
+    for _ in range(budget + 3):  # exploring before the final reset is free
+        client.post("/act", json={"action": "A", "value": 1.0}, headers=h)
+    client.post("/reset", headers=h)
+    for _ in range(budget):
+        client.post("/act", json={"action": "A", "value": 1.0}, headers=h)
+    assert audit.verdict(1)["ok"]
+    client.post("/act", json={"action": "A", "value": 1.0}, headers=h)
+    verdict = audit.verdict(1)
+    assert not verdict["ok"]
+    assert verdict["acts"] == budget + 1
+    assert len(verdict["violations"]) == 1
+
+
+def test_done_attaches_audit(tmp_path, monkeypatch):
+    import server
+    monkeypatch.setattr(server.world, "submissions_dir", str(tmp_path))
+    h = new_session()
+    body = {"goal": 1, "agent_id": "a", "solver": "", "command": "", "report": ""}
+    client.post("/done", json=body, headers=h)
+    server.world.submissions.flush()
+    audit = load_submission(tmp_path / "goal_1_a.wsub")["audit"]
+    assert audit["goal"] == 1 and audit["ok"] and audit["acts"] == 0
+    body["goal"] = 99
+    client.post("/done", json=body, headers=h)
+    server.world.submissions.flush()
+    assert load_submission(tmp_path / "goal_99_a.wsub")["audit"]["violations"] == ["unknown goal 99"]
+
+
+# --- Replay ---
+
+
+def test_replay_reproduces_logged_trajectory():
+    import server
+    start = len(server.api_log)
+    reset()
+    act("A", 3.0)
+    advance(7)
+    observe()
+    batch([{"op": "act", "action": "A", "value": -2.0}, {"op": "advance", "steps": 1000}, {"op": "observe"}])
+    advance(2)
+    observe()
+    trace = server.api_log[start:]
+    assert trace[0]["payload"]["seed"] >= 0
+    assert server.verify(trace) == 3
+    *_, (_, _, replayed) = server.replay(trace)
+    fields = ("x", "v", "t", "pending_a")
+    assert [getattr(replayed, f) for f in fields] == [getattr(server.state, f) for f in fields]
+
+
+def test_replay_stops_inside_advance():
+    import server
+    start = len(server.api_log)
+    reset()
+    act("A", 3.0)
+    advance(10)
+    whole = server.api_log[start:]
+    split = whole[:-1] + [
+        {"endpoint": "/advance", "payload": {"steps": 4}, "time": 0.0},
+        {"endpoint": "/advance", "payload": {"steps": 6}, "time": 0.0},
+    ]
+    at_stop = [server.observation(s) for _, _, s in server.replay(whole, stops=[4]) if s.t == 4]
+    assert at_stop == [server.observation(s) for _, _, s in server.replay(split) if s.t == 4]
+    *_, (_, _, last) = server.replay(whole, stops=[4])
+    assert server.same_observation(observe(), last)
+
+def test_replay_rejects_tampered_observation():
+    import pytest
+    import server
+    start = len(server.api_log)
+    reset()
+    act("A", 3.0)
+    advance(3)
+    observe()
+    trace = server.api_log[start:]
+    trace[-1]["payload"]["x"] += 1e-6
+    with pytest.raises(server.core.ReplayMismatch) as e:
+        server.verify(trace)
+    assert e.value.index == len(trace) - 1
+
+
+def test_replay_allowance_stays_tight_on_long_traces():
+    import pytest
+    import server
+    start = len(server.api_log)
+    reset()
+    act("A", 2.0)
+    advance(10_000_000)
+    observe()
+    trace = server.api_log[start:]
+    assert server.verify(trace) == 1
+    trace[-1]["payload"]["x"] += 1e-6 * max(1.0, abs(trace[-1]["payload"]["x"]))
+    with pytest.raises(server.core.ReplayMismatch):
+        server.verify(trace)
@@ -2,183 +2,173 @@
 
 from __future__ import annotations
 
-import io
-import json
 import math
 import os
-import time
-import zipfile
+import struct
+import sys
 
-from fastapi import FastAPI
-from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
-from pydantic import BaseModel
-import uvicorn
+import numpy as np
 
-app = FastAPI(docs_url=None, redoc_url=None, openapi_url=None)
-
-# --- State ---
-theta: float = 0.0
-omega: float = 0.0
-r: float = 1.0
-x: float = 0.0
-t: int = 0
-pending_a: float | None = None
-pending_b: float | None = None
+_TOOLS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tools")
+if _TOOLS not in sys.path:
+    sys.path.insert(0, _TOOLS)
+import server_core as core  # noqa: E402
 
 A_MIN, A_MAX = -1.0, 1.0
 B_MIN, B_MAX = -2.0, 2.0
 R_MIN, R_MAX = 0.1, 10.0
 
-api_log: list[dict] = []
-_done_log_start: int = 0
-
-
-def _log(endpoint: str, payload=None):
-    api_log.append({"endpoint": endpoint, "payload": payload, "time": time.time()})
-
-
-def _tick():
-    global theta, omega, r, x, t, pending_a, pending_b
-    if pending_a is not None:
-        omega += pending_a
-        pending_a = None
-    if pending_b is not None:
-        r += pending_b
-        r = max(R_MIN, min(R_MAX, r))
-        pending_b = None
-    theta += omega
-    x = r * math.sin(theta)
-    t += 1
-    print(f"  t={t} x={x:.6f} theta={theta:.6f} omega={omega:.6f} r={r:.6f}")
-
+# The goals (agent_briefing.md), in the form core.GoalAuditor documents.
+GOALS = {
+    1: {"type": "action", "act_budget": 50, "per_action": True, "targets": [{"t": 50, "x": 5.0, "tol": 0.2}]},
+    2: {"type": "prediction", "experiment": {"acts": [["A", 0.2]], "t": 30}},
+    3: {
+        "type": "action", "act_budget": 50, "per_action": True,
+        "targets": [{"t": 40, "x": 0.0, "tol": 0.1}, {"t": 50, "x": 3.0, "tol": 0.2}],
+    },
+}
 
-class ActRequest(BaseModel):
-    action: str
-    value: float
+# Endpoint -> (packed payload layout, payload keys), or None for no payload.
+# The key order here also fixes each endpoint's interned code.
+PAYLOADS = {
+    "/reset": None,
+    "/act": (struct.Struct("<cd"), ("action", "value")),
+    "/advance": (struct.Struct("<q"), ("steps",)),
+    "/observe": (struct.Struct("<dq"), ("x", "t")),
+    "/predict": (struct.Struct("<d"), ("x",)),
+}
 
+TICK_DTYPE = np.dtype([("tag", "S11"), ("t", "<i8"), ("x", "<f8"), ("theta", "<f8"), ("omega", "<f8"), ("r", "<f8")])
 
-class AdvanceRequest(BaseModel):
-    steps: int
 
+def format_tick(record) -> str:
+    tag, t, x, theta, omega, r = record.item()
+    return f"  {tag.decode()}t={t} x={x:.6f} theta={theta:.6f} omega={omega:.6f} r={r:.6f}"
 
-class PredictRequest(BaseModel):
-    x: float
 
+# --- State ---
 
-class DoneRequest(BaseModel):
-    goal: int
-    agent_id: str
-    solver: str
-    command: str
-    report: str
 
+class SessionStore(core.SessionStore):
+    COLUMNS = {
+        "theta": 0.0, "omega": 0.0, "r": 1.0, "x": 0.0, "t": 0,
+        "pending_a": 0.0, "pending_b": 0.0, "has_a": False, "has_b": False,
+    }
 
-@app.post("/reset", status_code=204)
-def reset():
-    global theta, omega, r, x, t, pending_a, pending_b
-    theta = 0.0
-    omega = 0.0
-    r = 1.0
-    x = 0.0
-    t = 0
-    pending_a = None
-    pending_b = None
-    _log("/reset")
-    print(f"RESET x={x:.6f}")
+    def _apply_pending(self, live: np.ndarray):
+        a = live[self.has_a[live]]
+        self.omega[a] = self.omega[a] + self.pending_a[a]
+        b = live[self.has_b[live]]
+        self.r[b] = np.clip(self.r[b] + self.pending_b[b], R_MIN, R_MAX)
+        self.has_a[live] = False
+        self.has_b[live] = False
+
+    def step(self, remaining: np.ndarray):
+        """Advance row i by up to remaining[i] ticks, decrementing ``remaining``.
+
+        Once the first tick has consumed the pending actions, omega and r are
+        constant, so step n is theta = theta0 + n * omega in closed form and
+        one call finishes every row. The tick loop adds omega n times instead,
+        so the two agree to about n ulps of |theta| (within 1e-9 for n up to
+        ~1e4 at |omega| <= 10); x inherits that error times r. TICK_ECHO runs
+        the per-tick loop instead, at most core.ADVANCE_CHUNK ticks per call.
+        """
+        live = np.flatnonzero(remaining > 0)
+        if core.TICK_ECHO:
+            for _ in range(min(core.ADVANCE_CHUNK, int(remaining.max(initial=0)))):
+                live = live[remaining[live] > 0]
+                self._apply_pending(live)
+                theta = self.theta[live] + self.omega[live]
+                self.theta[live] = theta
+                self.x[live] = self.r[live] * np.sin(theta)
+                self.t[live] += 1
+                remaining[live] -= 1
+                self._echo(live)
+            return
+        self._apply_pending(live)
+        steps = remaining[live]
+        theta = self.theta[live] + steps * self.omega[live]
+        self.theta[live] = theta
+        self.x[live] = self.r[live] * np.sin(theta)
+        self.t[live] += steps
+        remaining[live] = 0
+        self._echo(live)
+
+
+class State(core.StoreState):
+    """One session's row in the store."""
+
+    __slots__ = ()
+
+    theta = core.Column()
+    omega = core.Column()
+    r = core.Column()
+    x = core.Column()
+    t = core.Column(int)
+    pending_a = core.Pending("has_a")
+    pending_b = core.Pending("has_b")
+
+
+def reset_state(s: State):
+    """Start an episode. The start state is fixed, so /reset logs no seed."""
+    s.theta = 0.0
+    s.omega = 0.0
+    s.r = 1.0
+    s.x = 0.0
+    s.t = 0
+    s.pending_a = None
+    s.pending_b = None
+
+
+def act_error(action: str, value: float) -> str | None:
+    """Why an act is invalid, or None if it is valid."""
+    if action not in ("A", "B"):
+        return f"Unknown action: {action}"
+    if not math.isfinite(value):
+        return "value must be finite"
+    return None
+
+
+def apply_act(s: State, action: str, value: float) -> float:
+    """Clamp ``value`` into the action's range and make it pending; returns it."""
+    if action == "A":
+        clamped = max(A_MIN, min(A_MAX, value))
+        s.pending_a = clamped
+    else:
+        clamped = max(B_MIN, min(B_MAX, value))
+        s.pending_b = clamped
+    return clamped
 
 
-@app.post("/act", status_code=204)
-def act(req: ActRequest):
-    global pending_a, pending_b
-    if req.action not in ("A", "B"):
-        return JSONResponse(status_code=422, content={"detail": f"Unknown action: {req.action}"})
-    if not math.isfinite(req.value):
-        return JSONResponse(status_code=422, content={"detail": "value must be finite"})
-    if req.action == "A":
-        clamped = max(A_MIN, min(A_MAX, req.value))
-        pending_a = clamped
-    else:
-        clamped = max(B_MIN, min(B_MAX, req.value))
-        pending_b = clamped
-    _log("/act", {"action": req.action, "value": clamped})
-    print(f"ACT action={req.action} value={clamped:.6f}")
-
-
-@app.post("/advance", status_code=204)
-def advance(req: AdvanceRequest):
-    if req.steps < 1:
-        return JSONResponse(status_code=422, content={"detail": "steps must be >= 1"})
-    _log("/advance", {"steps": req.steps})
-    for _ in range(req.steps):
-        _tick()
-
-
-@app.get("/observe")
-def observe():
-    _log("/observe")
-    return {"x": round(x, 10), "t": t}
-
-
-@app.post("/predict", status_code=204)
-def predict(req: PredictRequest):
-    _log("/predict", {"x": req.x})
-    print(f"PREDICT x={req.x:.6f}")
-
-
-_world_dir = os.path.dirname(os.path.abspath(__file__))
-_submissions_dir = os.path.join(_world_dir, "submissions")
-
-
-@app.post("/done")
-def done(req: DoneRequest):
-    global _done_log_start
-    os.makedirs(_submissions_dir, exist_ok=True)
-    trace = api_log[_done_log_start:]
-    _done_log_start = len(api_log)
-    submission = {
-        "goal": req.goal,
-        "agent_id": req.agent_id,
-        "solver": req.solver,
-        "command": req.command,
-        "report": req.report,
-        "api_trace": trace,
-        "submitted_at": time.time(),
-    }
-    safe_id = req.agent_id.replace("/", "_").replace(" ", "_")
-    filename = f"goal_{req.goal}_{safe_id}.json"
-    path = os.path.join(_submissions_dir, filename)
-    with open(path, "w") as f:
-        json.dump(submission, f, indent=2)
-    print(f"DONE goal={req.goal} agent={req.agent_id} -> {filename}")
-    return {"status": "received"}
+def observation(s: State) -> dict:
+    return {"x": round(s.x, 10), "t": s.t}
 
 
-_project_root = os.path.dirname(_world_dir)
-_static = os.path.join(_world_dir, "static")
+# --- Replay ---
 
+# The closed form sets theta = theta0 + n * omega, rounding once; the TICK_ECHO
+# tick loop adds omega once per tick, rounding each sum to half an ulp of
+# |theta|. After t ticks the phases differ by at most
+# REPLAY_PHASE * t * |theta|, which x = r sin(theta) passes on times r, on top
+# of REPLAY_TOLERANCE relative to max(1, |x|).
+REPLAY_TOLERANCE = 1e-9
+REPLAY_PHASE = 2.0**-52  # per tick, relative to |theta|
 
-@app.get("/bootstrap")
-def bootstrap():
-    files = {
-        "agent_instructions.md": os.path.join(_project_root, "agent_instructions.md"),
-        "agent_briefing.md": os.path.join(_world_dir, "agent_briefing.md"),
-    }
-    buf = io.BytesIO()
-    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
-        for arcname, path in files.items():
-            zf.write(path, arcname)
-    buf.seek(0)
-    return StreamingResponse(
-        buf,
-        media_type="application/zip",
-        headers={"Content-Disposition": "attachment; filename=bootstrap.zip"},
-    )
 
+def same_observation(logged: dict, s: State) -> bool:
+    replayed = observation(s)
+    if logged["t"] != replayed["t"]:
+        return False
+    allowance = REPLAY_TOLERANCE * max(1.0, abs(logged["x"])) + REPLAY_PHASE * s.t * abs(s.theta) * s.r
+    return abs(logged["x"] - replayed["x"]) <= allowance
 
-@app.get("/")
-def dashboard():
-    return FileResponse(os.path.join(_static, "index.html"))
 
+world = core.StoreWorld(sys.modules[__name__])
+app = world.app
+replay = world.replay
+verify = world.verify
+state = world.default_session.state
+api_log = world.default_session.api_log
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8080)
+    world.main()